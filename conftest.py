@@ -0,0 +1,205 @@
+from collections import Counter
+import datetime
+import json
+import random
+import urllib.parse
+import pytest
+import requests
+import requests.adapters
+import constants
+import pj_cache
+import pj_http
+import pj_mock_server
+from pj_leaderboard_backend import Condition, Entry, Leaderboard
+
+
+class SyntheticOrigin(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter answering like the result hosts from generated sessions of season 5.
+    The dashboard honours the track, condition and date terms of the query and has page_size rows per page,
+    newest first. The hotlap API has no leaderboards, unless it is a MockHotlapServer on 127.0.0.1.
+
+    Attributes:
+        sessions: Host -> session dicts, newest first
+        counts: Requests sent by kind: dashboard, page (session html), json and api
+    """
+    def __init__(self, sessions:int, tracks:list[str], page_size:int = 20, seed:int = 0) -> None:
+        """
+        Initialize a SyntheticOrigin
+
+        Args:
+            sessions: Sessions per host
+            tracks: Raw names of the tracks the sessions are run on, i.e zandvoort
+            page_size: Dashboard rows per page
+            seed: Random seed
+        """
+        super().__init__()
+        self.page_size = page_size
+        self.counts = Counter()
+        rng = random.Random(seed)
+        self.sessions:dict[str, list[dict]] = {}
+        for host in constants.host_list:
+            timestamp = datetime.datetime(2022, 12, 20, tzinfo=datetime.timezone.utc)
+            self.sessions[host] = []
+            for _ in range(sessions):
+                timestamp -= datetime.timedelta(minutes=rng.randint(10, 300))
+                self.add_session(host, timestamp, rng.choice(tracks), wet=int(rng.random() < 0.3), password=rng.random() < 0.7, rng=rng)
+
+    def add_session(self, host:str, timestamp:datetime.datetime, track:str, wet:int, password:bool = True, rng:random.Random = None):
+        """
+        Publish a session on a host
+        """
+        rng = rng or random.Random(timestamp.timestamp())
+        cars = []
+        laps = []
+        for car_id in range(1000, 1000 + rng.randint(1, 8)):
+            drivers = [
+                {"firstName": f"First{d}", "lastName": f"Last{d}", "shortName": f"F{d:02}", "playerId": f"S7656119{d:09}"}
+                for d in rng.sample(range(200), rng.randint(1, 3))
+            ]
+            cars.append({"car": {"carId": car_id, "carModel": rng.choice(list(constants.car_model_dict)), "drivers": drivers}})
+            for _ in range(rng.randint(1, 10)):
+                laptime = rng.randint(90000, 100000)
+                laps.append({"carId": car_id, "driverIndex": rng.randrange(len(drivers)), "laptime": laptime,
+                             "isValidForBest": True, "splits": [laptime//3, laptime//3, laptime - 2*(laptime//3)]})
+        session = {
+            "filename": timestamp.strftime("%y%m%d_%H%M%S") + rng.choice(["_FP", "_Q", "_R"]),
+            "timestamp": timestamp,
+            "track": constants.pretty_name_raw_name[track],
+            "wet": wet,
+            "password": password,
+            "json": json.dumps({"sessionType": "FP", "trackName": track, "sessionResult": {"isWetSession": wet, "leaderBoardLines": cars}, "laps": laps}).encode("utf-8")
+        }
+        self.sessions[host].append(session)
+        self.sessions[host].sort(key=lambda s: s["timestamp"], reverse=True)
+
+    def dashboard(self, host:str, query:dict) -> tuple[int, bytes]:
+        rows = self.sessions[host]
+        for term in query.get("q", [""])[0].split(" +"):
+            term = term.strip("+ ")
+            if term.startswith(("Date:>=", "Date:<=")):
+                date = datetime.datetime.strptime(term.split('"')[1], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+                rows = [row for row in rows if (row["timestamp"] >= date if term.startswith("Date:>=") else row["timestamp"] <= date)]
+            elif term.startswith("sessionResult.isWetSession:"):
+                rows = [row for row in rows if row["wet"] == int(term.split(":")[1])]
+            elif term:
+                rows = [row for row in rows if constants.pretty_name_raw_name.get(row["track"]) == term]
+        page = int(query["page"][0])
+        rows = rows[page*self.page_size:(page + 1)*self.page_size]
+        if not rows:
+            return 404, b"Not found"
+        row_html = "".join(
+            f'<tr class="row-link" data-href="/results/{row["filename"]}">\n'
+            f'    <td>{row["timestamp"].strftime("%a, %d %b %Y %H:%M:%S UTC")}</td>\n'
+            f'    <td>Practice</td>\n'
+            f'    <td>{row["track"]}</td>\n'
+            f'</tr>\n'
+            for row in rows
+        )
+        return 200, f"<html><body><table class='table'><tbody>\n{row_html}</tbody></table></body></html>".encode("utf-8")
+
+    def send(self, request, **kwargs):
+        url = urllib.parse.urlsplit(request.url)
+        if url.hostname == "127.0.0.1":
+            # A local MockHotlapServer
+            return super().send(request, **kwargs)
+        status, content = 404, b"Not found"
+        if url.path.startswith("/api/hotlap/"):
+            self.counts["api"] += 1
+            status, content = 200, b'{"error": "Leaderboard does not exist"}'
+        elif url.path == "/results":
+            self.counts["dashboard"] += 1
+            status, content = self.dashboard(url.hostname, urllib.parse.parse_qs(url.query))
+        elif url.hostname in self.sessions:
+            filename = url.path.split("/")[-1]
+            download = url.path.startswith("/results/download/")
+            self.counts["json" if download else "page"] += 1
+            for session in self.sessions[url.hostname]:
+                if download and (filename == f"{session['filename']}.json"):
+                    status, content = 200, session["json"]
+                elif filename == session["filename"]:
+                    status, content = 200, f"<html>{'Password: sra' if session['password'] else 'Open lobby'}</html>".encode("utf-8")
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        # Streamed reads get the content in slices
+        response._content_consumed = True
+        response.headers["Content-Length"] = str(len(content))
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+
+@pytest.fixture
+def no_caches(monkeypatch):
+    """
+    Turn off the session cache, the verdict index, the validator cache and the crawl marks
+    """
+    monkeypatch.setattr(pj_cache.session_cache, "max_bytes", 0)
+    monkeypatch.setattr(pj_cache.verdict_index, "file_path", "")
+    monkeypatch.setattr(pj_cache.validator_cache, "cache_dir", "")
+    monkeypatch.setattr(pj_cache.crawl_marks, "file_path", "")
+
+@pytest.fixture
+def origin(no_caches):
+    """
+    Factory mounting a SyntheticOrigin on the shared HTTP client. Takes the arguments of SyntheticOrigin
+    """
+    def mount(*args, **kwargs) -> SyntheticOrigin:
+        adapter = SyntheticOrigin(*args, **kwargs)
+        pj_http.client.mount(adapter)
+        return adapter
+    yield mount
+    pj_http.client.mount(None)
+
+@pytest.fixture
+def hotlap_server(monkeypatch):
+    """
+    Factory starting a pj_mock_server.MockHotlapServer as the hotlap API. Takes the arguments of MockHotlapServer.
+    Leaderboards are fetched without the validator cache
+    """
+    monkeypatch.setattr(pj_cache.validator_cache, "cache_dir", "")
+    servers = []
+    def start(**kwargs) -> pj_mock_server.MockHotlapServer:
+        server = pj_mock_server.MockHotlapServer(**kwargs).start()
+        servers.append(server)
+        monkeypatch.setattr(constants, "sra_api_url", server.url)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def synthetic_entries(count:int, seed:int = 0) -> list[Entry]:
+    """
+    Entries with random cars and lap times and unique driver IDs, fastest first
+    """
+    rng = random.Random(seed)
+    car_models = list(constants.car_model_dict)
+    entries = []
+    for i in range(count):
+        best_time = rng.randint(85000, 110000)
+        s1 = best_time//3
+        s2 = best_time//3
+        entries.append(Entry(
+            first_name=f"First{i}",
+            last_name=f"Last{i}",
+            short_name=f"F{i%1000:03}",
+            id=f"S7656119{seed:04}{i:05}",
+            car=f"Car {i%40}",
+            car_raw=rng.choice(car_models),
+            best_time=best_time,
+            s1=s1,
+            s2=s2,
+            s3=best_time-s1-s2,
+            iswet=0
+        ))
+    entries.sort(key=lambda x: x.best_time)
+    return entries
+
+def synthetic_leaderboard(track:str, entries:int, seed:int = 0) -> Leaderboard:
+    """
+    Dry season 5 leaderboard of synthetic_entries
+    """
+    return Leaderboard(entry_list=synthetic_entries(entries, seed=seed), track=track, condition=Condition.DRY, season=5, most_recent_sessions={})
@@ -1,6 +1,4 @@
 from datetime import datetime
-from dateutil import parser
-from dateutil import tz
 from collections import namedtuple
 
 TEST_CHANNEL_ID=920858193624694874
@@ -99,6 +97,70 @@ body
 """
 
 host_list = ["accsm1.simracingalliance.com", "accsm2.simracingalliance.com", "accsm3.simracingalliance.com", "accsm4.simracingalliance.com"]
+# Max concurrent requests per host
+host_max_connections = 4
+# Keep-alive connections pooled per host and number of hosts with a pool (result hosts and the SRA API)
+http_pool_maxsize = 8
+http_pool_hosts = 8
+# Leaderboard updates run at once by the bot and updates allowed to wait behind them.
+# Updates of the same leaderboard never run at once, see pj_scheduler
+update_workers = 4
+update_queue_size = 8
+# Adaptive refresh of the track set. A leaderboard is due once refresh_target_sessions new sessions are expected
+# at its session arrival rate, but no sooner than refresh_min_interval and no later than refresh_max_interval (seconds)
+refresh_tick_seconds = 60
+refresh_min_interval = 5*60
+refresh_max_interval = 12*60*60
+refresh_target_sessions = 1
+# Weight of the latest refresh in the moving averages of the arrival rate and the request cost
+refresh_rate_alpha = 0.3
+# Requests assumed for a leaderboard that was never refreshed
+refresh_default_cost = 20
+# Max HTTP requests of all updates per window (seconds)
+request_budget = 3000
+request_budget_window = 60*60
+# Crawl history of the adaptive refresh. Set to "" to keep it in memory only
+refresh_history_path = "cache/refresh_history.json"
+# Base url of the SRA hotlap API. Point it at a pj_mock_server instance to test without the live API
+sra_api_url = "https://www.simracingalliance.com/api/hotlap"
+# Post only the rows that changed since the leaderboard was fetched, with rank shifts, to {sra_api_url}/update_delta.
+# Off by default: the live API has no delta endpoint yet, pj_mock_server implements one. A refused delta falls back to a full post
+post_delta = False
+# Post the full leaderboard instead when the changed rows and rank shifts exceed this fraction of the rows
+post_delta_max_ratio = 0.5
+# Post the leaderboards of one update together in gzip compressed requests to {sra_api_url}/update_batch, see pj_upload.
+# Off by default: the live API has no batch endpoint yet, pj_mock_server implements one. Without it leaderboards are posted one by one
+post_batch = False
+# Max leaderboards and max uncompressed bytes per batch request
+post_batch_max_items = 16
+post_batch_max_bytes = 16*1024*1024
+post_gzip_level = 6
+# Session download threads per host crawl
+session_workers = 4
+# Worker processes parsing session json, i.e os.cpu_count(). 0 keeps everything in threads
+session_processes = 0
+# Also merge every leaderboard in a worker process when session_processes is set.
+# Off by default: shipping a board to a worker and back costs about as much as merging it with the entry index
+process_merge = False
+# On-disk cache of session result json. Set the size to 0 to disable it
+session_cache_dir = "cache/sessions"
+session_cache_max_bytes = 512*1024*1024
+# NumPy lap engine for sessions with at least columnar_min_laps laps. Ignored if NumPy isn't installed.
+# Off by default: loading the json laps into columns costs more than the single pass of best_laps
+columnar_laps = False
+columnar_min_laps = 2000
+# Stream session json of at least stream_min_bytes instead of decoding it in one go
+stream_session_json = True
+stream_min_bytes = 4*1024*1024
+stream_chunk_size = 64*1024
+# Password filter verdicts of session pages. Set to "" to disable it
+verdict_index_path = "cache/verdicts.jsonl"
+# ETag/Last-Modified of dashboard pages and hotlap API responses for conditional requests. Set to "" to disable them
+validator_cache_dir = "cache/validators"
+# How far the shared dashboard crawl of a track set has seen each leaderboard. Set to "" to disable them
+crawl_marks_path = "cache/crawl_marks.json"
+# A session passes the password filter if its page contains any of these
+password_markers = ["assword: sra", "SRA League race", "entry list"]
 
 session_exclude = {
     "Silverstone": ['220203_033813_FP', '220203_043850_FP', '220207_002120_FP', '220206_194749_FP'],
@@ -212,19 +274,19 @@ discord_track_choices = {
 }
 
 season_start_dates = {
-    1 : parser.isoparse("2022-01-25T00:00:00+0000"),
-    2 : parser.isoparse("2022-03-22T00:00:00+0000"),
-    3 : parser.isoparse("2022-05-31T00:00:00+0000"),
-    4 : parser.isoparse("2022-08-01T00:00:00+0000"),
-    5 : parser.isoparse("2022-11-03T00:00:00+0000")
+    1 : datetime.fromisoformat("2022-01-25T00:00:00+00:00"),
+    2 : datetime.fromisoformat("2022-03-22T00:00:00+00:00"),
+    3 : datetime.fromisoformat("2022-05-31T00:00:00+00:00"),
+    4 : datetime.fromisoformat("2022-08-01T00:00:00+00:00"),
+    5 : datetime.fromisoformat("2022-11-03T00:00:00+00:00")
 }
 
 season_end_dates = {
-    1 : parser.isoparse("2022-03-22T00:00:00+0000"),
-    2 : parser.isoparse("2022-05-31T00:00:00+0000"),
-    3 : parser.isoparse("2022-07-31T00:00:00+0000"),
-    4 : parser.isoparse("2022-11-02T23:59:59+0000"),
-    5 : parser.isoparse("2040-11-03T00:00:00+0000")
+    1 : datetime.fromisoformat("2022-03-22T00:00:00+00:00"),
+    2 : datetime.fromisoformat("2022-05-31T00:00:00+00:00"),
+    3 : datetime.fromisoformat("2022-07-31T00:00:00+00:00"),
+    4 : datetime.fromisoformat("2022-11-02T23:59:59+00:00"),
+    5 : datetime.fromisoformat("2040-11-03T00:00:00+00:00")
 }
 
 season_starting_session_timestamps = {
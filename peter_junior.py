@@ -1,18 +1,18 @@
 import asyncio
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-import functools
 from threading import Thread
 import aiofiles
 import aiofiles.os
 
 from discord import SlashOption
 import constants
-import pj_leaderboard_backend
+import pj_http
+import pj_scheduler
 import keys
 
 import collections
 from datetime import datetime, timezone
 import math
+import traceback
 
 import nextcord
 from nextcord.ext.commands import context
@@ -78,7 +78,43 @@ class LeaderboardCog(commands.Cog):
         self.season = 4
         self.simulate = False
         self.track_set: set[TrackParams] = set()
+        # Every update goes through the scheduler. Updates of a leaderboard never overlap and waiting duplicates are coalesced
+        self.scheduler = pj_scheduler.UpdateScheduler(max_workers=constants.update_workers, max_pending=constants.update_queue_size)
+        # Picks the leaderboards of track_set due for a refresh on every tick of loop_update_leaderboard_multi
+        self.planner = pj_scheduler.RefreshPlanner(
+            constants.refresh_history_path,
+            pj_scheduler.RequestBudget(constants.request_budget, constants.request_budget_window)
+        )
+        self.refresh_tasks:set[asyncio.Task] = set()
         super().__init__()
+
+    def cog_unload(self):
+        self.loop_update_leaderboard.cancel()
+        self.loop_update_leaderboard_multi.cancel()
+        self.scheduler.shutdown()
+
+    async def run_update(self, track_params_list:list[TrackParams], pages:int = None, simulate:bool = False, pw:bool = True):
+        """
+        Queue a leaderboard update with the scheduler and wait for it
+
+        Args:
+            track_params_list: Leaderboards to update
+            pages: Pages override. See pj_leaderboard_backend.main
+            simulate: Simulation mode
+            pw: Password filter
+        Return:
+            Return value of the backend or ErrorCode if the queue is full or the cog is unloaded
+        """
+        future = self.scheduler.submit(track_params_list, pages=pages, simulate=simulate, pw=pw)
+        if future is None:
+            return constants.ErrorCode(2, "Update queue full")
+        try:
+            # Shielded so a cancelled caller doesn't cancel an update other callers joined
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return constants.ErrorCode(3, "Updates stopped")
+            raise
     
     async def set_params(self, track:str, condition:int, season:int):
         self.track = track
@@ -111,43 +147,71 @@ class LeaderboardCog(commands.Cog):
         return True
     
     async def cog_update_leaderboard(self):
-        loop = asyncio.get_event_loop()
-        backend = await loop.run_in_executor(
-            ThreadPoolExecutor(),
-            functools.partial(
-                pj_leaderboard_backend.main,
-                track=self.track,
-                condition=self.condition,
-                season=self.season,
-                pages=None,
-                simulate=self.simulate
-            )
+        backend = await self.run_update(
+            [TrackParams(track=self.track, condition=self.condition, season=self.season)],
+            pages=None,
+            simulate=self.simulate
         )
         return backend
         #pj_leaderboard_backend.main(track=self.track, condition=self.condition, season=self.season, pages=None, simulate=simulate)
     
     async def cog_update_single(self, track_params:TrackParams):
-        loop = asyncio.get_event_loop()
-        backend = await loop.run_in_executor(
-            ThreadPoolExecutor(),
-            functools.partial(
-                pj_leaderboard_backend.main,
-                track=track_params.track,
-                condition=track_params.condition,
-                season=track_params.season,
-                pages=None,
-                simulate=self.simulate
-            )
+        backend = await self.run_update(
+            [track_params],
+            pages=None,
+            simulate=self.simulate
         )
         return backend
 
-    @tasks.loop(hours=3)
+    async def cog_update_multi(self, track_params_list:list[TrackParams]):
+        backend = await self.run_update(
+            track_params_list,
+            pages=None,
+            simulate=self.simulate
+        )
+        return backend
+
+    async def refresh(self, track_params_list:list[TrackParams]):
+        """
+        Update leaderboards picked by the planner and record how many new sessions they had.
+        Requests are counted on the shared client, so updates running at the same time inflate the recorded cost
+        """
+        requests_before = pj_http.client.request_count
+        try:
+            results = await self.cog_update_multi(track_params_list=track_params_list)
+        except asyncio.CancelledError:
+            self.planner.cancel(track_params_list)
+            raise
+        except BaseException:
+            # Back off so a failing host isn't retried every tick
+            self.planner.fail(track_params_list)
+            raise
+        if isinstance(results, constants.ErrorCode):
+            # Queue full or updates stopped. Nothing was sent
+            self.planner.cancel(track_params_list)
+            return results
+        self.planner.record(results, pj_http.client.request_count - requests_before)
+        return results
+
+    @tasks.loop(seconds=constants.refresh_tick_seconds)
     async def loop_update_leaderboard_multi(self):
         if not self.track_set:
             return constants.ErrorCode(1, "Track not set")
-        else:
-            for track in self.track_set:
-                await self.cog_update_single(track_params=track)
+        due = self.planner.due(self.track_set)
+        if due:
+            # Not awaited so a long refresh of a dormant track doesn't hold up the next tick
+            task = asyncio.create_task(self.refresh(due))
+            self.refresh_tasks.add(task)
+            task.add_done_callback(self.refresh_done)
+
+    def refresh_done(self, task:asyncio.Task):
+        self.refresh_tasks.discard(task)
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is not None:
+            print("Refresh failed:", flush=True)
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
 
     @tasks.loop(hours=3)
     async def loop_update_leaderboard(self):
@@ -223,19 +287,22 @@ async def updateldb_single(
             print("Timed out...")
         elif view.value:
             print("Confirmed...")
-            loop = asyncio.get_event_loop()
-            backend = loop.run_in_executor(
-                ThreadPoolExecutor(), 
-                functools.partial(
-                    pj_leaderboard_backend.main, 
-                    track=track, 
-                    condition=condition, 
-                    season=season, 
-                    pages=pages if pages else None, 
-                    pw=password,
-                    simulate=simulate
-                )
+            leaderboard:LeaderboardCog = bot.get_cog('LeaderboardCog')
+            if leaderboard is None:
+                await interaction.channel.send("bot.get_cog('LeaderboardCog') returned None. Yell at Peter to troubleshoot")
+                return
+            queue_depth = leaderboard.scheduler.queue_depth()
+            if queue_depth:
+                await interaction.channel.send(f"Queued behind {queue_depth} update(s)")
+            backend = await leaderboard.run_update(
+                [TrackParams(track=track, condition=condition, season=season)],
+                pages=pages if pages else None,
+                pw=password,
+                simulate=simulate
             )
+            if isinstance(backend, constants.ErrorCode):
+                await interaction.channel.send(f"Not updated: {backend.message}")
+                return backend
             await interaction.channel.send(f"Updated ")
             return backend
         else:
@@ -502,8 +569,18 @@ async def get_loop_status(interaction:nextcord.Interaction):
         embed.add_field(name="Current season", value=current_params.season, inline=True)
         embed.add_field(name="Simulation mode", value=leaderboard.simulate, inline=True)
         embed.add_field(name="Current iteration", value=leaderboard.loop_update_leaderboard.current_loop, inline=True)
+        running, waiting = leaderboard.scheduler.status()
+        embed.add_field(name="Running updates", value="\n".join(running) if running else "None", inline=False)
+        embed.add_field(name="Queue depth", value=len(waiting), inline=True)
+        embed.add_field(name="Coalesced updates", value=leaderboard.scheduler.coalesced, inline=True)
         if current_params.track_set:
             embed.add_field(name="Track set", value=','.join([t.__str__() for t in current_params.track_set]), inline=False)
+            refresh_lines = []
+            for track_params in sorted(current_params.track_set):
+                rate = leaderboard.planner.rate(track_params)
+                rate_str = f"{rate:.1f} sessions/h" if rate is not None else "rate unknown"
+                refresh_lines.append(f"{track_params}: {rate_str}, next <t:{int(leaderboard.planner.next_refresh(track_params))}:R>")
+            embed.add_field(name="Refresh schedule", value="\n".join(refresh_lines), inline=False)
         next_it = leaderboard.loop_update_leaderboard_multi.next_iteration
         next_it_timestamp = 0.0
         if next_it:
@@ -0,0 +1,963 @@
+import argparse
+import array
+import contextlib
+import csv
+import datetime
+import http.server
+import io
+import json
+import os
+from os import path
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import dateutil.parser
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import requests.adapters
+import pj_columnar
+import pj_http
+import pj_leaderboard_backend
+import pj_mock_server
+import pj_replay
+import pj_scheduler
+from pj_leaderboard_backend import Entry, Leaderboard, Session
+
+
+def timed(func, repeat:int = 3) -> float:
+    """
+    Run func repeat times and return the best wall time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+def synthetic_entries(count:int, seed:int = 0, id_pool:int = None) -> list[Entry]:
+    """
+    Generate entries with random drivers, cars and lap times
+
+    Args:
+        count: Number of entries
+        seed: Random seed
+        id_pool: Number of distinct driver IDs. Defaults to count
+    """
+    rng = random.Random(seed)
+    car_models = list(pj_leaderboard_backend.constants.car_model_dict)
+    id_pool = id_pool or count
+    entries = []
+    for i in range(count):
+        best_time = rng.randint(85000, 110000)
+        s1 = best_time//3
+        s2 = best_time//3
+        entries.append(Entry(
+            first_name=f"First{i}",
+            last_name=f"Last{i}",
+            short_name=f"F{i%1000:03}",
+            id=f"S7656119{rng.randrange(id_pool):09}",
+            car=f"Car {i%40}",
+            car_raw=rng.choice(car_models),
+            best_time=best_time,
+            s1=s1,
+            s2=s2,
+            s3=best_time-s1-s2,
+            iswet=0
+        ))
+    return entries
+
+def copy_entries(entries:list[Entry]) -> list[Entry]:
+    return [
+        Entry(
+            first_name=e.first_name, last_name=e.last_name, short_name=e.short_name, id=e.id, car=e.car, car_raw=e.car_raw,
+            best_time=e.best_time, s1=e.s1, s2=e.s2, s3=e.s3, iswet=e.iswet
+        )
+        for e in entries
+    ]
+
+def merge_session_linear(leaderboard:Leaderboard, session:Session):
+    """
+    Merge as done before the entry index. Kept as the reference for bench_merge
+    """
+    if not leaderboard.entry_list:
+        leaderboard.entry_list = session.results
+        return
+    for session_entry in session.results:
+        found_flag = False
+        for leaderboard_entry in leaderboard.entry_list:
+            if ( (leaderboard_entry.id == session_entry.id) and (leaderboard_entry.car_raw == session_entry.car_raw) ):
+                found_flag = True
+                if (leaderboard_entry.best_time > session_entry.best_time):
+                    leaderboard_entry.best_time = session_entry.best_time
+                    leaderboard_entry.s1 = session_entry.s1
+                    leaderboard_entry.s2 = session_entry.s2
+                    leaderboard_entry.s3 = session_entry.s3
+        if not found_flag:
+            leaderboard.entry_list.append(session_entry)
+
+def bench_merge(args):
+    """
+    Merge sessions into a synthetic board with the linear scan and with the entry index
+    """
+    board_entries = synthetic_entries(args.entries, seed=1)
+    sessions = []
+    for i in range(args.sessions):
+        session = Session("bench", f"session{i}")
+        # Mix of drivers already on the board and new ones
+        session.results = synthetic_entries(args.session_size, seed=100+i, id_pool=args.entries*2)
+        sessions.append(session)
+
+    def run(merge):
+        # Merging mutates entries, so every run starts from fresh copies
+        leaderboard = Leaderboard(track="Zandvoort", entry_list=copy_entries(board_entries))
+        for session in sessions:
+            session_copy = Session("bench", session.filename)
+            session_copy.results = copy_entries(session.results)
+            merge(leaderboard, session_copy)
+        return leaderboard
+
+    linear = run(merge_session_linear)
+    indexed = run(Leaderboard.merge_session)
+    key = lambda e: (e.id, e.car_raw, e.best_time)
+    assert sorted(map(key, linear.entry_list)) == sorted(map(key, indexed.entry_list)), "Merge results differ"
+
+    linear_time = timed(lambda: run(merge_session_linear), args.repeat)
+    indexed_time = timed(lambda: run(Leaderboard.merge_session), args.repeat)
+    print(f"Board: {args.entries} entries, {args.sessions} sessions of {args.session_size} entries")
+    print(f"Linear scan: {linear_time*1000:.1f} ms")
+    print(f"Entry index: {indexed_time*1000:.1f} ms")
+    print(f"Speedup: {linear_time/indexed_time:.1f}x")
+
+def synthetic_laps(cars:int, laps_per_car:int, drivers_per_car:int = 3, seed:int = 0) -> list[dict]:
+    """
+    Generate the laps array of a long multi-driver session
+    """
+    rng = random.Random(seed)
+    laps = []
+    for _ in range(laps_per_car):
+        for car_id in range(cars):
+            laptime = rng.randint(100000, 130000)
+            s1 = rng.randint(30000, 40000)
+            s2 = rng.randint(30000, 40000)
+            laps.append({
+                "carId": 1000+car_id,
+                "driverIndex": rng.randrange(drivers_per_car),
+                "laptime": laptime,
+                "isValidForBest": rng.random() < 0.85,
+                "splits": [s1, s2, laptime-s1-s2]
+            })
+    return laps
+
+def bench_laps(args):
+    """
+    Best lap extraction of a long session with the Python single pass and the NumPy lap engine
+    """
+    if not pj_columnar.available():
+        print("NumPy is not installed")
+        return
+    laps = synthetic_laps(args.cars, args.laps_per_car)
+    assert pj_leaderboard_backend.best_laps(laps) == pj_columnar.best_laps(pj_columnar.LapColumns(laps)), "Best laps differ"
+    columns = pj_columnar.LapColumns(laps)
+
+    python_time = timed(lambda: pj_leaderboard_backend.best_laps(laps), args.repeat)
+    load_time = timed(lambda: pj_columnar.LapColumns(laps), args.repeat)
+    columnar_time = timed(lambda: pj_columnar.best_laps(columns), args.repeat)
+    print(f"Session: {args.cars} cars, {len(laps)} laps")
+    print(f"Python best laps: {python_time*1000:.1f} ms")
+    print(f"NumPy load: {load_time*1000:.1f} ms")
+    print(f"NumPy best laps: {columnar_time*1000:.1f} ms")
+    print(f"Speedup incl. load: {python_time/(load_time+columnar_time):.1f}x, on loaded columns: {python_time/columnar_time:.1f}x")
+
+def synthetic_session_json(cars:int, laps_per_car:int, drivers_per_car:int = 3) -> bytes:
+    """
+    Generate a pretty printed session result json like the ones served by the result hosts
+    """
+    leaderboard_lines = []
+    for car_id in range(cars):
+        drivers = [
+            {"firstName": f"First{car_id}_{i}", "lastName": f"Last{car_id}_{i}", "shortName": "FL", "playerId": f"S76561198{car_id:04}{i:04}"}
+            for i in range(drivers_per_car)
+        ]
+        leaderboard_lines.append({"car": {"carId": 1000+car_id, "carModel": 30, "drivers": drivers}})
+    session_json_data = {
+        "sessionType": "R",
+        "trackName": "spa",
+        "sessionResult": {"isWetSession": 0, "leaderBoardLines": leaderboard_lines},
+        "laps": synthetic_laps(cars, laps_per_car, drivers_per_car),
+        "penalties": []
+    }
+    return json.dumps(session_json_data, indent=4).encode("utf-8")
+
+def peak_memory(func) -> int:
+    """
+    Peak bytes allocated by Python while running func
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_stream(args):
+    """
+    Peak memory and time of decoding a long session json in one go and streaming it
+    """
+    session_json_raw = synthetic_session_json(args.cars, args.laps_per_car)
+    chunk_size = pj_leaderboard_backend.constants.stream_chunk_size
+    chunks = lambda: (session_json_raw[i:i+chunk_size] for i in range(0, len(session_json_raw), chunk_size))
+
+    def read_json():
+        Session("bench", "bench").read_json(session_json_raw)
+    def read_stream():
+        Session("bench", "bench").read_stream(chunks())
+
+    print(f"Session json: {len(session_json_raw)/1024/1024:.1f} MiB, {args.cars} cars, {args.cars*args.laps_per_car} laps")
+    print(f"json.loads: peak {peak_memory(read_json)/1024/1024:.1f} MiB, {timed(read_json, args.repeat)*1000:.0f} ms")
+    print(f"Streaming: peak {peak_memory(read_stream)/1024/1024:.1f} MiB, {timed(read_stream, args.repeat)*1000:.0f} ms")
+
+class DictEntry:
+    """
+    Entry as it was before __slots__. Reference for bench_memory
+    """
+    def __init__(self, first_name, last_name, short_name, id, car, car_raw, best_time, s1, s2, s3, iswet) -> None:
+        self.first_name = first_name
+        self.last_name = last_name
+        self.short_name = short_name
+        self.id = id
+        self.car = car
+        self.car_raw = car_raw
+        self.best_time = best_time
+        self.s1 = s1
+        self.s2 = s2
+        self.s3 = s3
+        self.iswet = iswet
+
+def bench_memory(args):
+    """
+    Memory of a season worth of entries as plain objects, slotted Entries and columns of typed arrays and interned strings
+    """
+    rng = random.Random(0)
+    car_models = list(pj_leaderboard_backend.constants.car_model_dict.items())
+    rows = []
+    for _ in range(args.entries):
+        driver = rng.randrange(args.drivers)
+        car_raw, car = rng.choice(car_models)
+        best_time = rng.randint(85000, 130000)
+        rows.append((driver, car, car_raw, best_time))
+
+    def fields(row):
+        # Fresh strings for every entry, like the ones decoded from json or csv
+        driver, car, car_raw, best_time = row
+        s1 = best_time//3
+        return (f"First{driver}", f"Last{driver}", f"F{driver%1000:03}", f"S76561198{driver:08}", "".join(car), car_raw, best_time, s1, s1, best_time-2*s1, 0)
+
+    def build_dict():
+        return [DictEntry(*fields(row)) for row in rows]
+    def build_slots():
+        return [Entry(*fields(row)) for row in rows]
+    def build_columns():
+        strs = [[] for _ in range(5)]
+        ints = [array.array('q') for _ in range(6)]
+        for row in rows:
+            values = fields(row)
+            for column, value in zip(strs, values[:5]):
+                column.append(sys.intern(value))
+            for column, value in zip(ints, values[5:]):
+                column.append(value)
+        return strs, ints
+
+    print(f"{args.entries} entries, {args.drivers} drivers")
+    for label, build in (("Plain objects", build_dict), ("Slotted Entry", build_slots), ("Columns", build_columns)):
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del built
+        print(f"{label}: {size/1024/1024:.1f} MiB ({size/args.entries:.0f} bytes/entry)")
+
+
+def read_leaderboard_strptime(track:str, file_path:str) -> Leaderboard:
+    """
+    Leaderboard.read_leaderboard as it was before load_leaderboard_csv. Kept as the reference for bench_csv
+    """
+    entry_list = []
+    last_updated_str = ""
+    most_recent_sessions = {}
+    with open(file_path, "r", encoding='utf-8') as csv_file:
+        line_count = 0
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        for row in csv_reader:
+            if line_count == 0:
+                line_count += 1
+                continue
+            else:
+                if ("Last updated" in row[0]):
+                    last_updated_str = row[0].split("?")[1]
+                    line_count += 1
+                    continue
+                elif ("?MR?" in row[0]):
+                    most_recent_sessions[row[1]] = row[2]
+                    continue
+                best_time = datetime.datetime.strptime(row[7], "%M:%S.%f")
+                s1 = datetime.datetime.strptime(row[8], "%M:%S.%f")
+                s2 = datetime.datetime.strptime(row[9], "%M:%S.%f")
+                s3 = datetime.datetime.strptime(row[10], "%M:%S.%f")
+                entry_list.append(Entry(
+                    first_name=row[1],
+                    last_name=row[2],
+                    short_name=row[3],
+                    id=row[4],
+                    car=row[5],
+                    car_raw=int(row[6]),
+                    best_time=pj_leaderboard_backend.datetime_to_ms(best_time),
+                    s1=pj_leaderboard_backend.datetime_to_ms(s1),
+                    s2=pj_leaderboard_backend.datetime_to_ms(s2),
+                    s3=pj_leaderboard_backend.datetime_to_ms(s3),
+                    iswet=int(row[11])
+                ))
+            line_count += 1
+    last_updated = dateutil.parser.parse(last_updated_str)
+    return Leaderboard(track=track, file_path=file_path, entry_list=entry_list, last_updated=last_updated, most_recent_sessions=most_recent_sessions)
+
+def bench_csv(args):
+    """
+    Loading a large leaderboard csv with the strptime loader and with load_leaderboard_csv
+    """
+    leaderboard = Leaderboard(
+        track="Zandvoort",
+        entry_list=synthetic_entries(args.entries),
+        last_updated=datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0),
+        most_recent_sessions={host: "2022-11-03T00:00:00+0000" for host in pj_leaderboard_backend.constants.host_list}
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "bench.csv")
+        leaderboard.write_leaderboard(file_path)
+
+        reference = read_leaderboard_strptime("Zandvoort", file_path)
+        loaded = Leaderboard.read_leaderboard("Zandvoort", file_path)
+        assert str(reference) == str(loaded), "Loaded leaderboards differ"
+        assert reference.last_updated == loaded.last_updated, "Last updated times differ"
+        assert reference.most_recent_sessions == loaded.most_recent_sessions, "Most recent sessions differ"
+
+        strptime_time = timed(lambda: read_leaderboard_strptime("Zandvoort", file_path), args.repeat)
+        fast_time = timed(lambda: Leaderboard.read_leaderboard("Zandvoort", file_path), args.repeat)
+        print(f"Leaderboard csv: {args.entries} rows, {os.path.getsize(file_path)/1024/1024:.1f} MiB")
+    print(f"strptime loader: {strptime_time*1000:.1f} ms")
+    print(f"load_leaderboard_csv: {fast_time*1000:.1f} ms")
+    print(f"Speedup: {strptime_time/fast_time:.1f}x")
+
+def import_times(module:str) -> list[tuple[int, int, str]]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Return:
+        (cumulative us, nesting level, module name) of every import, in the order they finished
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if (not line.startswith("import time:")) or ("cumulative" in line):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative), (len(name) - len(name.lstrip()) - 1)//2, name.strip()))
+    return times
+
+def bench_startup(args):
+    """
+    Import time of a module and of its slowest direct imports, as reported by python -X importtime
+    """
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[-1][0])
+    print(f"{args.module}: {best[-1][0]/1000:.1f} ms (best of {args.repeat})")
+    # Imports of the module itself come after the previous top level import, i.e site
+    start = max((i for i, t in enumerate(best[:-1]) if t[1] == 0), default=-1) + 1
+    direct = sorted((t for t in best[start:-1] if t[1] == 1), reverse=True)
+    for cumulative, _, name in direct[:args.top]:
+        print(f"  {name}: {cumulative/1000:.1f} ms")
+
+class CountingHTTPServer(http.server.ThreadingHTTPServer):
+    """
+    Local keep-alive server returning a fixed body. Counts the connections it accepts
+    """
+    daemon_threads = True
+
+    def __init__(self, body:bytes) -> None:
+        self.body = body
+        self.connections = 0
+        self._lock = threading.Lock()
+        server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, which stalls on delayed ACKs with keep-alive
+            disable_nagle_algorithm = True
+            def setup(self):
+                with server._lock:
+                    server.connections += 1
+                super().setup()
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+            def log_message(self, format, *args):
+                pass
+        super().__init__(("127.0.0.1", 0), Handler)
+
+def bench_http(args):
+    """
+    Requests to a local server with a new connection per request and with the pooled client
+    """
+    server = CountingHTTPServer(b"x"*args.body_size)
+    scheme = "http"
+    verify = True
+    if args.tls_cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.tls_cert, args.tls_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+        verify = args.tls_cert
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"{scheme}://localhost:{server.server_port}/results"
+
+    def run(get):
+        server.connections = 0
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for response in executor.map(lambda _: get(url, verify=verify), range(args.requests)):
+                assert len(response.content) == args.body_size
+        return server.connections
+
+    def pooled():
+        client = pj_http.HttpClient(pj_http.constants.host_max_connections, pj_http.constants.http_pool_maxsize, pj_http.constants.http_pool_hosts)
+        connections = run(client.get)
+        client.close()
+        return connections
+
+    print(f"{args.requests} {scheme.upper()} requests, {args.threads} threads, {args.body_size} byte body")
+    for label, func in (("requests.get", lambda: run(requests.get)), ("pj_http", pooled)):
+        connections = func()
+        elapsed = timed(func, args.repeat)
+        print(f"{label}: {elapsed*1000:.0f} ms, {connections} connections")
+    server.shutdown()
+
+def synthetic_dashboard_html(rows:int, seed:int = 0) -> str:
+    """
+    Generate a results dashboard page laid out like the ones served by the result hosts
+    """
+    rng = random.Random(seed)
+    timestamp = datetime.datetime(2022, 12, 1, tzinfo=datetime.timezone.utc)
+    row_html = []
+    for _ in range(rows):
+        timestamp -= datetime.timedelta(minutes=rng.randint(10, 300))
+        filename = timestamp.strftime("%y%m%d_%H%M%S") + rng.choice(["_FP", "_Q", "_R"])
+        row_html.append(
+            f'<tr class="row-link" data-href="/results/{filename}">\n'
+            f'    <td>{timestamp.strftime("%a, %d %b %Y %H:%M:%S UTC")}</td>\n'
+            f'    <td>{rng.choice(["Practice", "Qualifying", "Race"])}</td>\n'
+            f'    <td>{rng.choice(list(pj_leaderboard_backend.constants.pretty_name_raw_name.values()))}</td>\n'
+            f'    <td><a href="/results/download/{filename}.json" class="btn btn-sm">JSON</a></td>\n'
+            f'</tr>\n'
+        )
+    head = "<head>" + "".join(f'<link rel="stylesheet" href="/static/css/{i}.css">' for i in range(8)) + "<script>" + "var x = 1;"*500 + "</script></head>"
+    nav = "<nav class='navbar'>" + "".join(f"<a class='nav-link' href='/page{i}'>Page {i}</a>" for i in range(30)) + "</nav>"
+    table = (
+        "<table class='table table-striped'><thead><tr><th>Date</th><th>Type</th><th>Track</th><th></th></tr></thead><tbody>\n"
+        + "".join(row_html) + "</tbody></table>"
+    )
+    pagination = "<ul class='pagination'>" + "".join(f"<li class='page-item'><a href='?page={i}'>{i}</a></li>" for i in range(10)) + "</ul>"
+    return f"<!DOCTYPE html><html>{head}<body>{nav}<div class='container'>{table}{pagination}</div></body></html>"
+
+def bench_dashboard(args):
+    """
+    Row extraction of dashboard pages with bs4 and with the row tokenizer
+    """
+    if args.fixtures:
+        pages = []
+        for fixture in args.fixtures:
+            with open(fixture, "r", encoding="utf-8") as file:
+                pages.append(file.read())
+    else:
+        pages = [synthetic_dashboard_html(args.rows, seed=i) for i in range(args.pages)]
+    for page in pages:
+        assert pj_leaderboard_backend.parse_dashboard_rows(page) == pj_leaderboard_backend.parse_dashboard_rows_bs4(page), "Rows differ"
+
+    bs4_time = timed(lambda: [pj_leaderboard_backend.parse_dashboard_rows_bs4(page) for page in pages], args.repeat)
+    fast_time = timed(lambda: [pj_leaderboard_backend.parse_dashboard_rows(page) for page in pages], args.repeat)
+    print(f"{len(pages)} pages, {sum(map(len, pages))/len(pages)/1024:.0f} KiB each")
+    print(f"bs4 html.parser: {bs4_time*1000/len(pages):.2f} ms/page")
+    print(f"Row tokenizer: {fast_time*1000/len(pages):.2f} ms/page")
+    print(f"Speedup: {bs4_time/fast_time:.1f}x")
+
+def bench_process(args):
+    """
+    Session parsing and leaderboard merging of a track-set refresh in threads and in a process pool
+    """
+    session_jsons = [synthetic_session_json(args.cars, args.laps_per_car) for _ in range(args.sessions)]
+    boards = [synthetic_entries(args.entries, seed=i) for i in range(args.boards)]
+
+    def parse_threads():
+        with ThreadPoolExecutor(max_workers=args.processes) as executor:
+            return list(executor.map(lambda raw: Session("bench", "bench").read_json(raw), session_jsons))
+    def parse_processes(process_pool):
+        def read(raw):
+            session = Session("bench", "bench", process_pool=process_pool)
+            session.read_process(session_json_raw=raw)
+        with ThreadPoolExecutor(max_workers=args.processes) as executor:
+            return list(executor.map(read, session_jsons))
+
+    sessions = []
+    for session_json_raw in session_jsons:
+        session = Session("bench", "bench")
+        session.read_json(session_json_raw)
+        sessions.append(session)
+    def merge_threads():
+        for entries in boards:
+            leaderboard = Leaderboard(track="Spa", entry_list=copy_entries(entries))
+            for session in sessions:
+                leaderboard.merge_session(session)
+            leaderboard.entry_list.sort(key=lambda x: x.best_time)
+    def merge_processes(process_pool):
+        merges = [([session.pack_results() for session in sessions], True)]
+        futures = [process_pool.submit(pj_leaderboard_backend.merge_process, "Spa", pj_leaderboard_backend.pack_entries(entries), merges) for entries in boards]
+        for future in futures:
+            pj_leaderboard_backend.unpack_entries(future.result())
+
+    print(f"{os.cpu_count()} CPUs, {args.processes} threads/processes")
+    print(f"{args.sessions} sessions of {len(session_jsons[0])/1024:.0f} KiB, {args.boards} leaderboards of {args.entries} entries")
+    process_pool = pj_leaderboard_backend.start_process_pool(args.processes)
+    try:
+        parse_thread_time = timed(parse_threads, args.repeat)
+        parse_process_time = timed(lambda: parse_processes(process_pool), args.repeat)
+        merge_thread_time = timed(merge_threads, args.repeat)
+        merge_process_time = timed(lambda: merge_processes(process_pool), args.repeat)
+    finally:
+        process_pool.shutdown()
+    print(f"Parse, threads: {parse_thread_time*1000:.0f} ms, processes: {parse_process_time*1000:.0f} ms ({parse_thread_time/parse_process_time:.2f}x)")
+    print(f"Merge, threads: {merge_thread_time*1000:.0f} ms, processes: {merge_process_time*1000:.0f} ms ({merge_thread_time/merge_process_time:.2f}x)")
+
+def bench_scheduler(args):
+    """
+    Crawls run for a burst of overlapping update requests with and without the scheduler.
+    Updates are simulated by sleeping, so only the scheduling is measured
+    """
+    rng = random.Random(0)
+    tracks = [(track, condition, 5) for track in list(pj_leaderboard_backend.constants.pretty_name_raw_name)[:args.tracks] for condition in (0, 1)]
+    requests_list = []
+    for _ in range(args.requests):
+        if rng.random() < 0.2:
+            requests_list.append(tracks)
+        else:
+            requests_list.append([rng.choice(tracks)])
+    crawls = 0
+    crawls_lock = threading.Lock()
+    def runner(track_params, **options):
+        nonlocal crawls
+        with crawls_lock:
+            crawls += len(track_params)
+        time.sleep(args.update_ms/1000)
+        return 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(lambda track_params: runner(track_params), requests_list))
+    direct_time = time.perf_counter() - start
+    direct_crawls = crawls
+
+    crawls = 0
+    scheduler = pj_scheduler.UpdateScheduler(max_workers=args.workers, max_pending=len(requests_list), runner=runner)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        futures = set(scheduler.submit(track_params) for track_params in requests_list)
+        for future in futures:
+            future.result()
+    scheduler_time = time.perf_counter() - start
+    scheduler.shutdown()
+    print(f"{len(requests_list)} update requests over {len(tracks)} leaderboards, {args.workers} workers")
+    print(f"Direct: {direct_crawls} leaderboard crawls, {direct_time:.2f} s (same leaderboard crawled concurrently)")
+    print(f"Scheduler: {crawls} leaderboard crawls, {scheduler_time:.2f} s, {scheduler.coalesced} requests coalesced")
+
+def bench_refresh(args):
+    """
+    Simulated days of a track set with one busy leaderboard, refreshed by the fixed 3 hour loop and by the RefreshPlanner.
+    Sessions arrive as Poisson processes and a refresh costs a fixed number of requests plus one per new session
+    """
+    rng = random.Random(0)
+    track_set = [(track, 0, 5) for track in list(pj_leaderboard_backend.constants.pretty_name_raw_name)[:args.tracks]]
+    rates = {track_params: (args.hot_rate if i == 0 else args.idle_rate) for i, track_params in enumerate(track_set)}
+    day = args.days*24*3600
+    arrivals = {}
+    for track_params, rate in rates.items():
+        times = []
+        t = rng.expovariate(rate/3600)
+        while t < day:
+            times.append(t)
+            t += rng.expovariate(rate/3600)
+        arrivals[track_params] = times
+
+    def simulate(pick):
+        requests_sent = 0
+        track_requests = {track_params: 0 for track_params in track_set}
+        pending = {track_params: list(times) for track_params, times in arrivals.items()}
+        delays = {track_params: [] for track_params in track_set}
+        for now in range(0, day, args.tick):
+            picked = pick(now, lambda: requests_sent)
+            if not picked:
+                continue
+            results = []
+            for track_params in picked:
+                new = [t for t in pending[track_params] if t <= now]
+                pending[track_params] = pending[track_params][len(new):]
+                delays[track_params] += [now - t for t in new]
+                results.append(pj_leaderboard_backend.UpdateResult(track_params=track_params, new_sessions=len(new), published=True))
+            for result in results:
+                track_requests[result.track_params] += args.refresh_cost + result.new_sessions
+            cost = sum(args.refresh_cost + result.new_sessions for result in results)
+            requests_sent += cost
+            pick.record(results, cost, now) if hasattr(pick, "record") else None
+        return track_requests, delays
+
+    def fixed(now, counter):
+        return track_set if now % (3*3600) == 0 else []
+
+    counter_box = [lambda: 0]
+    planner = pj_scheduler.RefreshPlanner("", pj_scheduler.RequestBudget(args.budget, 3600, counter=lambda: counter_box[0]()))
+    def adaptive(now, counter):
+        counter_box[0] = counter
+        with contextlib.redirect_stdout(io.StringIO()):
+            return planner.due(track_set, now=now)
+    adaptive.record = lambda results, cost, now: planner.record(results, cost, now=now)
+
+    hot = track_set[0]
+    print(f"{args.days} days, 1 leaderboard at {args.hot_rate} sessions/h, {len(track_set)-1} at {args.idle_rate} sessions/h")
+    for name, pick in (("Fixed 3 h loop", fixed), ("Adaptive", adaptive)):
+        track_requests, delays = simulate(pick)
+        hot_delay = sum(delays[hot])/max(len(delays[hot]), 1)/60
+        idle_delays = [delay for track_params in track_set[1:] for delay in delays[track_params]]
+        idle_delay = sum(idle_delays)/max(len(idle_delays), 1)/3600
+        idle_requests = sum(track_requests.values()) - track_requests[hot]
+        print(f"{name}: busy track {track_requests[hot]/args.days:.0f} requests/day, mean delay {hot_delay:.1f} min. "
+              f"Idle tracks {idle_requests/args.days:.0f} requests/day, mean delay {idle_delay:.1f} h")
+
+def bench_post(args):
+    """
+    Bytes and time of a post cycle of a large leaderboard with a few improved drivers,
+    posting the full leaderboard and posting a delta, against a local pj_mock_server
+    """
+    server = pj_mock_server.MockHotlapServer().start()
+    constants = pj_leaderboard_backend.constants
+    constants.sra_api_url = server.url
+    entries = synthetic_entries(args.entries)
+    for i, entry in enumerate(entries):
+        entry.id = f"S7656119{i:09}"
+    seed_board = Leaderboard(entry_list=entries, track="Zandvoort", condition=pj_leaderboard_backend.Condition.DRY, season=5, most_recent_sessions={})
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert seed_board.post_leaderboard().ok
+
+    def cycle(delta:bool, seed:int):
+        constants.post_delta = delta
+        with contextlib.redirect_stdout(io.StringIO()):
+            leaderboard = Leaderboard.get_leaderboard(5, "Zandvoort", pj_leaderboard_backend.Condition.DRY)
+        rng = random.Random(seed)
+        for entry in rng.sample(leaderboard.entry_list, args.changed):
+            entry.best_time -= rng.randint(1, 2000)
+        leaderboard.entry_list.extend(synthetic_entries(args.new, seed=seed))
+        for i, entry in enumerate(leaderboard.entry_list[-args.new:] if args.new else []):
+            entry.id = f"S7656120{seed:04}{i:05}"
+        start = time.perf_counter()
+        js = leaderboard.to_post_json()
+        json.dumps(leaderboard.to_post_delta_json(js) if delta else js)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            r = leaderboard.post_leaderboard()
+        elapsed = time.perf_counter() - start
+        assert r.ok
+        return build, elapsed, server.posts[-1]
+
+    print(f"{args.entries} entries, {args.changed} improved and {args.new} new per cycle")
+    for name, delta in (("Full post", False), ("Delta post", True)):
+        best_build, best = None, None
+        for seed in range(args.repeat):
+            build, elapsed, post = cycle(delta, seed + (1000 if delta else 0))
+            best_build = build if best_build is None else min(best_build, build)
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name}: {post.size/1024:.1f} KiB to {post.path}. Payload built in {best_build*1000:.1f} ms, posted and applied by the server in {best*1000:.1f} ms")
+
+def bench_upload(args):
+    """
+    Posting the leaderboards of one update one by one against gzip compressed batches, to a local pj_mock_server
+    holding every response for a simulated round trip
+    """
+    server = pj_mock_server.MockHotlapServer(latency=args.latency_ms/1000).start()
+    constants = pj_leaderboard_backend.constants
+    constants.sra_api_url = server.url
+    tracks = list(constants.pretty_name_raw_name)[:args.leaderboards]
+    leaderboards = []
+    for i, track in enumerate(tracks):
+        entries = synthetic_entries(args.entries, seed=i)
+        leaderboards.append(Leaderboard(entry_list=entries, track=track, condition=pj_leaderboard_backend.Condition.DRY, season=5, most_recent_sessions={}))
+
+    print(f"{len(leaderboards)} leaderboards of {args.entries} entries, {args.latency_ms:.0f} ms round trip")
+    for name, batch in (("One by one", False), ("Batched", True)):
+        constants.post_batch = batch
+        best = None
+        for _ in range(args.repeat):
+            posts = len(server.posts)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                published = pj_leaderboard_backend.publish_multi(leaderboards, [True]*len(leaderboards))
+            elapsed = time.perf_counter() - start
+            assert all(published)
+            best = elapsed if best is None else min(best, elapsed)
+            sent = server.posts[posts:]
+        print(f"{name}: {len(sent)} requests, {sum(post.size for post in sent)/1024:.0f} KiB sent "
+              f"({sum(post.decoded_size for post in sent)/1024:.0f} KiB of json), {best*1000:.0f} ms")
+
+class SyntheticOriginAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter answering like the result hosts and the hotlap API, from generated sessions of season 5.
+    The dashboard honours the track, condition and date terms of the query and has page_size rows per page.
+    The hotlap API has no leaderboards, so an update crawls the whole season
+    """
+    def __init__(self, sessions:int, tracks:list[str], page_size:int = 20, seed:int = 0) -> None:
+        """
+        Initialize a SyntheticOriginAdapter
+
+        Args:
+            sessions: Sessions per host
+            tracks: Raw names of the tracks the sessions are run on, i.e zandvoort
+            page_size: Dashboard rows per page
+            seed: Random seed
+        """
+        super().__init__()
+        self.page_size = page_size
+        rng = random.Random(seed)
+        constants = pj_leaderboard_backend.constants
+        # Host -> sessions, newest first
+        self.sessions:dict[str, list[dict]] = {}
+        for host in constants.host_list:
+            timestamp = datetime.datetime(2022, 12, 20, tzinfo=datetime.timezone.utc)
+            host_sessions = []
+            for _ in range(sessions):
+                timestamp -= datetime.timedelta(minutes=rng.randint(10, 300))
+                track = rng.choice(tracks)
+                wet = int(rng.random() < 0.3)
+                cars = []
+                laps = []
+                for car_id in range(1000, 1000 + rng.randint(0, 8)):
+                    drivers = [
+                        {"firstName": f"First{d}", "lastName": f"Last{d}", "shortName": f"F{d:02}", "playerId": f"S7656119{d:09}"}
+                        for d in rng.sample(range(200), rng.randint(1, 3))
+                    ]
+                    cars.append({"car": {"carId": car_id, "carModel": rng.choice(list(constants.car_model_dict)), "drivers": drivers}})
+                    for _ in range(rng.randint(0, 20)):
+                        laptime = rng.randint(90000, 100000)
+                        laps.append({"carId": car_id, "driverIndex": rng.randrange(len(drivers)), "laptime": laptime,
+                                     "isValidForBest": rng.random() < 0.8, "splits": [laptime//3, laptime//3, laptime - 2*(laptime//3)]})
+                rng.shuffle(laps)
+                host_sessions.append({
+                    "filename": timestamp.strftime("%y%m%d_%H%M%S") + rng.choice(["_FP", "_Q", "_R"]),
+                    "timestamp": timestamp,
+                    "track": constants.pretty_name_raw_name[track],
+                    "wet": wet,
+                    "password": rng.random() < 0.7,
+                    "json": json.dumps({"sessionType": "FP", "trackName": track, "sessionResult": {"isWetSession": wet, "leaderBoardLines": cars}, "laps": laps}).encode("utf-8")
+                })
+            self.sessions[host] = host_sessions
+
+    def dashboard(self, host:str, query:dict) -> tuple[int, bytes]:
+        rows = self.sessions[host]
+        for term in query.get("q", [""])[0].split(" +"):
+            term = term.strip("+ ")
+            if term.startswith(("Date:>=", "Date:<=")):
+                date = datetime.datetime.strptime(term.split('"')[1], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+                rows = [row for row in rows if (row["timestamp"] >= date if term.startswith("Date:>=") else row["timestamp"] <= date)]
+            elif term.startswith("sessionResult.isWetSession:"):
+                rows = [row for row in rows if row["wet"] == int(term.split(":")[1])]
+            elif term:
+                rows = [row for row in rows if pj_leaderboard_backend.constants.pretty_name_raw_name.get(row["track"]) == term]
+        page = int(query["page"][0])
+        rows = rows[page*self.page_size:(page + 1)*self.page_size]
+        if not rows:
+            return 404, b"Not found"
+        row_html = "".join(
+            f'<tr class="row-link" data-href="/results/{row["filename"]}">\n'
+            f'    <td>{row["timestamp"].strftime("%a, %d %b %Y %H:%M:%S UTC")}</td>\n'
+            f'    <td>Practice</td>\n'
+            f'    <td>{row["track"]}</td>\n'
+            f'</tr>\n'
+            for row in rows
+        )
+        return 200, f"<html><body><table class='table'><tbody>\n{row_html}</tbody></table></body></html>".encode("utf-8")
+
+    def send(self, request, **kwargs):
+        url = urllib.parse.urlsplit(request.url)
+        status, content = 404, b"Not found"
+        if url.path.startswith("/api/hotlap/"):
+            status, content = 200, b'{"error": "Leaderboard does not exist"}'
+        elif url.path == "/results":
+            status, content = self.dashboard(url.hostname, urllib.parse.parse_qs(url.query))
+        elif url.hostname in self.sessions:
+            filename = url.path.split("/")[-1]
+            for session in self.sessions[url.hostname]:
+                if url.path.startswith("/results/download/") and (filename == f"{session['filename']}.json"):
+                    status, content = 200, session["json"]
+                elif filename == session["filename"]:
+                    status, content = 200, f"<html>{'Password: sra' if session['password'] else 'Open lobby'}</html>".encode("utf-8")
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        response.headers["Content-Length"] = str(len(content))
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+def bench_update(args):
+    """
+    End to end simulated updates with pj_leaderboard_backend.main, replayed from a fixture bundle by a local
+    pj_replay.ReplayServer holding every response for a simulated round trip. Without a bundle, one is
+    recorded from a SyntheticOriginAdapter first
+    """
+    pj_replay.disable_caches()
+    work_dir = tempfile.mkdtemp()
+    bundle = pj_replay.Bundle(args.bundle or path.join(work_dir, "bundle"))
+    cwd = os.getcwd()
+    # Simulated updates write their csv to the working directory
+    os.chdir(work_dir)
+    try:
+        if not args.bundle:
+            tracks = [args.track] + [track for track in pj_leaderboard_backend.constants.track_choices if track != args.track][:3]
+            pj_replay.record(bundle, SyntheticOriginAdapter(args.sessions, tracks))
+            with contextlib.redirect_stdout(io.StringIO()):
+                pj_leaderboard_backend.main(args.track, args.condition, args.season, simulate=True)
+        server = pj_replay.ReplayServer(bundle, latency=args.latency_ms/1000).start()
+        pj_replay.replay(server.url)
+        print(f"{sum(map(len, server.records.values()))} recorded responses, {args.latency_ms:.0f} ms round trip")
+        for workers in args.workers:
+            best = None
+            for _ in range(args.repeat):
+                server.reset()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pj_leaderboard_backend.main(args.track, args.condition, args.season, simulate=True, workers=workers, processes=args.processes)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{workers} download threads per host: {best:.2f} s, {server.requests} requests, {server.misses} not in the bundle")
+    finally:
+        pj_http.client.mount(None)
+        os.chdir(cwd)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the leaderboard backend")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement. Best run is reported")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Session merge into a leaderboard")
+    merge_parser.add_argument('--entries', type=int, default=10000, help="Leaderboard size")
+    merge_parser.add_argument('--sessions', type=int, default=100, help="Number of sessions to merge")
+    merge_parser.add_argument('--session-size', type=int, default=40, help="Entries per session")
+    merge_parser.set_defaults(func=bench_merge)
+
+    laps_parser = subparsers.add_parser("laps", help="Best lap extraction of a long session")
+    laps_parser.add_argument('--cars', type=int, default=40, help="Cars in the session")
+    laps_parser.add_argument('--laps-per-car', type=int, default=700, help="Laps driven by every car")
+    laps_parser.set_defaults(func=bench_laps)
+
+    stream_parser = subparsers.add_parser("stream", help="Peak memory of streaming a long session json")
+    stream_parser.add_argument('--cars', type=int, default=40, help="Cars in the session")
+    stream_parser.add_argument('--laps-per-car', type=int, default=700, help="Laps driven by every car")
+    stream_parser.set_defaults(func=bench_stream)
+
+    memory_parser = subparsers.add_parser("memory", help="Memory of leaderboard entry storage")
+    memory_parser.add_argument('--entries', type=int, default=100000, help="Number of entries")
+    memory_parser.add_argument('--drivers', type=int, default=5000, help="Distinct drivers among the entries")
+    memory_parser.set_defaults(func=bench_memory)
+
+    csv_parser = subparsers.add_parser("csv", help="Loading a large leaderboard csv")
+    csv_parser.add_argument('--entries', type=int, default=50000, help="Rows in the csv")
+    csv_parser.set_defaults(func=bench_csv)
+
+    startup_parser = subparsers.add_parser("startup", help="Import time of the backend or the bot")
+    startup_parser.add_argument('--module', default="pj_leaderboard_backend", help="Module to import")
+    startup_parser.add_argument('--top', type=int, default=8, help="Number of direct imports to list")
+    startup_parser.set_defaults(func=bench_startup)
+
+    http_parser = subparsers.add_parser("http", help="New connection per request against the pooled client")
+    http_parser.add_argument('--requests', type=int, default=1000, help="Number of requests")
+    http_parser.add_argument('--threads', type=int, default=4, help="Concurrent requests")
+    http_parser.add_argument('--body-size', type=int, default=20000, help="Response size in bytes")
+    http_parser.add_argument('--tls-cert', help="Certificate for localhost. Serves HTTPS when given")
+    http_parser.add_argument('--tls-key', help="Private key of --tls-cert")
+    http_parser.set_defaults(func=bench_http)
+
+    dashboard_parser = subparsers.add_parser("dashboard", help="Row extraction of dashboard pages")
+    dashboard_parser.add_argument('fixtures', nargs='*', help="Saved dashboard html files. Synthetic pages if none are given")
+    dashboard_parser.add_argument('--pages', type=int, default=20, help="Number of synthetic pages")
+    dashboard_parser.add_argument('--rows', type=int, default=20, help="Rows per synthetic page")
+    dashboard_parser.set_defaults(func=bench_dashboard)
+
+    process_parser = subparsers.add_parser("process", help="Session parsing and merging in threads against a process pool")
+    process_parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Worker processes, and threads of the thread run")
+    process_parser.add_argument('--sessions', type=int, default=32, help="Sessions to parse and merge")
+    process_parser.add_argument('--cars', type=int, default=30, help="Cars per session")
+    process_parser.add_argument('--laps-per-car', type=int, default=60, help="Laps driven by every car")
+    process_parser.add_argument('--boards', type=int, default=8, help="Leaderboards to merge into")
+    process_parser.add_argument('--entries', type=int, default=5000, help="Entries per leaderboard")
+    process_parser.set_defaults(func=bench_process)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="Crawls of a burst of update requests with the coalescing scheduler")
+    scheduler_parser.add_argument('--requests', type=int, default=50, help="Update requests in the burst")
+    scheduler_parser.add_argument('--tracks', type=int, default=4, help="Tracks, each with a dry and a wet leaderboard")
+    scheduler_parser.add_argument('--workers', type=int, default=4, help="Updates running at once")
+    scheduler_parser.add_argument('--update-ms', type=int, default=50, help="Simulated time of an update")
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Simulated day of the fixed refresh loop against the adaptive planner")
+    refresh_parser.add_argument('--days', type=int, default=7, help="Simulated days")
+    refresh_parser.add_argument('--tracks', type=int, default=12, help="Leaderboards in the track set")
+    refresh_parser.add_argument('--hot-rate', type=float, default=10, help="Sessions per hour of the busy leaderboard")
+    refresh_parser.add_argument('--idle-rate', type=float, default=0.05, help="Sessions per hour of the other leaderboards")
+    refresh_parser.add_argument('--refresh-cost', type=int, default=6, help="Requests of a refresh without new sessions")
+    refresh_parser.add_argument('--budget', type=int, default=pj_leaderboard_backend.constants.request_budget, help="Requests per hour")
+    refresh_parser.add_argument('--tick', type=int, default=pj_leaderboard_backend.constants.refresh_tick_seconds, help="Seconds between planner ticks")
+    refresh_parser.set_defaults(func=bench_refresh)
+
+    post_parser = subparsers.add_parser("post", help="Full post against delta post of a large leaderboard to a local mock API")
+    post_parser.add_argument('--entries', type=int, default=20000, help="Entries of the leaderboard")
+    post_parser.add_argument('--changed', type=int, default=5, help="Drivers improving per cycle")
+    post_parser.add_argument('--new', type=int, default=1, help="New drivers per cycle")
+    post_parser.set_defaults(func=bench_post)
+
+    upload_parser = subparsers.add_parser("upload", help="Leaderboards posted one by one against gzip compressed batches to a local mock API")
+    upload_parser.add_argument('--leaderboards', type=int, default=12, help="Leaderboards posted per update")
+    upload_parser.add_argument('--entries', type=int, default=2000, help="Entries of each leaderboard")
+    upload_parser.add_argument('--latency-ms', type=float, default=30, help="Simulated round trip to the API")
+    upload_parser.set_defaults(func=bench_upload)
+
+    update_parser = subparsers.add_parser("update", help="End to end updates replayed from a fixture bundle, see pj_replay")
+    update_parser.add_argument('--bundle', type=str, help="Bundle recorded with pj_replay.py record. Recorded from synthetic hosts if not set")
+    update_parser.add_argument('--track', type=str, default="zandvoort", choices=pj_leaderboard_backend.constants.track_choices, help="Track of the recorded update")
+    update_parser.add_argument('--condition', type=int, default=0, choices=[0, 1], help="Condition of the recorded update")
+    update_parser.add_argument('--season', type=int, default=5, help="Season of the recorded update")
+    update_parser.add_argument('--sessions', type=int, default=300, help="Sessions per synthetic host")
+    update_parser.add_argument('--latency-ms', type=float, default=30, help="Simulated round trip to the hosts")
+    update_parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help="Download threads per host to compare")
+    update_parser.add_argument('--processes', type=int, default=0, help="Worker processes for session parsing")
+    update_parser.set_defaults(func=bench_update)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,511 @@
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import os
+from os import path
+import threading
+import constants
+
+
+class SessionCache:
+    """
+    On-disk store of session result json files.
+    Results never change once published so entries never expire. They are only evicted
+    in least recently used order when the store grows past max_bytes.
+
+    Attributes:
+        cache_dir: Directory of the store. Files are kept at {cache_dir}/{host}/{filename}.json
+        max_bytes: Size cap of the store. 0 disables the cache
+    """
+    def __init__(self, cache_dir:str, max_bytes:int) -> None:
+        """
+        Initialize a SessionCache
+
+        Args:
+            cache_dir: Directory of the store
+            max_bytes: Size cap of the store. 0 disables the cache
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # File path -> size, least recently used first
+        self._entries:OrderedDict[str, int] = None
+        self._size = 0
+
+    def _load_index(self):
+        """
+        Build the LRU index from the files on disk. Access order is kept in the file mtimes
+        """
+        self._entries = OrderedDict()
+        self._size = 0
+        if not path.isdir(self.cache_dir):
+            return
+        files = []
+        for host in os.listdir(self.cache_dir):
+            host_dir = path.join(self.cache_dir, host)
+            if not path.isdir(host_dir):
+                continue
+            for filename in os.listdir(host_dir):
+                if not filename.endswith(".json"):
+                    continue
+                file_path = path.join(host_dir, filename)
+                stat = os.stat(file_path)
+                files.append((stat.st_mtime, file_path, stat.st_size))
+        files.sort()
+        for _, file_path, size in files:
+            self._entries[file_path] = size
+            self._size += size
+
+    def get_path(self, host:str, filename:str) -> str:
+        return path.join(self.cache_dir, path.basename(host), f"{path.basename(filename)}.json")
+
+    def get(self, host:str, filename:str) -> bytes:
+        """
+        Read a session from the store
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+        Return:
+            Raw json or None if the session isn't stored
+        """
+        file = self.open(host, filename)
+        if file is None:
+            return None
+        with file:
+            return file.read()
+
+    def open(self, host:str, filename:str):
+        """
+        Open a stored session for reading and mark it as recently used
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+        Return:
+            Binary file object or None if the session isn't stored
+        """
+        if not self.max_bytes:
+            return None
+        file_path = self.get_path(host, filename)
+        with self._lock:
+            if self._entries is None:
+                self._load_index()
+            if file_path not in self._entries:
+                return None
+            try:
+                file = open(file_path, "rb")
+                os.utime(file_path)
+            except OSError:
+                self._size -= self._entries.pop(file_path)
+                return None
+            self._entries.move_to_end(file_path)
+            return file
+
+    def writer(self, host:str, filename:str):
+        """
+        Get a writer that stores a session as it is downloaded
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+        Return:
+            SessionCacheWriter. Use as a context manager; the session is only stored if commit is called
+        """
+        return SessionCacheWriter(self, host, filename)
+
+    def put(self, host:str, filename:str, data:bytes):
+        """
+        Add a session to the store and evict the least recently used sessions if over the size cap
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+            data: Raw json
+        """
+        if (not self.max_bytes) or (len(data) > self.max_bytes):
+            return
+        file_path = self.get_path(host, filename)
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        self._commit(tmp_path, file_path, len(data))
+
+    def _commit(self, tmp_path:str, file_path:str, size:int):
+        """
+        Move a fully written temp file into the store and evict the least recently used sessions if over the size cap
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load_index()
+            os.replace(tmp_path, file_path)
+            if file_path in self._entries:
+                self._size -= self._entries.pop(file_path)
+            self._entries[file_path] = size
+            self._size += size
+            while self._size > self.max_bytes:
+                evict_path, evict_size = self._entries.popitem(last=False)
+                self._size -= evict_size
+                try:
+                    os.remove(evict_path)
+                except OSError:
+                    pass
+
+
+class SessionCacheWriter:
+    """
+    Writes a session to a temp file chunk by chunk and moves it into the SessionCache on commit
+    """
+    def __init__(self, cache:SessionCache, host:str, filename:str) -> None:
+        self.cache = cache
+        self.file_path = cache.get_path(host, filename)
+        self.tmp_path = f"{self.file_path}.{threading.get_ident()}.tmp"
+        self.size = 0
+        self._file = None
+        if cache.max_bytes:
+            os.makedirs(path.dirname(self.file_path), exist_ok=True)
+            self._file = open(self.tmp_path, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file:
+            self._file.close()
+            self._file = None
+            os.remove(self.tmp_path)
+
+    def tee(self, chunks):
+        """
+        Yield chunks unchanged while writing them to the temp file
+        """
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+    def write(self, chunk:bytes):
+        if not self._file:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_bytes:
+            # Too big to ever be stored
+            self._file.close()
+            self._file = None
+            os.remove(self.tmp_path)
+            return
+        self._file.write(chunk)
+
+    def commit(self):
+        if not self._file:
+            return
+        self._file.close()
+        self._file = None
+        self.cache._commit(self.tmp_path, self.file_path, self.size)
+
+
+Verdict = namedtuple("Verdict", "passed rule")
+
+class VerdictIndex:
+    """
+    Persistent record of password filter verdicts of sessions.
+    A session page doesn't change once published, so its page only has to be checked once.
+    Verdicts are appended to a json lines file as they come in.
+
+    Attributes:
+        file_path: Path of the json lines file. Empty string disables the index
+    """
+    def __init__(self, file_path:str) -> None:
+        """
+        Initialize a VerdictIndex
+
+        Args:
+            file_path: Path of the json lines file. Empty string disables the index
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._verdicts:dict[str, Verdict] = None
+
+    def _load(self):
+        self._verdicts = {}
+        if not path.exists(self.file_path):
+            return
+        with open(self.file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written last line
+                    continue
+                self._verdicts[record["key"]] = Verdict(passed=record["passed"], rule=record["rule"])
+
+    def get(self, host:str, filename:str) -> Verdict:
+        """
+        Get the verdict of a session
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+        Return:
+            Verdict or None if the session wasn't checked yet
+        """
+        if not self.file_path:
+            return None
+        with self._lock:
+            if self._verdicts is None:
+                self._load()
+            return self._verdicts.get(f"{host}/{filename}")
+
+    def put(self, host:str, filename:str, passed:bool, rule:str = None):
+        """
+        Record the verdict of a session
+
+        Args:
+            host: Host the session was published on
+            filename: Session filename, i.e 220210_232907_FP
+            passed: True if the session passed the password filter
+            rule: Marker that was found in the session page
+        """
+        if not self.file_path:
+            return
+        key = f"{host}/{filename}"
+        with self._lock:
+            if self._verdicts is None:
+                self._load()
+            if key in self._verdicts:
+                return
+            self._verdicts[key] = Verdict(passed=passed, rule=rule)
+            if path.dirname(self.file_path):
+                os.makedirs(path.dirname(self.file_path), exist_ok=True)
+            with open(self.file_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"key": key, "passed": passed, "rule": rule}) + "\n")
+
+
+class ValidatorCache:
+    """
+    ETag and Last-Modified of fetched urls, used to make conditional requests.
+    Validators of new responses are only staged. They are committed once the caller is done with the
+    response, i.e after the leaderboard it fed was posted, so a failed cycle never turns the next
+    fetch into a 304 for data that wasn't acted on.
+
+    Attributes:
+        cache_dir: Directory of the index and of the stored bodies. Empty string disables the cache
+    """
+    def __init__(self, cache_dir:str) -> None:
+        """
+        Initialize a ValidatorCache
+
+        Args:
+            cache_dir: Directory of the index and of the stored bodies. Empty string disables the cache
+        """
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._validators:dict[str, dict] = None
+        # Url -> (validator record, body to store)
+        self._staged:dict[str, tuple[dict, bytes]] = {}
+
+    def get_index_path(self) -> str:
+        return path.join(self.cache_dir, "validators.json")
+
+    def get_body_path(self, url:str) -> str:
+        return path.join(self.cache_dir, f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.body")
+
+    def _load(self):
+        self._validators = {}
+        try:
+            with open(self.get_index_path(), "r", encoding="utf-8") as file:
+                self._validators = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def _get(self, url:str) -> dict:
+        if not self.cache_dir:
+            return None
+        with self._lock:
+            if self._validators is None:
+                self._load()
+            return self._validators.get(url)
+
+    def headers(self, url:str, with_body:bool = False) -> dict:
+        """
+        Get the conditional request headers of a url
+
+        Args:
+            url: Url
+            with_body: Only make the request conditional if the body of the url is stored
+        Return:
+            If-None-Match and If-Modified-Since headers. Empty if nothing is known about the url
+        """
+        record = self._get(url)
+        if not record:
+            return {}
+        if with_body and (not record.get("body")):
+            return {}
+        headers = {}
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def body(self, url:str) -> bytes:
+        """
+        Get the stored body of a url
+
+        Return:
+            Body or None if it isn't stored
+        """
+        record = self._get(url)
+        if (not record) or (not record.get("body")):
+            return None
+        try:
+            with open(path.join(self.cache_dir, record["body"]), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def stage(self, url:str, headers, body:bytes = None, key:str = None):
+        """
+        Stage the validators of a 200 response
+
+        Args:
+            url: Url
+            headers: Response headers
+            body: Body to store along with the validators, returned by body after a 304
+            key: Urls with the same key supersede each other. Committing url drops the validators of the others
+        """
+        if not self.cache_dir:
+            return
+        record = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"), "body": None, "key": key}
+        if body is not None:
+            record["body"] = path.basename(self.get_body_path(url))
+        with self._lock:
+            self._staged[url] = (record, body)
+
+    def commit(self, urls):
+        """
+        Commit the staged validators of urls
+
+        Args:
+            urls: Urls whose responses were acted on
+        """
+        if not self.cache_dir:
+            return
+        with self._lock:
+            if self._validators is None:
+                self._load()
+            committed = False
+            for url in urls:
+                if url not in self._staged:
+                    continue
+                record, body = self._staged.pop(url)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                if record["key"] is not None:
+                    for superseded in [other for other, other_record in self._validators.items() if (other != url) and (other_record.get("key") == record["key"])]:
+                        self._remove(superseded)
+                if body is not None:
+                    body_path = self.get_body_path(url)
+                    with open(f"{body_path}.tmp", "wb") as file:
+                        file.write(body)
+                    os.replace(f"{body_path}.tmp", body_path)
+                if record["etag"] or record["last_modified"]:
+                    self._validators[url] = record
+                else:
+                    self._validators.pop(url, None)
+                committed = True
+            if committed:
+                index_path = self.get_index_path()
+                with open(f"{index_path}.tmp", "w", encoding="utf-8") as file:
+                    json.dump(self._validators, file)
+                os.replace(f"{index_path}.tmp", index_path)
+
+    def _remove(self, url:str):
+        record = self._validators.pop(url)
+        if record.get("body"):
+            try:
+                os.remove(path.join(self.cache_dir, record["body"]))
+            except OSError:
+                pass
+
+    def discard(self, urls):
+        """
+        Drop the staged validators of urls
+        """
+        with self._lock:
+            for url in urls:
+                self._staged.pop(url, None)
+
+
+class CrawlMarks:
+    """
+    Persistent record of how far the shared dashboard crawl of crawl_multi has seen every row of each leaderboard on each host.
+    The most recent session of a leaderboard only moves when one of its sessions is merged and posted, so a leaderboard
+    without new sessions of its own would otherwise drag every shared crawl back to its most recent session.
+
+    Attributes:
+        file_path: Path of the json file. Empty string disables the marks
+    """
+    def __init__(self, file_path:str) -> None:
+        """
+        Initialize a CrawlMarks
+
+        Args:
+            file_path: Path of the json file. Empty string disables the marks
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        # Leaderboard key -> host -> timestamp, read from _loaded_path
+        self._marks:dict[str, dict[str, str]] = None
+        self._loaded_path:str = None
+
+    def _load(self):
+        if (self._marks is not None) and (self._loaded_path == self.file_path):
+            return
+        self._loaded_path = self.file_path
+        self._marks = {}
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                self._marks = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def get(self, key:str, host:str) -> str:
+        """
+        Get the mark of a leaderboard on a host
+
+        Args:
+            key: Leaderboard key, i.e Zandvoort|0|5
+            host: Host
+        Return:
+            Timestamp up to which every row of the leaderboard was seen, or None
+        """
+        if not self.file_path:
+            return None
+        with self._lock:
+            self._load()
+            return self._marks.get(key, {}).get(host)
+
+    def put(self, key:str, marks:dict[str, str]):
+        """
+        Record the marks of a leaderboard
+
+        Args:
+            key: Leaderboard key, i.e Zandvoort|0|5
+            marks: Host -> timestamp up to which every row of the leaderboard was seen
+        """
+        if (not self.file_path) or (not marks):
+            return
+        with self._lock:
+            self._load()
+            self._marks.setdefault(key, {}).update(marks)
+            if path.dirname(self.file_path):
+                os.makedirs(path.dirname(self.file_path), exist_ok=True)
+            with open(f"{self.file_path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(self._marks, file)
+            os.replace(f"{self.file_path}.tmp", self.file_path)
+
+
+session_cache = SessionCache(constants.session_cache_dir, constants.session_cache_max_bytes)
+verdict_index = VerdictIndex(constants.verdict_index_path)
+validator_cache = ValidatorCache(constants.validator_cache_dir)
+crawl_marks = CrawlMarks(constants.crawl_marks_path)
@@ -0,0 +1,92 @@
+import importlib
+
+# Imported by available() on first use. NumPy takes a while to import and most runs never need it
+numpy = None
+_numpy_checked = False
+
+
+def available() -> bool:
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            numpy = importlib.import_module("numpy")
+        except ImportError:
+            numpy = None
+        _numpy_checked = True
+    return numpy is not None
+
+class LapColumns:
+    """
+    Laps of a session stored as NumPy columns
+
+    Attributes:
+        car_id: carId of every lap
+        driver_index: driverIndex of every lap
+        valid: isValidForBest of every lap
+        laptime: Lap time of every valid lap in ms
+        valid_car_id: carId of every valid lap
+        valid_driver_index: driverIndex of every valid lap
+        s1: S1 of every valid lap in ms
+        s2: S2 of every valid lap in ms
+        s3: S3 of every valid lap in ms
+    """
+    def __init__(self, laps:list[dict]) -> None:
+        """
+        Load laps into columns. Splits are only read from valid laps
+
+        Args:
+            laps: Laps of the session json
+        """
+        count = len(laps)
+        self.car_id = numpy.fromiter((lap['carId'] for lap in laps), dtype=numpy.int64, count=count)
+        self.driver_index = numpy.fromiter((lap['driverIndex'] for lap in laps), dtype=numpy.int64, count=count)
+        self.valid = numpy.fromiter((bool(lap['isValidForBest']) for lap in laps), dtype=numpy.bool_, count=count)
+        valid_laps = [lap for lap in laps if lap['isValidForBest']]
+        valid_count = len(valid_laps)
+        self.laptime = numpy.fromiter((lap['laptime'] for lap in valid_laps), dtype=numpy.int64, count=valid_count)
+        self.valid_car_id = self.car_id[self.valid]
+        self.valid_driver_index = self.driver_index[self.valid]
+        self.s1 = numpy.fromiter((lap['splits'][0] for lap in valid_laps), dtype=numpy.int64, count=valid_count)
+        self.s2 = numpy.fromiter((lap['splits'][1] for lap in valid_laps), dtype=numpy.int64, count=valid_count)
+        self.s3 = numpy.fromiter((lap['splits'][2] for lap in valid_laps), dtype=numpy.int64, count=valid_count)
+
+def _group_starts(car_id, driver_index):
+    """
+    Indices where a new (carId, driverIndex) group starts in arrays sorted by group
+    """
+    if not len(car_id):
+        return numpy.zeros(0, dtype=numpy.int64)
+    change = (car_id[1:] != car_id[:-1]) | (driver_index[1:] != driver_index[:-1])
+    return numpy.concatenate(([0], numpy.flatnonzero(change) + 1))
+
+def best_laps(columns:LapColumns) -> dict[tuple[int, int], tuple[int, int, int, int]]:
+    """
+    Vectorized equivalent of pj_leaderboard_backend.best_laps.
+    On equal lap times the later lap wins
+
+    Args:
+        columns: Laps of the session
+    Return:
+        (carId, driverIndex) -> (laptime, S1, S2, S3)
+    """
+    order_in_session = numpy.arange(len(columns.laptime))
+    # Sort by group, then lap time, then latest lap first so the first row of a group is its best lap
+    order = numpy.lexsort((-order_in_session, columns.laptime, columns.valid_driver_index, columns.valid_car_id))
+    car_id = columns.valid_car_id[order]
+    driver_index = columns.valid_driver_index[order]
+    best = order[_group_starts(car_id, driver_index)]
+    lap_bests = {}
+    for car, driver, laptime, s1, s2, s3 in zip(
+        columns.valid_car_id[best].tolist(),
+        columns.valid_driver_index[best].tolist(),
+        columns.laptime[best].tolist(),
+        columns.s1[best].tolist(),
+        columns.s2[best].tolist(),
+        columns.s3[best].tolist()
+    ):
+        #6 hours max session time (Arbitrary initial minimum)
+        if laptime > 3599999:
+            lap_bests[(car, driver)] = (3599999, 0, 0, 0)
+        else:
+            lap_bests[(car, driver)] = (laptime, s1, s2, s3)
+    return lap_bests
@@ -0,0 +1,97 @@
+"""
+Delta payloads of the hotlap update API.
+A delta holds the rows of a leaderboard that changed or are new since the version the poster fetched,
+and the rank shifts of every other row, instead of the whole leaderboard.
+
+Rows are the driver dicts of Leaderboard.to_post_json, ranked 1 to n. A row is keyed by steam_id and car_id.
+Rank shifts are [first_rank, last_rank, shift] ranges over the ranks of the fetched version:
+every unchanged row with a rank in the range moves by shift. Rows without a range keep their rank.
+"""
+import operator
+
+# Fields compared to tell if a row changed. Keys and ranks aren't
+ROW_FIELDS = ("first_name", "last_name", "short_name", "lap_time", "sector_1", "sector_2", "sector_3")
+
+_row_values = operator.itemgetter(*ROW_FIELDS)
+
+
+def row_key(row:dict) -> tuple:
+    return (row["steam_id"], row["car_id"])
+
+def index_rows(rows:list[dict]) -> dict[tuple, tuple[int, tuple]]:
+    """
+    Index the rows of a version of a leaderboard for diff_rows
+
+    Return:
+        Key -> (rank, values of ROW_FIELDS) or None if a key isn't unique
+    """
+    index = {row_key(row): (row["rank"], _row_values(row)) for row in rows}
+    if len(index) != len(rows):
+        return None
+    return index
+
+def diff_rows(base:dict[tuple, tuple[int, tuple]], rows:list[dict]) -> tuple[list[dict], list[list[int]]]:
+    """
+    Compare two versions of a leaderboard
+
+    Args:
+        base: Fetched version, indexed by index_rows
+        rows: Rows of the version to post
+    Return:
+        (changed or new rows, rank shifts) or None if a row of the fetched version is gone
+    """
+    changed = []
+    # (rank in the fetched version, shift) of every unchanged row
+    moves = []
+    seen = 0
+    for row in rows:
+        base_row = base.get(row_key(row))
+        if base_row is None:
+            changed.append(row)
+            continue
+        seen += 1
+        base_rank, base_values = base_row
+        if base_values != _row_values(row):
+            changed.append(row)
+            continue
+        moves.append((base_rank, row["rank"] - base_rank))
+    if seen != len(base):
+        return None
+    moves.sort()
+    shifts = []
+    for rank, shift in moves:
+        # Gaps between ranks of a range belong to changed rows, which are replaced anyway
+        if shifts and (shifts[-1][2] == shift):
+            shifts[-1][1] = rank
+        else:
+            shifts.append([rank, rank, shift])
+    shifts = [s for s in shifts if s[2] != 0]
+    return changed, shifts
+
+def apply_delta(base_rows:list[dict], changed:list[dict], shifts:list[list[int]]) -> list[dict]:
+    """
+    Rebuild a leaderboard from the fetched version and a delta
+
+    Args:
+        base_rows: Rows of the fetched version
+        changed: Changed or new rows, with their new rank
+        shifts: Rank shifts
+    Return:
+        Rows sorted by rank or None if the delta doesn't rank the rows 1 to n
+    """
+    changed_keys = set(map(row_key, changed))
+    shifts = sorted(shifts)
+    rows = list(changed)
+    i = 0
+    for base_row in sorted(base_rows, key=operator.itemgetter("rank")):
+        if row_key(base_row) in changed_keys:
+            continue
+        rank = base_row["rank"]
+        while (i < len(shifts)) and (shifts[i][1] < rank):
+            i += 1
+        shift = shifts[i][2] if ((i < len(shifts)) and (shifts[i][0] <= rank)) else 0
+        rows.append({**base_row, "rank": rank + shift})
+    rows.sort(key=operator.itemgetter("rank"))
+    if [row["rank"] for row in rows] != list(range(1, len(rows) + 1)):
+        return None
+    return rows
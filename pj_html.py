@@ -0,0 +1,53 @@
+import html
+import constants
+
+
+def iter_table_html(columns:list[str], rows):
+    """
+    Yield the html of a leaderboard table piece by piece.
+    Markup matches DataFrame.to_html(index=False, justify='center', classes="ldb-table") so the css keeps working
+
+    Args:
+        columns: Column headers
+        rows: Iterable of rows, each an iterable of cell strings
+    """
+    yield '<table border="1" class="dataframe ldb-table">\n  <thead>\n    <tr style="text-align: center;">\n'
+    for column in columns:
+        yield f"      <th>{html.escape(column, quote=False)}</th>\n"
+    yield "    </tr>\n  </thead>\n  <tbody>\n"
+    for row in rows:
+        yield "    <tr>\n" + "".join(f"      <td>{html.escape(cell, quote=False)}</td>\n" for cell in row) + "    </tr>\n"
+    yield "  </tbody>\n</table>"
+
+def iter_page_html(columns:list[str], rows, footer:str = ""):
+    """
+    Yield a full leaderboard page: the table wrapped in constants.html_string
+
+    Args:
+        columns: Column headers
+        rows: Iterable of rows, each an iterable of cell strings
+        footer: Text shown below the table
+    """
+    page_head, page_tail = constants.html_string.split("{ldb_html}")
+    yield page_head
+    yield from iter_table_html(columns, rows)
+    if footer:
+        yield f"\n    <p>{html.escape(footer, quote=False)}</p>"
+    yield page_tail
+
+def write_page(file_path:str, columns:list[str], rows, footer:str = "", stream:bool = False):
+    """
+    Write a leaderboard page
+
+    Args:
+        file_path: Path of the html file
+        columns: Column headers
+        rows: Iterable of rows, each an iterable of cell strings
+        footer: Text shown below the table
+        stream: Write the page as it is generated instead of building it in memory first
+    """
+    with open(file_path, "w", encoding="utf-8") as html_file:
+        if stream:
+            html_file.writelines(iter_page_html(columns, rows, footer))
+        else:
+            html_file.write("".join(iter_page_html(columns, rows, footer)))
@@ -0,0 +1,135 @@
+import threading
+import urllib.parse
+import requests
+import requests.adapters
+import constants
+
+
+class HttpClient:
+    """
+    HTTP client shared by everything that talks to the result hosts and the SRA API.
+    Connections are kept alive in a pool per host, so a crawl pays the TCP and TLS setup once per
+    connection instead of once per request. Requests in flight to a host are capped by a semaphore.
+
+    Attributes:
+        max_connections: Max concurrent requests per host
+        pool_maxsize: Connections kept alive per host
+        pool_hosts: Number of hosts that get a pool
+    """
+    def __init__(self, max_connections:int, pool_maxsize:int, pool_hosts:int) -> None:
+        """
+        Initialize a HttpClient
+
+        Args:
+            max_connections: Max concurrent requests per host
+            pool_maxsize: Connections kept alive per host
+            pool_hosts: Number of hosts that get a pool
+        """
+        self.max_connections = max_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_hosts = pool_hosts
+        self._session:requests.Session = None
+        self._lock = threading.Lock()
+        self._host_semaphores:dict[str, threading.BoundedSemaphore] = {}
+        # Requests sent since the client was created. See pj_scheduler.RequestBudget
+        self.request_count = 0
+        # Transport adapter replacing the pooled HTTPAdapter. See mount
+        self.adapter:requests.adapters.HTTPAdapter = None
+
+    def get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = self.adapter or requests.adapters.HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def host_semaphore(self, host:str) -> threading.BoundedSemaphore:
+        """
+        Get the semaphore capping the amount of concurrent requests to a host
+
+        Args:
+            host: Host name, i.e accsm1.simracingalliance.com
+        Return:
+            Semaphore shared by every thread talking to that host
+        """
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_connections)
+            return self._host_semaphores[host]
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response:
+        """
+        Send a request over the pooled connections. Blocks while the host already has max_connections requests in flight
+
+        Args:
+            method: HTTP method
+            url: Url
+            kwargs: Passed to requests.Session.request
+        Return:
+            Response
+        """
+        session = self.get_session()
+        host = urllib.parse.urlsplit(url).hostname
+        with self._lock:
+            self.request_count += 1
+        with self.host_semaphore(host):
+            return session.request(method, url, **kwargs)
+
+    def get(self, url:str, **kwargs) -> requests.Response:
+        return self.request("GET", url, allow_redirects=True, **kwargs)
+
+    def post(self, url:str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def mount(self, adapter:requests.adapters.HTTPAdapter):
+        """
+        Send every request through a transport adapter instead of the pooled HTTPAdapter, i.e to record or replay
+        the traffic with pj_replay. Closes the pooled connections
+
+        Args:
+            adapter: Adapter for both http and https. None restores the pooled HTTPAdapter
+        """
+        with self._lock:
+            self.adapter = adapter
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def close(self):
+        """
+        Close every pooled connection. The client opens new ones on the next request
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+client = HttpClient(constants.host_max_connections, constants.http_pool_maxsize, constants.http_pool_hosts)
+
+def get(url:str, **kwargs) -> requests.Response:
+    """
+    GET a url with the shared client
+
+    Args:
+        url: Url to fetch
+        kwargs: Passed to requests.Session.get
+    Return:
+        Response
+    """
+    return client.get(url, **kwargs)
+
+def post(url:str, **kwargs) -> requests.Response:
+    """
+    POST to a url with the shared client
+
+    Args:
+        url: Url to post to
+        kwargs: Passed to requests.Session.post
+    Return:
+        Response
+    """
+    return client.post(url, **kwargs)
@@ -0,0 +1,141 @@
+import codecs
+import json
+import re
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+# Rest of the buffer after a number if the next chunk may continue it, i.e "1." or "1e"
+_number_tail = re.compile(r"[0-9.eE+-]*\Z")
+
+
+class JsonStreamReader:
+    """
+    Incremental reader of a json document arriving in chunks.
+    Objects and arrays can be walked member by member so only the member being read is held in memory.
+
+    Attributes:
+        chunks: Iterator of bytes
+    """
+    def __init__(self, chunks, encoding:str = "utf-8") -> None:
+        """
+        Initialize a JsonStreamReader
+
+        Args:
+            chunks: Iterable of bytes, i.e Response.iter_content() or a file read in blocks
+            encoding: Document encoding
+        """
+        self.chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Append the next chunk to the buffer, dropping what was already consumed
+
+        Return:
+            False at the end of the document
+        """
+        if self._eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._decoder.decode(b"", final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """
+        Skip whitespace and return the next character without consuming it. Empty string at the end
+        """
+        while True:
+            self._pos = _whitespace.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars:str) -> str:
+        c = self._peek()
+        if (not c) or (c not in chars):
+            raise ValueError(f"Expected one of {chars!r} at offset {self._pos}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def read_value(self):
+        """
+        Decode the next complete value
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # Value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if (not self._eof) and (not isinstance(value, (dict, list, str))) and _number_tail.match(self._buf, end):
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def iter_object(self):
+        """
+        Yield the keys of the next object. The caller must read or walk each member value before the next key
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def iter_array(self):
+        """
+        Yield every element of the next array, decoded one at a time
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._expect(",]") == "]":
+                return
+
+
+def read_session(chunks, on_laps) -> dict:
+    """
+    Read a session result json in a single pass without holding the laps array.
+    Every top-level member except laps is decoded normally; laps is handed to on_laps as an iterator
+
+    Args:
+        chunks: Iterable of bytes of the session json
+        on_laps: Function consuming an iterator of lap dicts. Its return value is stored under "laps"
+    Return:
+        Top-level members of the session json
+    """
+    reader = JsonStreamReader(chunks)
+    session_data = {}
+    for key in reader.iter_object():
+        if key == "laps":
+            laps = reader.iter_array()
+            session_data[key] = on_laps(laps)
+            # Drain anything on_laps didn't consume
+            for _ in laps:
+                pass
+        else:
+            session_data[key] = reader.read_value()
+    return session_data
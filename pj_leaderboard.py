@@ -8,9 +8,10 @@ import csv
 import json
 import re
 import constants
+import pj_html
 from dateutil import parser
+import os
 from os import path
-import pandas
 
 host_list = ["simracingalliance.emperorservers.com", "accsm.simracingalliance.com"]
 
@@ -33,6 +34,22 @@ def laptimetostring(td: datetime.timedelta, trail_trim = False) -> str:
         just_mod = 3
     return f"{str(minutes).rjust(2,'0')}:{str(seconds).rjust(2,'0')}.{str(subsecond).rjust(6-just_mod,'0')}"
 
+def stringtolaptime(laptime_str: str) -> datetime.timedelta:
+    """
+    Convert a MM:ss.SSS or MM:ss.SSSSSS string to an ACC laptime (a timedelta object).
+    Same result as going through strptime(laptime_str, "%M:%S.%f")
+
+    Args:
+        laptime_str: String written by laptimetostring
+    Return:
+        timedelta object
+    """
+    minutes_str, rest = laptime_str.split(':')
+    seconds_str, subsecond_str = rest.split('.')
+    if not (0 < len(subsecond_str) <= 6):
+        raise ValueError(f"Invalid lap time: {laptime_str}")
+    return datetime.timedelta(minutes=int(minutes_str), seconds=int(seconds_str), microseconds=int(subsecond_str.ljust(6,'0')))
+
 class Entry:
     """
     A class representing an entry in a Leaderboard/Session
@@ -46,6 +63,8 @@ class Entry:
         s2: Best lap S2
         s3: Best lap S3
     """
+    __slots__ = ("name", "first_name", "last_name", "short_name", "id", "car", "car_raw", "best_time", "s1", "s2", "s3")
+
     def __init__(
             self, name:str = "", 
             id:str = "", 
@@ -276,37 +295,30 @@ class Leaderboard:
         """
         entry_list = []
         last_updated_str = ""
-        with open(file_path, "r", encoding='utf-8') as csv_file:
-            line_count = 0
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                if line_count == 0:
-                    line_count += 1
-                    continue
-                else:
-                    if ("Last updated" in row[0]):
-                        last_updated_str = row[0].split("?")[1]
-                        line_count += 1
-                        continue
-                    best_time = datetime.datetime.strptime(row[4], "%M:%S.%f")
-                    s1 = datetime.datetime.strptime(row[5], "%M:%S.%f")
-                    s2 = datetime.datetime.strptime(row[6], "%M:%S.%f")
-                    s3 = datetime.datetime.strptime(row[7], "%M:%S.%f")
-                    
-                    entry = Entry(
-                        name=row[1],\
-                        id=row[2],\
-                        car=row[3],\
-                        best_time=datetime.timedelta(minutes=best_time.minute, seconds=best_time.second, microseconds=best_time.microsecond),\
-                        s1=datetime.timedelta(minutes=s1.minute, seconds=s1.second, microseconds=s1.microsecond),\
-                        s2=datetime.timedelta(minutes=s2.minute, seconds=s2.second, microseconds=s2.microsecond),\
-                        s3=datetime.timedelta(minutes=s3.minute, seconds=s3.second, microseconds=s3.microsecond)\
-                    )
-                    #print(entry)
-                    entry_list.append(entry)
-                line_count += 1
+        with open(file_path, "r", encoding='utf-8', newline='') as csv_file:
+            rows = list(csv.reader(csv_file, delimiter=','))
+        del rows[0]
+        for row in rows:
+            if not row:
+                continue
+            if ("Last updated" in row[0]):
+                last_updated_str = row[0].split("?")[1]
+                continue
+            entry = Entry(
+                name=row[1],\
+                id=row[2],\
+                car=row[3],\
+                best_time=stringtolaptime(row[4]),\
+                s1=stringtolaptime(row[5]),\
+                s2=stringtolaptime(row[6]),\
+                s3=stringtolaptime(row[7])\
+            )
+            entry_list.append(entry)
         #last_updated = datetime.datetime.strptime(last_updated_str, "%Y-%m-%dT%H:%M:%S%z")
-        last_updated = parser.parse(last_updated_str)
+        try:
+            last_updated = datetime.datetime.fromisoformat(last_updated_str)
+        except ValueError:
+            last_updated = parser.parse(last_updated_str)
         return cls(file_path=file_path, entry_list=entry_list, last_updated=last_updated)
 
     def generate_embed_compatible(self):
@@ -336,60 +348,48 @@ class Leaderboard:
         """
         if not file_path:
             file_path = self.file_path
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(self.__str__(suppress_id=suppress_id, space_delim=space_delim, include_timestamp=include_timestamp, trail_trim=trail_trim))
-
-    def __str__(self, suppress_id = False, space_delim = False, short = False, include_timestamp = True, trail_trim = False) -> str:
+        # Write to a temp file and swap it in so a crash mid-write can't truncate the csv
+        tmp_path = f"{file_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.writelines(self.iter_lines(suppress_id=suppress_id, space_delim=space_delim, include_timestamp=include_timestamp, trail_trim=trail_trim))
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def iter_lines(self, suppress_id = False, space_delim = False, include_timestamp = True, trail_trim = False):
         """
-        Convert the leaderboard to a csv string
-
-        Args:
-            suppress_id: Suppress driver ID flag
-            space_delim: Space delimited mode
-            include_timestamp: Include last updated timestamp line flag
-            trail_trim: Trim trailing zeroes flag
-        Return:
-            CSV string
+        Yield the leaderboard line by line. Same arguments and output as __str__
         """
-        us_div = 1
         #Justification modifier
         just_mod = 0
         if trail_trim:
-            us_div = 1000
             just_mod = 3
         if space_delim:
-            name_max_width = 0
-            car_max_width = 0
-            for entry in self.entry_list:
-                name = entry.name
-                car = entry.car
-                if len(name) > name_max_width:
-                    name_max_width = len(name)
-                if len(car) > car_max_width:
-                    car_max_width = len(car)
-            if suppress_id:
-                csv_header = constants.csv_header_no_id
-                columns = csv_header.split(',')
-                # 18 is the max width of time in MM:ss.SSSSSS format
-                # Justification stuff
-                leaderboard_str = (
-                    f"{str(columns[0]).center(6,' ')}"
-                    f"{str(columns[1]).center(name_max_width+4,' ')}"
-                    f"{str(columns[2]).center(car_max_width+4,' ')}"
-                    f"{str(columns[3]).center(18-just_mod,' ')}"
-                    f"{str(columns[4]).center(18-just_mod,' ')}"
-                    f"{str(columns[5]).center(18-just_mod,' ')}"
-                    f"{str(columns[6]).center(18-just_mod,' ')}"
-                    f"\n"
-                )
-            else:
+            if not suppress_id:
                 #Not supported cuz who tf would want that
-                return "BITCH WHAT THE FUCK"
-            last_updated_str = datetime.datetime.strftime(self.last_updated, "%Y-%m-%dT%H:%M:%S%z")
-            rank = 1
-            for entry in self.entry_list:
-                #leaderboard_str += f"{rank},{entry.__str__(suppress_id=suppress_id)}\n"
-                leaderboard_str += (
+                yield "BITCH WHAT THE FUCK"
+                return
+            name_max_width = max((len(entry.name) for entry in self.entry_list), default=0)
+            car_max_width = max((len(entry.car) for entry in self.entry_list), default=0)
+            csv_header = constants.csv_header_no_id
+            columns = csv_header.split(',')
+            # 18 is the max width of time in MM:ss.SSSSSS format
+            # Justification stuff
+            yield (
+                f"{str(columns[0]).center(6,' ')}"
+                f"{str(columns[1]).center(name_max_width+4,' ')}"
+                f"{str(columns[2]).center(car_max_width+4,' ')}"
+                f"{str(columns[3]).center(18-just_mod,' ')}"
+                f"{str(columns[4]).center(18-just_mod,' ')}"
+                f"{str(columns[5]).center(18-just_mod,' ')}"
+                f"{str(columns[6]).center(18-just_mod,' ')}"
+                f"\n"
+            )
+            for rank, entry in enumerate(self.entry_list, start=1):
+                yield (
                     f"{str(rank).center(6, ' ')}"
                     f"{str(entry.name).ljust(name_max_width+4, ' ')}"
                     f"{str(entry.car).ljust(car_max_width+4, ' ')}"
@@ -399,23 +399,30 @@ class Leaderboard:
                     f"{laptimetostring(entry.s3, trail_trim).center(18-just_mod, ' ')}"
                     f"\n"
                 )
-                rank += 1
-            if include_timestamp:
-                leaderboard_str += f"Last updated?{last_updated_str}\n"
-            return leaderboard_str
         else:
             if not suppress_id:
-                leaderboard_str = constants.csv_header + "\n"
+                yield constants.csv_header + "\n"
             else:
-                leaderboard_str = constants.csv_header_no_id + "\n"
+                yield constants.csv_header_no_id + "\n"
+            for rank, entry in enumerate(self.entry_list, start=1):
+                yield f"{rank},{entry.__str__(suppress_id=suppress_id, trail_trim=trail_trim)}\n"
+        if include_timestamp:
             last_updated_str = datetime.datetime.strftime(self.last_updated, "%Y-%m-%dT%H:%M:%S%z")
-            rank = 1
-            for entry in self.entry_list:
-                leaderboard_str += f"{rank},{entry.__str__(suppress_id=suppress_id, trail_trim=trail_trim)}\n"
-                rank += 1
-            if include_timestamp:
-                leaderboard_str += f"Last updated?{last_updated_str}\n"
-            return leaderboard_str
+            yield f"Last updated?{last_updated_str}\n"
+
+    def __str__(self, suppress_id = False, space_delim = False, short = False, include_timestamp = True, trail_trim = False) -> str:
+        """
+        Convert the leaderboard to a csv string
+
+        Args:
+            suppress_id: Suppress driver ID flag
+            space_delim: Space delimited mode
+            include_timestamp: Include last updated timestamp line flag
+            trail_trim: Trim trailing zeroes flag
+        Return:
+            CSV string
+        """
+        return "".join(self.iter_lines(suppress_id=suppress_id, space_delim=space_delim, include_timestamp=include_timestamp, trail_trim=trail_trim))
 
     def update(self, pages = 3, pw = True):
         """
@@ -510,18 +517,43 @@ class Leaderboard:
     def get_css_path(self):
         return path.join(self.get_html_dir_path(), f"external.css")
 
-    def to_html(self, suppress_id=True, include_timestamp=False, trail_trim=True):
+    def to_html(self, suppress_id=True, include_timestamp=False, trail_trim=True, stream=False):
+        """
+        Render the leaderboard to an html page
+
+        Args:
+            suppress_id: Suppress driver ID flag
+            include_timestamp: Show the last updated time below the table
+            trail_trim: Trim trailing zeroes flag
+            stream: Write rows as they are rendered instead of building the page in memory first. Use for very large boards
+        """
         html_path = self.get_html_path()
-        html_csv_path = self.get_html_csv_path()
         css_path = self.get_css_path()
         if not path.exists(css_path):
             with open(css_path, "w") as css_file:
                 css_file.write(constants.css_string)
-        self.write_leaderboard(file_path=html_csv_path, suppress_id=suppress_id, include_timestamp=include_timestamp, trail_trim=trail_trim)
-        pandas_csv = pandas.read_csv(html_csv_path, encoding='utf-8')
-        pandas_html = pandas_csv.to_html(None, index=False, justify='center', classes="ldb-table")
-        with open(html_path, "w", encoding="utf-8") as html_file:
-            html_file.write(constants.html_string.format(ldb_html=pandas_html))
+        # Entries have no wet flag here
+        columns = constants.csv_header_no_id.split(',')[:-1]
+        if not suppress_id:
+            columns.insert(2, "ID")
+        def rows():
+            for rank, entry in enumerate(self.entry_list, start=1):
+                row = [
+                    str(rank),
+                    entry.name,
+                    entry.car,
+                    laptimetostring(entry.best_time, trail_trim),
+                    laptimetostring(entry.s1, trail_trim),
+                    laptimetostring(entry.s2, trail_trim),
+                    laptimetostring(entry.s3, trail_trim)
+                ]
+                if not suppress_id:
+                    row.insert(2, entry.id)
+                yield row
+        footer = ""
+        if include_timestamp:
+            footer = f"Last updated: {datetime.datetime.strftime(self.last_updated, '%Y-%m-%dT%H:%M:%S%z')}"
+        pj_html.write_page(html_path, columns, rows(), footer=footer, stream=stream)
         return
 
                 
@@ -539,4 +571,4 @@ def main():
     #print(embed.time)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file
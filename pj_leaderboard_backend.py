@@ -1,36 +1,115 @@
 import argparse
+import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 from enum import IntEnum
+import threading
 import requests
 import urllib.parse
-import bs4
 import json
 import datetime
+import email.utils
+import functools
+import html
 import csv
 import json
 import constants
-import dateutil
-from dateutil import parser
-from dateutil import tz
+import pj_cache
+import pj_columnar
+import pj_delta
+import pj_html
+import pj_http
+import pj_json_stream
+import pj_upload
+import os
+import re
 from os import path
-import pandas
-import pprint
 import keys
 
 
 def ms_to_string(ms:int) -> str:
-    td = datetime.timedelta(milliseconds=ms)
-    minutes = td.seconds//60
-    seconds = td.seconds - minutes*60
-    ms = td.microseconds//1000
-    minutes_str = str(minutes).rjust(2,'0')
-    seconds_str = str(seconds).rjust(2,'0')
-    ms_str = str(ms).rjust(3,'0')
-    return f"{minutes_str}:{seconds_str}.{ms_str}"
+    # Wrap at a day like timedelta(milliseconds=ms).seconds does
+    seconds, ms = divmod(ms % 86400000, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes:02}:{seconds:02}.{ms:03}"
 
 def datetime_to_ms(dt:datetime.datetime) -> int:
     ms = dt.hour*3600000 + dt.minute*60000 + dt.second*1000 + dt.microsecond//1000
     return ms
 
+@contextlib.contextmanager
+def open_atomic(file_path:str, encoding:str = "utf-8"):
+    """
+    Open a text file for writing through a temp file next to it. The temp file replaces file_path only
+    once the block finishes, so a crash mid-write leaves the previous file intact
+
+    Args:
+        file_path: File path
+        encoding: File encoding
+    """
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding=encoding) as file:
+            yield file
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def laptime_to_ms(laptime_str:str) -> int:
+    """
+    Parse a MM:SS.mmm lap time to ms. Same result as strptime(laptime_str, "%M:%S.%f") and datetime_to_ms
+    """
+    if (len(laptime_str) == 9) and (laptime_str[2] == ':') and (laptime_str[5] == '.'):
+        return int(laptime_str[0:2])*60000 + int(laptime_str[3:5])*1000 + int(laptime_str[6:9])
+    minutes_str, rest = laptime_str.split(':')
+    seconds_str, fraction_str = rest.split('.')
+    if not (0 < len(fraction_str) <= 6):
+        raise ValueError(f"Invalid lap time: {laptime_str}")
+    # %f right pads to microseconds
+    return int(minutes_str)*60000 + int(seconds_str)*1000 + int(fraction_str.ljust(6, '0'))//1000
+
+def parse_timestamp(timestamp_str:str) -> datetime.datetime:
+    """
+    Parse an ISO 8601 timestamp, i.e 2022-11-03T00:00:00+0000, or a dashboard timestamp, i.e Thu, 03 Nov 2022 00:00:00 UTC.
+    Falls back to dateutil for anything else
+    """
+    try:
+        return datetime.datetime.fromisoformat(timestamp_str)
+    except ValueError:
+        pass
+    try:
+        timestamp = email.utils.parsedate_to_datetime(timestamp_str)
+        if timestamp.tzinfo is not None:
+            return timestamp
+    except (TypeError, ValueError):
+        pass
+    # dateutil is slow to import and only needed for unusual formats
+    from dateutil import parser as dateutil_parser
+    return dateutil_parser.parse(timestamp_str)
+
+_laptime_delete_table = str.maketrans("", "", ":.")
+
+def laptimes_to_ms(laptime_strs:list[str]) -> list[int]:
+    """
+    Parse a column of lap times with laptime_to_ms.
+    A column of plain MM:SS.mmm times is converted in bulk: the separators are dropped so every time
+    parses as the single integer MMSSmmm, which is then corrected to ms
+
+    Args:
+        laptime_strs: Lap time strings
+    Return:
+        Lap times in ms
+    """
+    joined = ",".join(laptime_strs)
+    count = len(laptime_strs)
+    if (not count) or (len(joined) != count*10 - 1) or (joined[2::10] != ":"*count) or (joined[5::10] != "."*count):
+        return list(map(laptime_to_ms, laptime_strs))
+    packed = map(int, joined.translate(_laptime_delete_table).split(","))
+    return [mmssmmm - (mmssmmm//100000)*40000 for mmssmmm in packed]
+
 class Condition(IntEnum):
     DRY = 0
     WET = 1
@@ -42,16 +121,194 @@ def build_query(host:str, page:int, track:str, condition:int, start_date:datetim
     #https://simracingalliance.emperorservers.com/results?page=0&q=%2BZandvoort+%2BsessionResult.isWetSession%3A1+%2BDate%3A%3E%3D%222022-05-31T02%3A51%3A55Z%22+%2BDate%3A%3C%3D%222022-06-17T02%3A51%3A55Z%22&sort=date
     #https://simracingalliance.emperorservers.com/results?page=0&q=%2Bzandvoort+%2BsessionResult.isWetSession%3A1+%2BDate%3A%3E%3D%222022-05-31T02%3A51%3A55Z%22+%2BDate%3A%3C%3D%222022-06-17T02%3A51%3A55Z%22'
     
-    start_date_utc = start_date.astimezone(tz=tz.UTC)
-    end_date_utc = end_date.astimezone(tz=tz.UTC)
-    start_date_str = datetime.datetime.strftime(start_date_utc, "%Y-%m-%dT%H:%M:%SZ")
+    # Without a start date the url only serves as the validator key of the query, see fetch_dashboard_page
+    end_date_utc = end_date.astimezone(tz=datetime.timezone.utc)
     end_date_str = datetime.datetime.strftime(end_date_utc, "%Y-%m-%dT%H:%M:%SZ")
 
-    query = f'+{track} +sessionResult.isWetSession:{condition} +Date:>="{start_date_str}" +Date:<="{end_date_str}"'
+    query = f'+Date:<="{end_date_str}"'
+    if start_date is not None:
+        start_date_utc = start_date.astimezone(tz=datetime.timezone.utc)
+        start_date_str = datetime.datetime.strftime(start_date_utc, "%Y-%m-%dT%H:%M:%SZ")
+        query = f'+Date:>="{start_date_str}" {query}'
+    if condition is not None:
+        query = f'+sessionResult.isWetSession:{condition} {query}'
+    if track is not None:
+        query = f'+{track} {query}'
     query_quote = urllib.parse.quote_plus(query, safe='"')
     return f"https://{host}/results?page={page}&q={query_quote}&sort=date"
 
 
+# seen_timestamp: Time up to which crawl_multi saw every dashboard row of the leaderboard, see pj_cache.CrawlMarks
+CrawlResult = namedtuple("CrawlResult", "host sessions most_recent_timestamp ldb_most_recent updated seen_timestamp", defaults=(None,))
+UpdateResult = namedtuple("UpdateResult", "track_params new_sessions published")
+DashboardRow = namedtuple("DashboardRow", "filename timestamp session_type track")
+# Entries packed by pack_entries and last updated time of a leaderboard as fetched from the API
+PostBase = namedtuple("PostBase", "entries last_updated")
+
+# Attributes of a tag. A > inside a quoted value doesn't end the tag
+_tag_attrs = r"""(?:"[^"]*"|'[^']*'|[^'">])*"""
+# Start tag of an element with the row-link class, i.e <tr class="row-link" data-href="/results/220210_232907_FP">
+_row_link_start = re.compile(
+    r"""<([a-zA-Z][\w-]*)(\s(?:""" + _tag_attrs + r"""?\s)?class\s*=\s*(?:"(?:[^"]*\s)?row-link(?:\s[^"]*)?"|'(?:[^']*\s)?row-link(?:\s[^']*)?'|row-link(?=[\s/>]))""" + _tag_attrs + r""")>"""
+)
+_data_href = re.compile(r"""(?:^|\s)data-href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""")
+# Tag, comment or text
+_html_token = re.compile(r"<(/?)([a-zA-Z][\w-]*)(" + _tag_attrs + r")>|<!--(.*?)-->|([^<]+|<)", re.S)
+_void_elements = frozenset(("area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"))
+
+class _RowChild:
+    """
+    Child element of a dashboard row: its first node and its text
+    """
+    __slots__ = ("first", "texts")
+
+    def __init__(self) -> None:
+        self.first = None
+        self.texts = []
+
+def _row_children(dash_html:str, pos:int, tag_name:str):
+    """
+    Read the child nodes of a row starting right after its start tag, like Tag.contents of bs4.
+    Text and comments are kept as strings, elements as _RowChild
+
+    Return:
+        (children, position after the end tag of the row)
+    """
+    children = []
+    text = []
+    depth = 0
+    child = None
+    for token in _html_token.finditer(dash_html, pos):
+        closing, name, attrs, comment, data = token.groups()
+        if data is not None:
+            text.append(data)
+            continue
+        if text:
+            data = html.unescape("".join(text))
+            text = []
+            if depth == 0:
+                children.append(data)
+            else:
+                child.texts.append(data)
+                if child.first is None:
+                    child.first = data
+        if comment is not None:
+            if depth == 0:
+                children.append(comment)
+            elif child.first is None:
+                child.first = comment
+            continue
+        name = name.lower()
+        if closing:
+            if depth == 0:
+                if name == tag_name:
+                    return children, token.end()
+                continue
+            depth -= 1
+            continue
+        if depth == 0:
+            child = _RowChild()
+            children.append(child)
+        elif child.first is None:
+            # Element as first node. Not a string, so it can't be read as one
+            child.first = False
+        if (name not in _void_elements) and (not attrs.endswith("/")):
+            depth += 1
+    raise ValueError("Unterminated row")
+
+def _child_first_str(child) -> str:
+    if (not isinstance(child, _RowChild)) or (not isinstance(child.first, str)):
+        raise ValueError("Unexpected dashboard row layout")
+    return child.first
+
+def parse_dashboard_rows(dash_html:str) -> list[DashboardRow]:
+    """
+    Parse the results table of a dashboard page.
+    Only the rows are tokenized; the rest of the page is skipped. Pages the tokenizer can't read are
+    parsed with bs4 instead
+
+    Args:
+        dash_html: Dashboard page html
+    Return:
+        List of DashboardRows in page order
+    """
+    rows = []
+    pos = 0
+    try:
+        while True:
+            start = _row_link_start.search(dash_html, pos)
+            if not start:
+                break
+            comment = dash_html.rfind("<!--", pos, start.start())
+            if comment != -1:
+                comment_end = dash_html.find("-->", comment + 4)
+                if comment_end == -1:
+                    break
+                if comment_end > start.start():
+                    # Commented out row
+                    pos = comment_end + 3
+                    continue
+            children, pos = _row_children(dash_html, start.end(), start.group(1).lower())
+            href = _data_href.search(start.group(2))
+            filename = html.unescape(next(group for group in href.groups() if group is not None)).split('/')[2]
+            timestamp_str = _child_first_str(children[1]).strip()
+            if not isinstance(children[3], _RowChild):
+                raise ValueError("Unexpected dashboard row layout")
+            session_type = "".join(children[3].texts).strip()
+            track = _child_first_str(children[5]).strip()
+            #timestamp = datetime.datetime.strptime(timestamp_str, "%a, %d %b %Y %H:%M:%S %Z")
+            timestamp = parse_timestamp(timestamp_str)
+            rows.append(DashboardRow(filename=filename, timestamp=timestamp, session_type=session_type, track=track))
+    except (ValueError, IndexError, AttributeError):
+        return parse_dashboard_rows_bs4(dash_html)
+    if (not rows) and ("row-link" in dash_html):
+        return parse_dashboard_rows_bs4(dash_html)
+    return rows
+
+def parse_dashboard_rows_bs4(dash_html:str) -> list[DashboardRow]:
+    """
+    Parse the results table of a dashboard page with bs4
+
+    Args:
+        dash_html: Dashboard page html
+    Return:
+        List of DashboardRows in page order
+    """
+    import bs4
+    soup = bs4.BeautifulSoup(dash_html, "html.parser")
+    rows = []
+    for row in soup.select(".row-link"):
+        filename = row['data-href'].split('/')[2]
+        children = row.contents
+        timestamp_str = children[1].contents[0].strip()
+        session_type = children[3].get_text().strip()
+        track = children[5].contents[0].strip()
+        #timestamp = datetime.datetime.strptime(timestamp_str, "%a, %d %b %Y %H:%M:%S %Z")
+        timestamp = parse_timestamp(timestamp_str)
+        rows.append(DashboardRow(filename=filename, timestamp=timestamp, session_type=session_type, track=track))
+    return rows
+
+def session_has_password(host:str, filename:str) -> bool:
+    """
+    Check if a session was run in a closed lobby by looking for the password or league markers in the session page.
+    Verdicts are kept in the verdict index so each session page is fetched at most once
+
+    Args:
+        host: Host
+        filename: Session filename, i.e 220210_232907_FP
+    Return:
+        True if the session passes the password filter
+    """
+    verdict = pj_cache.verdict_index.get(host, filename)
+    if verdict:
+        return verdict.passed
+    session_res_request = pj_http.get(f"https://{host}/results/{filename}")
+    session_res_html = session_res_request.content.decode("utf-8")
+    rule = next((marker for marker in constants.password_markers if marker in session_res_html), None)
+    if (session_res_request.status_code == 200):
+        pj_cache.verdict_index.put(host, filename, passed=rule is not None, rule=rule)
+    return rule is not None
+
 class Entry:
     """
     A class representing an entry in a Leaderboard/Session
@@ -65,6 +322,8 @@ class Entry:
         s2: Best lap S2
         s3: Best lap S3
     """
+    __slots__ = ("first_name", "last_name", "short_name", "id", "car", "car_raw", "best_time", "s1", "s2", "s3", "iswet")
+
     def __init__(
             self,
             first_name = "",
@@ -103,6 +362,10 @@ class Entry:
         self.s3 = s3
         self.iswet = iswet
 
+    @property
+    def name(self) -> str:
+        return f"{self.first_name} {self.last_name} ({self.short_name})"
+
     def __str__(self, trail_trim = False) -> str:
         """
         Convert an Entry to a string
@@ -133,6 +396,194 @@ class Entry:
         tmp_list = [e for e in tmp_list if e is not None]
         return ','.join(tmp_list)
 
+def pack_entries(entries):
+    """
+    Serialize entries compactly to send them between processes.
+    String fields go into one flat list and integer fields into one typed array,
+    so pickling costs two objects instead of one per field of every entry
+
+    Args:
+        entries: Entries or None
+    Return:
+        (strings, integers) or None
+    """
+    if entries is None:
+        return None
+    strs = []
+    ints = array.array('q')
+    for entry in entries:
+        strs.extend((entry.first_name, entry.last_name, entry.short_name, entry.id, entry.car))
+        ints.extend((entry.car_raw, entry.best_time, entry.s1, entry.s2, entry.s3, entry.iswet))
+    return strs, ints
+
+def unpack_entries(packed) -> list[Entry]:
+    """
+    Rebuild the entries serialized by pack_entries
+    """
+    if packed is None:
+        return None
+    strs, ints = packed
+    return list(map(
+        Entry,
+        strs[0::5],
+        strs[1::5],
+        strs[2::5],
+        strs[3::5],
+        strs[4::5],
+        ints[0::6],
+        ints[1::6],
+        ints[2::6],
+        ints[3::6],
+        ints[4::6],
+        ints[5::6]
+    ))
+
+def post_rows(entries) -> list[dict]:
+    """
+    Rank entries by lap time into the driver dicts of the hotlap update API
+
+    Args:
+        entries: Entries
+    Return:
+        Driver dicts, fastest first
+    """
+    rows = []
+    for rank, entry in enumerate(sorted(entries, key=lambda e:e.best_time), start=1):
+        rows.append({
+            "rank" : rank,
+            "first_name" : entry.first_name,
+            "last_name" : entry.last_name,
+            "short_name" : entry.short_name,
+            "steam_id" : entry.id,
+            "car_id" : entry.car_raw,
+            "lap_time" : entry.best_time,
+            "sector_1" : entry.s1,
+            "sector_2" : entry.s2,
+            "sector_3" : entry.s3,
+        })
+    return rows
+
+def post_index(packed) -> dict[tuple, tuple[int, tuple]]:
+    """
+    Index entries packed by pack_entries like pj_delta.index_rows indexes the post_rows of the entries,
+    without building the rows
+
+    Return:
+        (steam_id, car_id) -> (rank, values of pj_delta.ROW_FIELDS) or None if a key isn't unique
+    """
+    strs, ints = packed
+    rows = list(zip(strs[3::5], ints[0::6], strs[0::5], strs[1::5], strs[2::5], ints[1::6], ints[2::6], ints[3::6], ints[4::6]))
+    rows.sort(key=lambda row:row[5])
+    index = {(row[0], row[1]): (rank, row[2:]) for rank, row in enumerate(rows, start=1)}
+    if len(index) != len(rows):
+        return None
+    return index
+
+def _entry_from_row(row:list[str]) -> Entry:
+    return Entry(
+        row[1],
+        row[2],
+        row[3],
+        row[4],
+        row[5],
+        int(row[6]),
+        laptime_to_ms(row[7]),
+        laptime_to_ms(row[8]),
+        laptime_to_ms(row[9]),
+        laptime_to_ms(row[10]),
+        int(row[11])
+    )
+
+def _entries_from_lines(lines:list[str]) -> list[Entry]:
+    """
+    Build entries from the data rows of a leaderboard csv column by column instead of row by row
+
+    Args:
+        lines: Data rows of the csv
+    Return:
+        Entries or None if the rows are not plain comma separated rows of 12 fields
+    """
+    field_count = 12
+    joined = ",".join(lines)
+    if '"' in joined:
+        return None
+    fields = joined.split(",")
+    if (len(fields) != len(lines)*field_count) or (not "".join(fields[0::field_count]).isdigit()):
+        return None
+    columns = [fields[i::field_count] for i in range(1, field_count)]
+    return list(map(
+        Entry,
+        columns[0],
+        columns[1],
+        columns[2],
+        columns[3],
+        columns[4],
+        map(int, columns[5]),
+        laptimes_to_ms(columns[6]),
+        laptimes_to_ms(columns[7]),
+        laptimes_to_ms(columns[8]),
+        laptimes_to_ms(columns[9]),
+        map(int, columns[10])
+    ))
+
+def load_leaderboard_csv(file_path:str):
+    """
+    Load a leaderboard csv written by Leaderboard.write_leaderboard
+
+    Args:
+        file_path: Path to csv
+    Return:
+        (entry list, last updated time, most recent session timestamp of each host)
+    """
+    # Universal newlines like csv.reader on the file. str.splitlines would also split names on \x85, \u2028 and such
+    with open(file_path, "r", encoding='utf-8') as csv_file:
+        lines = csv_file.read().split("\n")
+    del lines[0]
+    # Entry rows start with their rank, trailer rows with Last updated? or ?MR?
+    data_lines = [line for line in lines if line[:1].isdigit()]
+    trailer_lines = [line for line in lines if not line[:1].isdigit()]
+
+    entry_list = _entries_from_lines(data_lines)
+    if entry_list is None:
+        entry_list = [_entry_from_row(row) for row in csv.reader(data_lines, delimiter=',')]
+
+    last_updated_str = ""
+    most_recent_sessions = {}
+    for row in csv.reader(trailer_lines, delimiter=','):
+        if not row:
+            continue
+        if ("Last updated" in row[0]):
+            last_updated_str = row[0].split("?")[1]
+        elif ("?MR?" in row[0]):
+            most_recent_sessions[row[1]] = row[2]
+    #last_updated = datetime.datetime.strptime(last_updated_str, "%Y-%m-%dT%H:%M:%S%z")
+    last_updated = parse_timestamp(last_updated_str)
+    return entry_list, last_updated, most_recent_sessions
+
+def best_laps(laps) -> dict[tuple[int, int], tuple[int, int, int, int]]:
+    """
+    Find the best valid lap of every driver in one pass over the laps of a session.
+    On equal lap times the later lap wins
+
+    Args:
+        laps: Laps of the session json. Any iterable of lap dicts
+    Return:
+        (carId, driverIndex) -> (laptime, S1, S2, S3)
+    """
+    lap_bests = {}
+    for lap in laps:
+        if not lap['isValidForBest']:
+            continue
+        key = (lap['carId'], lap['driverIndex'])
+        laptime = lap['laptime']
+        #6 hours max session time (Arbitrary initial minimum)
+        if laptime <= lap_bests.get(key, (3599999,))[0]:
+            splits = lap['splits']
+            lap_bests[key] = (laptime, splits[0], splits[1], splits[2])
+        elif key not in lap_bests:
+            lap_bests[key] = (3599999, 0, 0, 0)
+    return lap_bests
+
 class Session:
     """
     A class representing results of a single session
@@ -146,13 +597,20 @@ class Session:
     #session_json_prefix = f"https://simracingalliance.emperorservers.com/results/download/"
     #simresults_prefix = f"https://simresults.net/remote/csv?result=https%3A%2F%2Fsimracingalliance.emperorservers.com%2Fresults%2Fdownload%2F"
     
-    def __init__(self, host:str = None, filename:str = None) -> None:
+    def __init__(self, host:str = None, filename:str = None, columnar:bool = None, process_pool:ProcessPoolExecutor = None) -> None:
         """
         Initialize a Session
 
         Args:
             filename: File name of server results json, i.e 220210_232907_FP
+            columnar: Use the NumPy lap engine. Defaults to constants.columnar_laps
+            process_pool: Parse the session json in this pool instead of the calling thread
         """
+        self.host = host
+        self.columnar = columnar
+        self.process_pool = process_pool
+        # Results as serialized by the worker process. See pack_results
+        self._packed_results = None
         self.filename = filename
         self.results:list[Entry] = []
         self.dash_url = f"https://{host}/results"
@@ -164,15 +622,112 @@ class Session:
     def get_session_results(self):
         """
         Fetch results of a session from Emperor servers and populate the Session instance with that result.
+        Results already in the session cache are read from disk instead.
         Ignores sessions with no laps.
         """
+        cached_file = pj_cache.session_cache.open(self.host, self.filename)
+        if cached_file:
+            with cached_file:
+                if self.process_pool:
+                    self.read_process(file_path=cached_file.name)
+                else:
+                    self.read_file(cached_file)
+            return
+
         session_json_url = f"{self.session_json_prefix}{self.filename}.json"
-        session_json = requests.get(session_json_url, allow_redirects=True).content.decode("utf-8")
+        with pj_http.get(session_json_url, stream=True) as response:
+            content_length = response.headers.get("Content-Length")
+            if self.use_stream(int(content_length) if content_length else None):
+                with pj_cache.session_cache.writer(self.host, self.filename) as cache_writer:
+                    self.read_stream(cache_writer.tee(response.iter_content(constants.stream_chunk_size)))
+                    cache_writer.commit()
+            else:
+                session_json_raw = response.content
+                if self.process_pool:
+                    self.read_process(session_json_raw=session_json_raw)
+                else:
+                    self.read_json(session_json_raw)
+                pj_cache.session_cache.put(self.host, self.filename, session_json_raw)
+
+    def read_file(self, file):
+        """
+        Populate the Session from a session json file. Large files are streamed
+
+        Args:
+            file: Binary file object
+        """
+        if self.use_stream(os.fstat(file.fileno()).st_size):
+            self.read_stream(iter(functools.partial(file.read, constants.stream_chunk_size), b""))
+        else:
+            self.read_json(file.read())
+
+    def read_process(self, file_path:str = None, session_json_raw:bytes = None):
+        """
+        Populate the Session by parsing the session json in the process pool
+
+        Args:
+            file_path: Path of the session json file
+            session_json_raw: Raw session json. Used if file_path isn't given
+        """
+        future = self.process_pool.submit(parse_session_process, self.host, self.filename, self.columnar, file_path, session_json_raw)
+        self.track, self.iswet, self._packed_results = future.result()
+        self.results = unpack_entries(self._packed_results)
+
+    def pack_results(self):
+        """
+        Get the results serialized by pack_entries
+        """
+        if self._packed_results is None:
+            self._packed_results = pack_entries(self.results)
+        return self._packed_results
+
+    def read_json(self, session_json_raw:bytes):
+        """
+        Populate the Session from a complete session json document
+
+        Args:
+            session_json_raw: Raw session json
+        """
+        session_json = session_json_raw.decode("utf-8")
         session_json_data = json.loads(session_json)
+        laps = session_json_data['laps']
+        if self.use_columnar(laps):
+            lap_bests = pj_columnar.best_laps(pj_columnar.LapColumns(laps))
+        else:
+            lap_bests = best_laps(laps)
+        self.set_results(session_json_data, lap_bests, len(laps))
+
+    def read_stream(self, chunks):
+        """
+        Populate the Session from a session json arriving in chunks.
+        Laps are folded into best laps as they are read, so memory is bounded by the number of drivers
+
+        Args:
+            chunks: Iterable of bytes of the session json
+        """
+        lap_count = 0
+        def count_laps(laps):
+            nonlocal lap_count
+            for lap in laps:
+                lap_count += 1
+                yield lap
+        session_json_data = pj_json_stream.read_session(chunks, lambda laps: best_laps(count_laps(laps)))
+        self.set_results(session_json_data, session_json_data['laps'], lap_count)
+
+    def use_stream(self, size:int) -> bool:
+        """
+        Check if a session json of a given size should be streamed. Unknown sizes are streamed
+        """
+        return constants.stream_session_json and ((size is None) or (size >= constants.stream_min_bytes))
+
+    def set_results(self, session_json_data:dict, lap_bests:dict[tuple[int, int], tuple[int, int, int, int]], lap_count:int):
+        """
+        Populate the Session from the decoded session json and its best laps.
+        Ignores sessions with no laps.
+        """
         self.track = session_json_data['trackName']
         self.iswet = session_json_data['sessionResult']['isWetSession']
-        laps = session_json_data['laps']
-        if not laps:
+        if not lap_count:
             print(f"DB: NO LAPS || {self.session_res_prefix}{self.filename}", flush=True)
             return
 
@@ -180,50 +735,50 @@ class Session:
         # Each car has a list of drivers.
         # An Entry in the Session is made from pair of driver and car and lap times of that pair
         leaderboard_lines = session_json_data['sessionResult']['leaderBoardLines']
+        self.add_results(leaderboard_lines, lap_bests)
+
+    def use_columnar(self, laps:list[dict]) -> bool:
+        """
+        Check if the laps should go through the NumPy lap engine.
+        Short sessions are faster in plain Python
+        """
+        columnar = constants.columnar_laps if self.columnar is None else self.columnar
+        return columnar and pj_columnar.available() and (len(laps) >= constants.columnar_min_laps)
+
+    def add_results(self, leaderboard_lines:list[dict], lap_bests:dict[tuple[int, int], tuple[int, int, int, int]]):
+        """
+        Make an Entry for every driver of every car that has a valid lap
+
+        Args:
+            leaderboard_lines: sessionResult.leaderBoardLines of the session json
+            lap_bests: Best laps of the session. See best_laps
+        """
         for line in leaderboard_lines:
             car = line['car']
             drivers = car['drivers']
             driver_index = 0
             for driver in drivers:
+                car_id = car['carId']
+                lap_best = lap_bests.get((car_id, driver_index))
+                driver_index += 1
+                if lap_best is None:
+                    continue
                 entry = Entry()
                 car_model = car['carModel']
                 entry.car_raw = car_model
-                car_id = car['carId']
                 if car_model in constants.car_model_dict:
                     entry.car = constants.car_model_dict[car_model]
                 else:
                     entry.car = "1996 Toyota Corolla"
                 
-                driver_name = f"{driver['firstName']} {driver['lastName']} ({driver['shortName']})"
-                entry.name = driver_name
                 entry.first_name = driver['firstName']
                 entry.last_name = driver['lastName']
                 entry.short_name = driver['shortName']
                 entry.iswet = self.iswet
                 
                 entry.id = driver['playerId']
-                
-                min_lap = 3599999 #6 hours max session time (Arbitrary initial minimum)
-                min_lap_s1 = 0
-                min_lap_s2 = 0
-                min_lap_s3 = 0
-                valid_lap_set = False
-                for lap in laps:
-                    if ( (lap['isValidForBest']) and (car_id == lap['carId']) and (driver_index == lap['driverIndex']) ):
-                        valid_lap_set = True
-                        if (lap['laptime'] <= min_lap):
-                            min_lap_s1 = lap['splits'][0]
-                            min_lap_s2 = lap['splits'][1]
-                            min_lap_s3 = lap['splits'][2]
-                            min_lap = lap['laptime']
-                entry.best_time = min_lap
-                entry.s1 = min_lap_s1
-                entry.s2 = min_lap_s2
-                entry.s3 = min_lap_s3
-                
-                if valid_lap_set:
-                    self.results.append(entry)
-                driver_index += 1
+                entry.best_time, entry.s1, entry.s2, entry.s3 = lap_best
+                self.results.append(entry)
 
     def __str__(self, suppress_id:bool = False) -> str:
         """
@@ -271,6 +826,183 @@ class Session:
         return js
 
 
+def parse_session_process(host:str, filename:str, columnar:bool, file_path:str = None, session_json_raw:bytes = None):
+    """
+    Parse a session json in a worker process. See Session.read_process
+
+    Return:
+        (track, iswet, results serialized by pack_entries)
+    """
+    session = Session(host, filename, columnar)
+    if file_path is None:
+        session.read_json(session_json_raw)
+    else:
+        with open(file_path, "rb") as file:
+            session.read_file(file)
+    return session.track, session.iswet, pack_entries(session.results)
+
+def merge_process(track:str, packed_entries, merges):
+    """
+    Merge sessions into the entries of a leaderboard in a worker process. See merge_crawls_process
+
+    Args:
+        track: Track of the leaderboard
+        packed_entries: Entries of the leaderboard serialized by pack_entries
+        merges: (serialized results of each session, sort afterwards) of each crawl, in merge order
+    Return:
+        Merged entries serialized by pack_entries
+    """
+    leaderboard = Leaderboard(track=track, entry_list=unpack_entries(packed_entries))
+    for packed_results_list, sort in merges:
+        for packed_results in packed_results_list:
+            session = Session()
+            session.results = unpack_entries(packed_results)
+            leaderboard.merge_session(session)
+        if sort and leaderboard.entry_list:
+            leaderboard.entry_list.sort(key=lambda x: x.best_time)
+    return pack_entries(leaderboard.entry_list)
+
+def start_process_pool(processes:int) -> ProcessPoolExecutor:
+    """
+    Start a pool of worker processes for session parsing and leaderboard merging.
+    The workers are started right away, before the crawl threads exist, because forking while
+    other threads run can copy locks they hold into the workers
+
+    Args:
+        processes: Number of worker processes
+    """
+    process_pool = ProcessPoolExecutor(max_workers=processes)
+    process_pool.submit(os.getpid).result()
+    return process_pool
+
+
+def dashboard_pages(fetch_rows, pages:int, executor:ThreadPoolExecutor = None):
+    """
+    Yield (page, rows) until pages is reached or a page doesn't exist.
+    Prefetches the next page on the executor if there is one.
+
+    Args:
+        fetch_rows: Function taking a page index and returning its DashboardRows or None if the page doesn't exist
+        pages: Max number of pages
+        executor: Executor to prefetch on
+    """
+    if executor:
+        next_page = executor.submit(fetch_rows, 0)
+    for page in range(0, pages):
+        if executor:
+            rows = next_page.result()
+        else:
+            rows = fetch_rows(page)
+        if rows is None:
+            return
+        if executor and (page+1 < pages):
+            next_page = executor.submit(fetch_rows, page+1)
+        yield page, rows
+
+def row_results(host:str, rows:list[DashboardRow], pw:bool, wants_session, executor:ThreadPoolExecutor = None, process_pool:ProcessPoolExecutor = None):
+    """
+    Yield (row, passed password filter, downloaded Session or None) for every row of a dashboard page in order.
+    Rows are fetched on the executor if there is one, otherwise when the consumer gets to them.
+
+    Args:
+        host: Host
+        rows: Rows of a dashboard page
+        pw: Password restriction flag
+        wants_session: Function taking a row and returning True if its session should be downloaded
+        executor: Executor to download on
+        process_pool: Pool to parse the sessions in. See Session.read_process
+    """
+    if not executor:
+        for row in rows:
+            yield (row, *fetch_row(host, row, pw, wants_session, process_pool))
+        return
+    futures = [executor.submit(fetch_row, host, row, pw, wants_session, process_pool) for row in rows]
+    try:
+        for row, future in zip(rows, futures):
+            yield (row, *future.result())
+    finally:
+        # Consumer stopped early. Don't download the rest of the page
+        for future in futures:
+            future.cancel()
+
+def fetch_row(host:str, row:DashboardRow, pw:bool, wants_session, process_pool:ProcessPoolExecutor = None):
+    """
+    Check the password filter of a row and download its session if wanted
+
+    Return:
+        (passed password filter, Session or None)
+    """
+    if pw and not session_has_password(host, row.filename):
+        return False, None
+    if wants_session(row):
+        session = Session(host, row.filename, process_pool=process_pool)
+        session.get_session_results()
+        return True, session
+    return True, None
+
+def fetch_dashboard_page(dash_query:str, host:str, page:int, leaderboards:list["Leaderboard"], conditional:bool = False, validator_key:str = None) -> list[DashboardRow]:
+    """
+    Fetch and parse a page of the results dashboard.
+    With conditional, the first page is requested with the validators of the last committed crawl. The dashboard
+    is sorted by date, so an unchanged first page means there are no new sessions and nothing is parsed.
+    Validators of a changed first page are staged for the leaderboards, see commit_validators
+
+    Args:
+        dash_query: Url of the page. See build_query
+        host: Host
+        page: Page index
+        leaderboards: Leaderboards the page is crawled for
+        conditional: Fetch the first page conditionally
+        validator_key: Url of the page without its start date. Committing the validators of dash_query drops those
+            of older urls with the same key, i.e the query of the previous watermark
+    Return:
+        Rows of the page or None if the page doesn't exist or wasn't modified
+    """
+    conditional = conditional and (page == 0)
+    headers = pj_cache.validator_cache.headers(dash_query) if conditional else {}
+    dash_request = pj_http.get(dash_query, headers=headers)
+    if (dash_request.status_code == 304):
+        print(f"304: https://{host}/results not modified", flush=True)
+        return None
+    if (dash_request.status_code == 404):
+        print(f"404: https://{host}/results?page={page}", flush=True)
+        return None
+    if conditional:
+        pj_cache.validator_cache.stage(dash_query, dash_request.headers, key=validator_key)
+        for leaderboard in leaderboards:
+            leaderboard.validator_urls.append(dash_query)
+    return parse_dashboard_rows(dash_request.content.decode("utf-8"))
+
+def commit_validators(leaderboards:list["Leaderboard"], succeeded:list[bool]):
+    """
+    Commit the validators staged while fetching leaderboards. A url is only committed if every leaderboard
+    that fetched it succeeded, otherwise the next run fetches it again in full
+
+    Args:
+        leaderboards: Leaderboards of the run
+        succeeded: For each leaderboard, True if it was posted or had nothing to post
+    """
+    failed_urls = {url for leaderboard, ok in zip(leaderboards, succeeded) if not ok for url in leaderboard.validator_urls}
+    urls = {url for leaderboard in leaderboards for url in leaderboard.validator_urls} - failed_urls
+    pj_cache.validator_cache.commit(urls)
+    pj_cache.validator_cache.discard(failed_urls)
+    for leaderboard in leaderboards:
+        leaderboard.validator_urls = []
+
+def commit_crawl_marks(leaderboards:list["Leaderboard"], succeeded:list[bool]):
+    """
+    Record the crawl marks staged by Leaderboard.accept_crawl of the leaderboards that were posted or had nothing to post.
+    The marks of a leaderboard that failed to post are dropped, so the next crawl hands it the same sessions again
+
+    Args:
+        leaderboards: Leaderboards of the run
+        succeeded: For each leaderboard, True if it was posted or had nothing to post
+    """
+    for leaderboard, ok in zip(leaderboards, succeeded):
+        if ok:
+            pj_cache.crawl_marks.put(leaderboard.get_crawl_key(), leaderboard.crawl_marks)
+        leaderboard.crawl_marks = {}
+
 class Leaderboard:
     """
     A class representing a leaderboard for a certain track
@@ -291,7 +1023,7 @@ class Leaderboard:
         file_path:str = "", 
         condition:Condition = Condition.ALL, 
         season:int = 4,
-        most_recent_sessions = {}
+        most_recent_sessions = None
     ) -> None:
         """
         Init the Leaderboard
@@ -309,7 +1041,17 @@ class Leaderboard:
         self.file_path = file_path
         self.condition = condition
         self.season = season
-        self.most_recent_sessions = most_recent_sessions
+        self.most_recent_sessions = most_recent_sessions if most_recent_sessions is not None else {}
+        self._entry_index:dict[tuple[str, int], list[Entry]] = None
+        self._entry_index_size = 0
+        # Urls whose validators were staged while fetching this leaderboard. See commit_validators
+        self.validator_urls:list[str] = []
+        # Host -> time up to which the shared crawl saw every row of this leaderboard. See commit_crawl_marks
+        self.crawl_marks:dict[str, str] = {}
+        # Sessions merged by this instance. See accept_crawl
+        self.new_sessions = 0
+        # Version of the leaderboard on the API, set by get_leaderboard. See to_post_delta_json
+        self.post_base:PostBase = None
 
     @classmethod
     def read_leaderboard(cls, track:str, file_path = None):
@@ -321,68 +1063,35 @@ class Leaderboard:
         Return:
             Populated instance of class
         """
-        entry_list = []
-        last_updated_str = ""
-        with open(file_path, "r", encoding='utf-8') as csv_file:
-            line_count = 0
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            most_recent_sessions = {}
-            for row in csv_reader:
-                if line_count == 0:
-                    line_count += 1
-                    continue
-                else:
-                    if ("Last updated" in row[0]):
-                        last_updated_str = row[0].split("?")[1]
-                        line_count += 1
-                        continue
-                    elif ("?MR?" in row[0]):
-                        host = row[1]
-                        timestamp = row[2]
-                        most_recent_sessions[host] = timestamp
-                        continue
-
-                    best_time = datetime.datetime.strptime(row[7], "%M:%S.%f")
-                    s1 = datetime.datetime.strptime(row[8], "%M:%S.%f")
-                    s2 = datetime.datetime.strptime(row[9], "%M:%S.%f")
-                    s3 = datetime.datetime.strptime(row[10], "%M:%S.%f")
-                    wet = int(row[11])
-                    
-                    entry = Entry(
-                        first_name=row[1],
-                        last_name=row[2],
-                        short_name=row[3],
-                        id=row[4],
-                        car=row[5],
-                        car_raw=int(row[6]),
-                        best_time=datetime_to_ms(best_time),
-                        s1=datetime_to_ms(s1),
-                        s2=datetime_to_ms(s2),
-                        s3=datetime_to_ms(s3),
-                        iswet=wet
-                    )
-                    #print(entry)
-                    entry_list.append(entry)
-                line_count += 1
-        #last_updated = datetime.datetime.strptime(last_updated_str, "%Y-%m-%dT%H:%M:%S%z")
-        last_updated = dateutil.parser.parse(last_updated_str)
+        entry_list, last_updated, most_recent_sessions = load_leaderboard_csv(file_path)
         return cls(file_path=file_path, entry_list=entry_list, last_updated=last_updated, track=track, most_recent_sessions=most_recent_sessions)
 
     @classmethod
     def get_leaderboard(cls, season:int, track:str, condition:Condition = Condition.DRY):
         #https://www.simracingalliance.com/api/leaderboard/get/zandvoort/1?season=3
-        url = f"https://www.simracingalliance.com/api/hotlap/get/{constants.pretty_name_raw_name[track]}/{int(condition)}?season={season}"
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': f'Bearer {keys.SRA_API_KEY}'}
-        r = requests.get(url=url, headers=headers)
-        c = r.content.decode(encoding='utf-8')
+        url = f"{constants.sra_api_url}/get/{constants.pretty_name_raw_name[track]}/{int(condition)}?season={season}"
+        headers = api_headers()
+        r = pj_http.get(url, headers={**headers, **pj_cache.validator_cache.headers(url, with_body=True)})
+        content = None
+        if (r.status_code == 304):
+            print("Leaderboard not modified", flush=True)
+            content = pj_cache.validator_cache.body(url)
+            if content is None:
+                r = pj_http.get(url, headers=headers)
+        if content is None:
+            content = r.content
+            pj_cache.validator_cache.stage(url, r.headers, body=content)
+        c = content.decode(encoding='utf-8')
         ldb_dict = json.loads(c)
         if (("error" in ldb_dict) and ("does not exist" in ldb_dict["error"])):
             print("Leaderboard does not exist. Returning empty leaderboard", flush=True)
-            return cls(track=track, condition=condition, last_updated=datetime.datetime.fromtimestamp(0,tz=tz.UTC), most_recent_sessions=constants.season_starting_session_timestamps[season], season=season)
+            leaderboard = cls(track=track, condition=condition, last_updated=datetime.datetime.fromtimestamp(0,tz=datetime.timezone.utc), most_recent_sessions=dict(constants.season_starting_session_timestamps[season]), season=season)
+            leaderboard.validator_urls.append(url)
+            return leaderboard
 
         ldb_data = ldb_dict['data']['leaderboard_data']
         last_updated_str = ldb_dict['data']['leaderboard']['last_updated_iso_8601']
-        last_updated = dateutil.parser.parse(last_updated_str).astimezone(tz.UTC)
+        last_updated = parse_timestamp(last_updated_str).astimezone(datetime.timezone.utc)
         most_recent_sessions = ldb_dict['data']['leaderboard']['most_recent_sessions']
         entry_list:list[Entry] = []
         for ldb_entry in ldb_data:
@@ -407,7 +1116,10 @@ class Leaderboard:
 
             entry_list.append(entry)
 
-        return cls(entry_list=entry_list, track=track, condition=condition, last_updated=last_updated, season=season, most_recent_sessions=most_recent_sessions)
+        leaderboard = cls(entry_list=entry_list, track=track, condition=condition, last_updated=last_updated, season=season, most_recent_sessions=most_recent_sessions)
+        leaderboard.validator_urls.append(url)
+        leaderboard.post_base = PostBase(entries=pack_entries(entry_list), last_updated=last_updated_str)
+        return leaderboard
 
 
     def write_leaderboard(self, file_path: None, trail_trim = False):
@@ -423,13 +1135,34 @@ class Leaderboard:
         """
         if not file_path:
             file_path = self.file_path
-        with open(file_path, "w", encoding="utf-8") as file:
+        with open_atomic(file_path) as file:
+            self.write_csv(file, trail_trim=trail_trim)
             last_updated_str = datetime.datetime.strftime(self.last_updated, "%Y-%m-%dT%H:%M:%S%z")
-            file.write(self.__str__(trail_trim=trail_trim))
             file.write(f"Last updated?{last_updated_str}\n")
             for host in constants.host_list:
                 file.write(f"?MR?,{host},{self.most_recent_sessions[host]}\n")
 
+    def iter_csv_lines(self, trail_trim = False):
+        """
+        Yield the csv of the leaderboard line by line, header first
+
+        Args:
+            trail_trim: Trim trailing zeroes flag
+        """
+        yield constants.csv_header + "\n"
+        for rank, entry in enumerate(self.entry_list or [], start=1):
+            yield f"{rank},{entry.__str__(trail_trim=trail_trim)}\n"
+
+    def write_csv(self, file, trail_trim = False):
+        """
+        Write the csv of the leaderboard to a file or buffer without building it in memory
+
+        Args:
+            file: Text file object, i.e an open file or io.StringIO
+            trail_trim: Trim trailing zeroes flag
+        """
+        file.writelines(self.iter_csv_lines(trail_trim=trail_trim))
+
     def __str__(self, trail_trim = False) -> str:
         """
         Convert the leaderboard to a csv string
@@ -440,31 +1173,74 @@ class Leaderboard:
         Return:
             CSV string
         """
+        return "".join(self.iter_csv_lines(trail_trim=trail_trim))
 
-        leaderboard_str = constants.csv_header + "\n"
-        rank = 1
-        for entry in self.entry_list:
-            leaderboard_str += f"{rank},{entry.__str__(trail_trim=trail_trim)}\n"
-            rank += 1
-        return leaderboard_str
-
-    def update(self, host:str, pages, pw = True, condition:Condition = Condition.ALL) -> bool:
+    def update(self, host:str, pages, pw = True, condition:Condition = Condition.ALL, workers:int = 1, process_pool:ProcessPoolExecutor = None) -> bool:
         """
         Update the leaderboard using data fetched from the server
 
         Args:
             pages: Number of pages to go through. See https://simracingalliance.emperorservers.com/results
             pw: Password restriction flag
+            workers: Number of download threads. See crawl
+            process_pool: Pool to parse sessions in. See crawl
+        """
+        crawl_result = self.crawl(host=host, pages=pages, pw=pw, workers=workers, process_pool=process_pool)
+        return self.merge_crawl(crawl_result, condition=condition)
+
+    def update_concurrent(self, hosts:list[str], pages, pw = True, condition:Condition = Condition.ALL, workers:int = 1, process_pool:ProcessPoolExecutor = None) -> bool:
+        """
+        Update the leaderboard from several hosts at once.
+        Every host is crawled in its own thread, then the results are merged in host order
+        so the leaderboard ends up the same as with sequential update calls.
+
+        Args:
+            hosts: Hosts to crawl
+            pages: Number of pages to go through. See https://simracingalliance.emperorservers.com/results
+            pw: Password restriction flag
+            workers: Number of download threads per host. See crawl
+            process_pool: Pool to parse sessions in. See crawl
+        """
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            futures = [executor.submit(self.crawl, host=host, pages=pages, pw=pw, workers=workers, process_pool=process_pool) for host in hosts]
+            crawl_results = [future.result() for future in futures]
+        updated = False
+        for crawl_result in crawl_results:
+            print(f"Merging: {crawl_result.host}", flush=True)
+            updated |= self.merge_crawl(crawl_result, condition=condition)
+        return updated
+
+    def crawl(self, host:str, pages, pw = True, workers:int = 1, process_pool:ProcessPoolExecutor = None) -> CrawlResult:
+        """
+        Walk the results dashboard of a host and download every new session for this leaderboard.
+        Doesn't modify the leaderboard so it can be run for several hosts at the same time.
+
+        With workers > 1 the crawl is pipelined: the next dashboard page is prefetched and the sessions
+        of the current page are downloaded over a pool of that many threads.
+        Rows are still consumed in dashboard order, so the early stop and the merge order don't change.
+
+        Without a page override the dashboard query starts at the most recent session of the leaderboard instead
+        of the season start. The host search seeks to it, so the walk ends at the last page with new sessions.
+
+        Args:
+            host: Host to crawl
+            pages: Number of pages to go through. See https://simracingalliance.emperorservers.com/results
+            pw: Password restriction flag
+            workers: Number of download threads. 1 to crawl sequentially
+            process_pool: Parse the session json in this pool of processes instead of the download threads
+        Return:
+            CrawlResult to pass to merge_crawl
         """
         # Flow:
         # Scrape result page html -> Parse result table
         # For each entry get session filename, session html
         # Session html for checking password restriction
         # Pass session filename to Session object and call get_session_results
-        # Update leaderboard with Session object
 
         #https://accsm.simracingalliance.com/results?page=0&q=zandvoort&sort=date
 
+        # Without a page override the first page is fetched conditionally. Unchanged means no new sessions
+        conditional = not pages
         if not pages:
             pages = 8000
 
@@ -474,99 +1250,139 @@ class Leaderboard:
         processed_all_new = False
         most_recent_timestamp:datetime.datetime = None
         if host in self.most_recent_sessions:
-            ldb_most_recent:datetime.datetime = dateutil.parser.parse(self.most_recent_sessions[host])
+            ldb_most_recent:datetime.datetime = parse_timestamp(self.most_recent_sessions[host])
         else:
-            ldb_most_recent:datetime.datetime = dateutil.parser.parse("1970-01-01T00:00:00Z")
+            ldb_most_recent:datetime.datetime = parse_timestamp("1970-01-01T00:00:00Z")
         updated = False
-        for page in range(0, pages):
-            print(f"=====Processing page{page+1}=====", flush=True)
-            dash_query = build_query(
-                host=host, 
-                page=page, 
-                track=self.track_raw, 
-                condition=int(self.condition), 
-                start_date=constants.season_start_dates[self.season],
-                end_date=constants.season_end_dates[self.season]
-            )
-            dash_request = requests.get(dash_query)
-            #dash_request = requests.get(f"{dash_url}?page={page}&q={self.track_raw}&sort=date", allow_redirects=True)
-            if (dash_request.status_code == 404):
-                print(f"404: {dash_url}?page={page}", flush=True)
-                break
-            dash_html = dash_request.content.decode("utf-8")
-            soup = bs4.BeautifulSoup(dash_html, "html.parser")
-            rows = soup.select(".row-link")
-
-            for row in rows:
-                filename = row['data-href'].split('/')[2]
-                #track_excludes = constants.session_exclude[self.track]
-                if ((self.track in constants.session_exclude) and (filename in constants.session_exclude[self.track])):
-                    print(f"DB: Excluded session || {session_res_prefix}{filename}", flush=True)
-                    continue
-                session_res_url = f"{session_res_prefix}{filename}"
-                session_res_html = requests.get(session_res_url, allow_redirects=True).content.decode("utf-8")
-                if (
-                    pw and
-                    ("assword: sra" not in session_res_html) and 
-                    ("SRA League race" not in session_res_html) and
-                    ("entry list" not in session_res_html)
-                ):
-                    print(f"DB: No password || {session_res_prefix}{filename}", flush=True)
-                    continue
-                print(f"Processing: {session_res_prefix}{filename}", flush=True)
-                children = row.contents
-                timestamp_str = children[1].contents[0].strip()
-                session_type = children[3]
-                track = children[5].contents[0].strip()
-                #timestamp = datetime.datetime.strptime(timestamp_str, "%a, %d %b %Y %H:%M:%S %Z")
-                timestamp = dateutil.parser.parse(timestamp_str)
-                delta = timestamp - self.last_updated
-                if not most_recent_timestamp:
-                    most_recent_timestamp = timestamp
-
-                if ( (track == self.track) and ((pages != 8000) or (timestamp >= ldb_most_recent)) ):   #If track matches and new
-                    updated = True
-                    session = Session(host, filename)
-                    session.get_session_results()
-                    self.track_raw = session.track
-                    if not session.results:
+        sessions:list[Session] = []
+        start_date = constants.season_start_dates[self.season]
+        if (pages == 8000):
+            start_date = max(start_date, ldb_most_recent)
+            if (start_date > constants.season_end_dates[self.season]):
+                print("Most recent session is past the season end. Nothing to crawl", flush=True)
+                return CrawlResult(host=host, sessions=sessions, most_recent_timestamp=None, ldb_most_recent=ldb_most_recent, updated=False)
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            fetch_rows = functools.partial(self.fetch_dashboard_rows, host, conditional=conditional, start_date=start_date)
+            # The session at the watermark was merged by the previous crawl. Only newer ones are new
+            wants_session = lambda row: (row.track == self.track) and ((pages != 8000) or (row.timestamp > ldb_most_recent))
+            for page, rows in dashboard_pages(fetch_rows, pages, executor):
+                print(f"=====Processing page{page+1}=====", flush=True)
+                if not rows:
+                    break
+                kept_rows = []
+                for row in rows:
+                    #track_excludes = constants.session_exclude[self.track]
+                    if ((self.track in constants.session_exclude) and (row.filename in constants.session_exclude[self.track])):
+                        print(f"DB: Excluded session || {session_res_prefix}{row.filename}", flush=True)
                         continue
-                    if (condition != Condition.ALL):
-                        if (self.condition != session.iswet):
-                            print(f"DB: Condition doesn't match || {session_res_prefix}{filename}", flush=True)
-                            continue
-                    if not self.entry_list:
-                        self.entry_list = session.results
+                    kept_rows.append(row)
+                for row, passed, session in row_results(host, kept_rows, pw, wants_session, executor, process_pool):
+                    if not passed:
+                        print(f"DB: No password || {session_res_prefix}{row.filename}", flush=True)
                         continue
-                    for session_entry in session.results:
-                        found_flag = False
-                        for leaderboard_entry in self.entry_list:
-                            # If car and ID match
-                            if ( (leaderboard_entry.id == session_entry.id) and (leaderboard_entry.car_raw == session_entry.car_raw) ):
-                                found_flag = True
-                                if (leaderboard_entry.best_time > session_entry.best_time):
-                                    leaderboard_entry.best_time = session_entry.best_time
-                                    leaderboard_entry.s1 = session_entry.s1
-                                    leaderboard_entry.s2 = session_entry.s2
-                                    leaderboard_entry.s3 = session_entry.s3
-                        
-                        #If session entry is not in leaderboard entry
-                        if not found_flag:
-                            self.entry_list.append(session_entry)
-                else:
-                    if (track != self.track):
-                        print(f"DB: Track doesn't match || {session_res_prefix}{filename}", flush=True)
-                    elif (timestamp <= ldb_most_recent):
-                        print(f"DB: Old session || {session_res_prefix}{filename}", flush=True)
-                        if (pages==8000):
-                            print("Processed all new sessions. Stopping...", flush=True)
-                            processed_all_new = True
-                            break
+                    print(f"Processing: {session_res_prefix}{row.filename}", flush=True)
+                    timestamp = row.timestamp
+                    if not most_recent_timestamp:
+                        most_recent_timestamp = timestamp
+
+                    if session is not None:   #If track matches and new
+                        updated = True
+                        sessions.append(session)
                     else:
-                        print(f"DB: Unknown error || {session_res_prefix}{filename}", flush=True)
-            print(f"=====Finished page{page+1}=====", flush=True)
-            if processed_all_new:
-                break
+                        if (row.track != self.track):
+                            print(f"DB: Track doesn't match || {session_res_prefix}{row.filename}", flush=True)
+                        elif (timestamp <= ldb_most_recent):
+                            print(f"DB: Old session || {session_res_prefix}{row.filename}", flush=True)
+                            if (pages==8000):
+                                print("Processed all new sessions. Stopping...", flush=True)
+                                processed_all_new = True
+                                break
+                        else:
+                            print(f"DB: Unknown error || {session_res_prefix}{row.filename}", flush=True)
+                print(f"=====Finished page{page+1}=====", flush=True)
+                if processed_all_new:
+                    break
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        return CrawlResult(
+            host=host,
+            sessions=sessions,
+            most_recent_timestamp=most_recent_timestamp,
+            ldb_most_recent=ldb_most_recent,
+            updated=updated
+        )
+
+    def fetch_dashboard_rows(self, host:str, page:int, conditional:bool = False, start_date:datetime.datetime = None) -> list[DashboardRow]:
+        """
+        Fetch a page of the results dashboard, filtered for this leaderboard
+
+        Args:
+            host: Host
+            page: Page index
+            conditional: Fetch the first page conditionally. See fetch_dashboard_page
+            start_date: Oldest session to list. Defaults to the season start
+        Return:
+            Rows of the page or None if the page doesn't exist or wasn't modified
+        """
+        dash_query = build_query(
+            host=host, 
+            page=page, 
+            track=self.track_raw, 
+            condition=int(self.condition), 
+            start_date=start_date if start_date is not None else constants.season_start_dates[self.season],
+            end_date=constants.season_end_dates[self.season]
+        )
+        validator_key = build_query(host=host, page=page, track=self.track_raw, condition=int(self.condition), start_date=None, end_date=constants.season_end_dates[self.season])
+        #dash_request = requests.get(f"{dash_url}?page={page}&q={self.track_raw}&sort=date", allow_redirects=True)
+        return fetch_dashboard_page(dash_query, host, page, [self], conditional=conditional, validator_key=validator_key)
+
+    def merge_crawl(self, crawl_result:CrawlResult, condition:Condition = Condition.ALL) -> bool:
+        """
+        Merge the sessions downloaded by crawl into the leaderboard
+
+        Args:
+            crawl_result: Result of crawl
+            condition: Condition filter. Sessions with other conditions are skipped unless Condition.ALL
+        Return:
+            True if any session newer than the most recent session of the host was merged
+        """
+        sessions, accepted = self.accept_crawl(crawl_result, condition=condition)
+        for session in sessions:
+            self.merge_session(session)
+        if not accepted:
+            return False
+        print("#######################################################", flush=True)
+        if (self.entry_list):
+            self.entry_list.sort(key=lambda x: x.best_time)
+        return bool(sessions)
+
+    def accept_crawl(self, crawl_result:CrawlResult, condition:Condition = Condition.ALL) -> tuple[list[Session], bool]:
+        """
+        Pick the sessions of a crawl to merge and advance the most recent session of its host.
+        Doesn't touch the entries
+
+        Args:
+            crawl_result: Result of crawl
+            condition: Condition filter. Sessions with other conditions are skipped unless Condition.ALL
+        Return:
+            (sessions to merge, False if the host is behind the leaderboard and the crawl was rejected)
+        """
+        host = crawl_result.host
+        sessions:list[Session] = []
+        most_recent_timestamp = crawl_result.most_recent_timestamp
+        ldb_most_recent = crawl_result.ldb_most_recent
+        for session in crawl_result.sessions:
+            self.track_raw = session.track
+            if not session.results:
+                continue
+            if (condition != Condition.ALL):
+                if (self.condition != session.iswet):
+                    print(f"DB: Condition doesn't match || {session.session_res_prefix}{session.filename}", flush=True)
+                    continue
+            sessions.append(session)
+        self.new_sessions += len(sessions)
         if (most_recent_timestamp):
             if (ldb_most_recent <= most_recent_timestamp):
                 ldb_most_recent = most_recent_timestamp
@@ -574,11 +1390,55 @@ class Leaderboard:
             else:
                 print("Server most recent is older than leaderboard most recent. Aborting", flush=True)
                 print(f"{self.most_recent_sessions[host]} > {most_recent_timestamp}", flush=True)
-                return False
-        print("#######################################################", flush=True)
-        if (self.entry_list):
-            self.entry_list.sort(key=lambda x: x.best_time)
-        return updated
+                return sessions, False
+        if crawl_result.seen_timestamp:
+            self.crawl_marks[host] = datetime.datetime.strftime(crawl_result.seen_timestamp, "%Y-%m-%dT%H:%M:%SZ")
+        return sessions, True
+
+    def get_crawl_key(self) -> str:
+        return f"{self.track}|{int(self.condition)}|{self.season}"
+
+    def merge_session(self, session:Session):
+        """
+        Merge the results of a session into the leaderboard.
+        Entries are matched by driver ID and car. Only improvements replace the existing time.
+
+        Args:
+            session: Session with results
+        """
+        if not self.entry_list:
+            self.entry_list = session.results
+            self._entry_index = None
+            return
+        entry_index = self.get_entry_index()
+        for session_entry in session.results:
+            key = (session_entry.id, session_entry.car_raw)
+            leaderboard_entries = entry_index.get(key)
+            # If car and ID match
+            if leaderboard_entries:
+                for leaderboard_entry in leaderboard_entries:
+                    if (leaderboard_entry.best_time > session_entry.best_time):
+                        leaderboard_entry.best_time = session_entry.best_time
+                        leaderboard_entry.s1 = session_entry.s1
+                        leaderboard_entry.s2 = session_entry.s2
+                        leaderboard_entry.s3 = session_entry.s3
+            #If session entry is not in leaderboard entry
+            else:
+                self.entry_list.append(session_entry)
+                entry_index[key] = [session_entry]
+        self._entry_index_size = len(self.entry_list)
+
+    def get_entry_index(self) -> dict[tuple[str, int], list[Entry]]:
+        """
+        Get the (driver ID, car) -> Entries index of the leaderboard.
+        Rebuilt if entries were added or replaced outside merge_session
+        """
+        if (self._entry_index is None) or (self._entry_index_size != len(self.entry_list)):
+            self._entry_index = {}
+            for entry in self.entry_list:
+                self._entry_index.setdefault((entry.id, entry.car_raw), []).append(entry)
+            self._entry_index_size = len(self.entry_list)
+        return self._entry_index
 
     def get_html_dir_path(self):
         return path.join(self.html_dir, f"{self.track}")
@@ -589,18 +1449,34 @@ class Leaderboard:
     def get_css_path(self):
         return path.join(self.get_html_dir_path(), f"external.css")
 
-    def to_html(self, suppress_id=True, include_timestamp=False, trail_trim=True):
+    def to_html(self, suppress_id=True, include_timestamp=False, trail_trim=True, stream=False):
+        """
+        Render the leaderboard to an html page
+
+        Args:
+            suppress_id: Suppress driver ID flag
+            include_timestamp: Show the last updated time below the table
+            trail_trim: Unused, times are always in ms
+            stream: Write rows as they are rendered instead of building the page in memory first. Use for very large boards
+        """
         html_path = self.get_html_path()
-        html_csv_path = self.get_html_csv_path()
         css_path = self.get_css_path()
         if not path.exists(css_path):
             with open(css_path, "w") as css_file:
                 css_file.write(constants.css_string)
-        self.write_leaderboard(file_path=html_csv_path, suppress_id=suppress_id, include_timestamp=include_timestamp, trail_trim=trail_trim)
-        pandas_csv = pandas.read_csv(html_csv_path, encoding='utf-8')
-        pandas_html = pandas_csv.to_html(None, index=False, justify='center', classes="ldb-table")
-        with open(html_path, "w", encoding="utf-8") as html_file:
-            html_file.write(constants.html_string.format(ldb_html=pandas_html))
+        columns = constants.csv_header_no_id.split(',')
+        if not suppress_id:
+            columns.insert(2, "ID")
+        def rows():
+            for rank, entry in enumerate(self.entry_list or [], start=1):
+                row = [str(rank), entry.name, entry.car, ms_to_string(entry.best_time), ms_to_string(entry.s1), ms_to_string(entry.s2), ms_to_string(entry.s3), str(entry.iswet)]
+                if not suppress_id:
+                    row.insert(2, entry.id)
+                yield row
+        footer = ""
+        if include_timestamp:
+            footer = f"Last updated: {datetime.datetime.strftime(self.last_updated, '%Y-%m-%dT%H:%M:%S%z')}"
+        pj_html.write_page(html_path, columns, rows(), footer=footer, stream=stream)
         return
 
     def to_post_json(self):
@@ -609,57 +1485,440 @@ class Leaderboard:
             "is_wet": int(self.condition),
             "most_recent_sessions" : self.most_recent_sessions
         }
-        drivers_list = []
         if (not self.entry_list):
             return None
-        entries_sorted = sorted(self.entry_list, key=lambda e:e.best_time)
-        rank = 1
-        for entry in entries_sorted:
-            entry_dict = {
-                "rank" : rank,
-                "first_name" : entry.first_name,
-                "last_name" : entry.last_name,
-                "short_name" : entry.short_name,
-                "steam_id" : entry.id,
-                "car_id" : entry.car_raw,
-                "lap_time" : entry.best_time,
-                "sector_1" : entry.s1,
-                "sector_2" : entry.s2,
-                "sector_3" : entry.s3,
-            }
-            drivers_list.append(entry_dict)
-            rank += 1
         js = {
             "track" : track_dict,
-            "drivers" : drivers_list
+            "drivers" : post_rows(self.entry_list)
         }
 
         return js
 
-    def post_leaderboard(self):
+    def to_post_delta_json(self, js = None):
+        """
+        Build the delta of the leaderboard against the version fetched by get_leaderboard. See pj_delta
+
+        Args:
+            js: to_post_json of the leaderboard, if already built
+        Return:
+            Delta payload or None if the leaderboard wasn't fetched, can't be diffed or changed too much to be worth a delta
+        """
+        if self.post_base is None:
+            return None
+        if js is None:
+            js = self.to_post_json()
+            if not js:
+                return None
+        base = post_index(self.post_base.entries)
+        diff = pj_delta.diff_rows(base, js["drivers"]) if base is not None else None
+        if diff is None:
+            return None
+        changed, shifts = diff
+        if len(changed) + len(shifts) > constants.post_delta_max_ratio*len(js["drivers"]):
+            return None
+        return {
+            "track" : js["track"],
+            "base" : {
+                "last_updated" : self.post_base.last_updated,
+                "drivers" : len(base)
+            },
+            "drivers" : changed,
+            "rank_shifts" : shifts
+        }
+
+    def post_payload(self, delta:bool = None):
+        """
+        Pick what to post for the leaderboard
+
+        Args:
+            delta: Post a delta if possible. Defaults to constants.post_delta
+        Return:
+            (pj_upload.BatchItem to post, to_post_json of the leaderboard) or None if the leaderboard is empty
+        """
         js = self.to_post_json()
         if not js:
+            return None
+        if delta is None:
+            delta = constants.post_delta
+        delta_js = self.to_post_delta_json(js) if delta else None
+        if delta_js is not None:
+            print(f"Delta of {self.track}-{int(self.condition)}: {len(delta_js['drivers'])}/{len(js['drivers'])} rows, {len(delta_js['rank_shifts'])} rank shifts", flush=True)
+            return pj_upload.BatchItem(endpoint="update_delta", payload=delta_js), js
+        return pj_upload.BatchItem(endpoint="update", payload=js), js
+
+    def post_leaderboard(self, delta:bool = None):
+        """
+        Post the leaderboard
+
+        Args:
+            delta: Post a delta if possible. Defaults to constants.post_delta
+        Return:
+            Response or a message if the leaderboard is empty
+        """
+        payload = self.post_payload(delta)
+        if payload is None:
             return f"Empty leaderboard: {self.track}-{self.condition}-{self.season}"
-        url = "https://www.simracingalliance.com/api/hotlap/update"
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': f'Bearer {keys.SRA_API_KEY}'}
-        r = requests.post(url, data=json.dumps(js), headers=headers)
+        item, js = payload
+        r = pj_http.post(f"{constants.sra_api_url}/{item.endpoint}", data=json.dumps(item.payload), headers=api_headers())
+        if (not r.ok) and (item.endpoint == "update_delta"):
+            # The API doesn't take deltas or the leaderboard changed since it was fetched
+            print(f"Delta refused ({r.status_code}). Posting the full leaderboard", flush=True)
+            r = pj_http.post(f"{constants.sra_api_url}/update", data=json.dumps(js), headers=api_headers())
+        if r.ok:
+            # The posted version is the base now, but its last updated time is only known to the API
+            self.post_base = None
         return r
     
     def finalize(self):
         self.last_updated = datetime.datetime.now(datetime.timezone.utc)
 
+    def publish(self, updated:bool, simulate_path:str = None) -> bool:
+        """
+        Post the leaderboard if any new session was merged
+
+        Args:
+            updated: True if any new session was merged
+            simulate_path: Write the leaderboard to this csv instead of posting it
+        Return:
+            True if the leaderboard was posted or had nothing new to post
+        """
+        if simulate_path:
+            self.write_leaderboard(simulate_path, True)
+            # Nothing was posted, so the next real run has to see the same pages again
+            return False
+        if not updated:
+            print(f"No new sessions: {self.track}-{int(self.condition)}-S{self.season}. Skipping post", flush=True)
+            return True
+        r = self.post_leaderboard()
+        print(r)
+        return isinstance(r, requests.Response) and r.ok
+
+
+
+def api_headers() -> dict:
+    return {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': f'Bearer {keys.SRA_API_KEY}'}
 
-def main(track:str, condition:int, season:int = 5, pages:int = None, simulate:bool = False, pw:bool = True):
+def post_leaderboards(leaderboards:list[Leaderboard]) -> list[bool]:
+    """
+    Post several leaderboards with pj_upload.uploader, in gzip compressed batches.
+    Leaderboards whose item was refused, i.e a stale delta, and every leaderboard if the API has no batch endpoint,
+    are posted one by one over the pooled connection instead
+
+    Args:
+        leaderboards: Leaderboards to post
+    Return:
+        True for each leaderboard that was posted
+    """
+    posted = [False]*len(leaderboards)
+    items = []
+    # Index in leaderboards of each item
+    item_leaderboards = []
+    for i, leaderboard in enumerate(leaderboards):
+        payload = leaderboard.post_payload()
+        if payload is None:
+            print(f"Empty leaderboard: {leaderboard.track}-{leaderboard.condition}-{leaderboard.season}", flush=True)
+            continue
+        items.append(payload[0])
+        item_leaderboards.append(i)
+    statuses = pj_upload.uploader.post(items, api_headers()) if items else []
+    if statuses is None:
+        statuses = [None]*len(items)
+    for i, status in zip(item_leaderboards, statuses):
+        leaderboard = leaderboards[i]
+        if (status is not None) and (200 <= status < 300):
+            leaderboard.post_base = None
+            posted[i] = True
+            continue
+        delta = None
+        if status is not None:
+            # A refused delta is most likely stale, so post the full leaderboard
+            print(f"Batch item of {leaderboard.track}-{int(leaderboard.condition)} refused ({status}). Posting it alone", flush=True)
+            delta = False
+        r = leaderboard.post_leaderboard(delta=delta)
+        print(r)
+        posted[i] = isinstance(r, requests.Response) and r.ok
+    return posted
+
+def publish_multi(leaderboards:list[Leaderboard], updated:list[bool], simulate_paths:list[str] = None) -> list[bool]:
+    """
+    Leaderboard.publish for several leaderboards. With constants.post_batch the updated leaderboards are posted together, see post_leaderboards
+
+    Args:
+        leaderboards: Leaderboards
+        updated: True for each leaderboard that merged a new session
+        simulate_paths: Write each leaderboard to this csv instead of posting it
+    Return:
+        True for each leaderboard that was posted or had nothing new to post
+    """
+    if simulate_paths or (not constants.post_batch) or (sum(updated) < 2):
+        return [
+            leaderboard.publish(leaderboard_updated, simulate_paths[i] if simulate_paths else None)
+            for i, (leaderboard, leaderboard_updated) in enumerate(zip(leaderboards, updated))
+        ]
+    published = [True]*len(leaderboards)
+    to_post = []
+    for i, (leaderboard, leaderboard_updated) in enumerate(zip(leaderboards, updated)):
+        if leaderboard_updated:
+            to_post.append(i)
+        else:
+            leaderboard.publish(False)
+    for i, posted in zip(to_post, post_leaderboards([leaderboards[i] for i in to_post])):
+        published[i] = posted
+    return published
+
+def crawl_multi(leaderboards:list[Leaderboard], host:str, pages, pw = True, workers:int = 1, process_pool:ProcessPoolExecutor = None) -> list[CrawlResult]:
+    """
+    Walk the results dashboard of a host once for several leaderboards.
+    The dashboard is queried over the union of the seasons of the leaderboards without a track or condition
+    filter, and every session is handed to each leaderboard whose track, condition and season match.
+
+    Without a page override a leaderboard only wants rows newer than its most recent session, or than its crawl mark
+    if that is newer. The mark is the newest row of the last crawl that walked past the leaderboard, so sessions of
+    the other condition or quiet tracks don't drag later crawls back to an old most recent session. The query starts
+    at the oldest of these, leaderboards past their season end are skipped, and the walk stops once the rows are older
+    than every leaderboard wants. Doesn't modify the leaderboards.
+
+    Args:
+        leaderboards: Leaderboards to crawl for
+        host: Host to crawl
+        pages: Number of pages to go through. See https://simracingalliance.emperorservers.com/results
+        pw: Password restriction flag
+        workers: Number of download threads. 1 to crawl sequentially
+        process_pool: Parse the session json in this pool of processes instead of the download threads
+    Return:
+        A CrawlResult for each leaderboard, in the same order, to pass to Leaderboard.merge_crawl
+    """
+    conditional = not pages
+    if not pages:
+        pages = 8000
+
+    print(f"HOST: {host} ({len(leaderboards)} leaderboards)", flush=True)
+    session_res_prefix = f"https://{host}/results/"
+    ldb_most_recents:list[datetime.datetime] = []
+    # Newest row each leaderboard already has. Most recent session or crawl mark
+    watermarks:list[datetime.datetime] = []
+    for leaderboard in leaderboards:
+        if host in leaderboard.most_recent_sessions:
+            ldb_most_recents.append(parse_timestamp(leaderboard.most_recent_sessions[host]))
+        else:
+            ldb_most_recents.append(parse_timestamp("1970-01-01T00:00:00Z"))
+        mark = pj_cache.crawl_marks.get(leaderboard.get_crawl_key(), host) if (pages == 8000) else None
+        watermarks.append(max(ldb_most_recents[-1], parse_timestamp(mark)) if mark else ldb_most_recents[-1])
+    most_recent_timestamps:list[datetime.datetime] = [None]*len(leaderboards)
+    seen_timestamps:list[datetime.datetime] = [None]*len(leaderboards)
+    sessions:list[list[Session]] = [[] for _ in leaderboards]
+    # Leaderboards that reached a row they already have on this host
+    done = [False]*len(leaderboards)
+    # Dates each leaderboard still needs sessions from
+    windows = []
+    for i, leaderboard in enumerate(leaderboards):
+        start_date = constants.season_start_dates[leaderboard.season]
+        if (pages == 8000):
+            start_date = max(start_date, watermarks[i])
+        windows.append((start_date, constants.season_end_dates[leaderboard.season]))
+        if (start_date > constants.season_end_dates[leaderboard.season]):
+            done[i] = True
+    crawled = [not leaderboard_done for leaderboard_done in done]
+
+    def crawl_results():
+        return [
+            CrawlResult(
+                host=host,
+                sessions=sessions[i],
+                most_recent_timestamp=most_recent_timestamps[i],
+                ldb_most_recent=ldb_most_recents[i],
+                updated=bool(sessions[i]),
+                seen_timestamp=seen_timestamps[i]
+            )
+            for i in range(len(leaderboards))
+        ]
+
+    if all(done):
+        print("Most recent sessions are past the season ends. Nothing to crawl", flush=True)
+        return crawl_results()
+    start_date = min(window[0] for window, leaderboard_done in zip(windows, done) if not leaderboard_done)
+    end_date = max(window[1] for window, leaderboard_done in zip(windows, done) if not leaderboard_done)
+
+    def matching(row:DashboardRow):
+        # Indices of the leaderboards a row is new for, ignoring the condition which is only known from the session json
+        indices = []
+        for i, leaderboard in enumerate(leaderboards):
+            if done[i] or (row.track != leaderboard.track):
+                continue
+            if ((leaderboard.track in constants.session_exclude) and (row.filename in constants.session_exclude[leaderboard.track])):
+                continue
+            if not (constants.season_start_dates[leaderboard.season] <= row.timestamp <= constants.season_end_dates[leaderboard.season]):
+                continue
+            indices.append(i)
+        return indices
+
+    def fetch_rows(page:int):
+        dash_query = build_query(host=host, page=page, track=None, condition=None, start_date=start_date, end_date=end_date)
+        validator_key = build_query(host=host, page=page, track=None, condition=None, start_date=None, end_date=end_date)
+        return fetch_dashboard_page(dash_query, host, page, leaderboards, conditional=conditional, validator_key=validator_key)
+
+    newest_row:datetime.datetime = None
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for page, rows in dashboard_pages(fetch_rows, pages, executor):
+            print(f"=====Processing page{page+1}=====", flush=True)
+            if not rows:
+                break
+            if newest_row is None:
+                newest_row = rows[0].timestamp
+            # Filename -> leaderboards the row is new for. Rows are newest first, so a leaderboard is done at the first
+            # row it already has, whatever its track. Rows of no leaderboard are neither checked nor downloaded
+            targets:dict[str, list[int]] = {}
+            for row in rows:
+                if (pages == 8000):
+                    for i, watermark in enumerate(watermarks):
+                        if (row.timestamp <= watermark) or (row.timestamp < constants.season_start_dates[leaderboards[i].season]):
+                            done[i] = True
+                indices = matching(row)
+                if indices:
+                    targets[row.filename] = indices
+            new_rows = [row for row in rows if row.filename in targets]
+            for row, passed, session in row_results(host, new_rows, pw, lambda row: True, executor, process_pool):
+                if not passed:
+                    print(f"DB: No password || {session_res_prefix}{row.filename}", flush=True)
+                    continue
+                for i in targets[row.filename]:
+                    # Sessions of the other condition count as seen too
+                    if not most_recent_timestamps[i]:
+                        most_recent_timestamps[i] = row.timestamp
+                    if (leaderboards[i].condition != session.iswet):
+                        continue
+                    print(f"Processing: {session_res_prefix}{row.filename} -> {leaderboards[i].track}-{int(leaderboards[i].condition)}-S{leaderboards[i].season}", flush=True)
+                    sessions[i].append(session)
+            print(f"=====Finished page{page+1}=====", flush=True)
+            if all(done):
+                print("Processed all new sessions. Stopping...", flush=True)
+                break
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+    if (pages == 8000) and (newest_row is not None):
+        # The walk went back past what every leaderboard already had, so each has seen every row up to the newest
+        for i in range(len(leaderboards)):
+            if crawled[i]:
+                seen_timestamps[i] = max(watermarks[i], newest_row)
+    return crawl_results()
+
+def update_multi(leaderboards:list[Leaderboard], hosts:list[str], pages = None, pw = True, workers:int = 1, processes:int = 0) -> list[bool]:
+    """
+    Update several leaderboards with one dashboard crawl per host. Hosts are crawled concurrently
+
+    Args:
+        leaderboards: Leaderboards to update
+        hosts: Hosts to crawl
+        pages: Number of pages to go through. See https://simracingalliance.emperorservers.com/results
+        pw: Password restriction flag
+        workers: Number of download threads per host. See crawl_multi
+        processes: Worker processes for session parsing, and merging with constants.process_merge. 0 to do everything in threads
+    Return:
+        Updated flag of each leaderboard
+    """
+    process_pool = start_process_pool(processes) if processes else None
+    try:
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            futures = [executor.submit(crawl_multi, leaderboards, host=host, pages=pages, pw=pw, workers=workers, process_pool=process_pool) for host in hosts]
+            host_crawl_results = [future.result() for future in futures]
+        if process_pool and constants.process_merge:
+            return merge_crawls_process(leaderboards, host_crawl_results, process_pool)
+        updated = [False]*len(leaderboards)
+        for crawl_results in host_crawl_results:
+            for i, (leaderboard, crawl_result) in enumerate(zip(leaderboards, crawl_results)):
+                updated[i] |= leaderboard.merge_crawl(crawl_result, condition=leaderboard.condition)
+        return updated
+    finally:
+        if process_pool:
+            process_pool.shutdown(cancel_futures=True)
+
+def merge_crawls_process(leaderboards:list[Leaderboard], host_crawl_results:list[list[CrawlResult]], process_pool:ProcessPoolExecutor) -> list[bool]:
+    """
+    Merge the crawls of every host into each leaderboard like update_multi, with the merge
+    of every leaderboard running in its own worker process
+
+    Args:
+        leaderboards: Leaderboards to update
+        host_crawl_results: Result of crawl_multi for each host
+        process_pool: Pool to merge in
+    Return:
+        Updated flag of each leaderboard
+    """
+    updated = [False]*len(leaderboards)
+    merges = [[] for _ in leaderboards]
+    for crawl_results in host_crawl_results:
+        for i, (leaderboard, crawl_result) in enumerate(zip(leaderboards, crawl_results)):
+            sessions, accepted = leaderboard.accept_crawl(crawl_result, condition=leaderboard.condition)
+            if accepted:
+                print("#######################################################", flush=True)
+                updated[i] |= bool(sessions)
+            merges[i].append(([session.pack_results() for session in sessions], accepted))
+    futures = []
+    for leaderboard, leaderboard_merges in zip(leaderboards, merges):
+        if any(packed_results_list for packed_results_list, _ in leaderboard_merges):
+            futures.append((leaderboard, process_pool.submit(merge_process, leaderboard.track, pack_entries(leaderboard.entry_list), leaderboard_merges)))
+        elif leaderboard.entry_list and any(accepted for _, accepted in leaderboard_merges):
+            leaderboard.entry_list.sort(key=lambda x: x.best_time)
+    for leaderboard, future in futures:
+        leaderboard.entry_list = unpack_entries(future.result())
+        leaderboard._entry_index = None
+    return updated
+
+def main(track:str, condition:int, season:int = 5, pages:int = None, simulate:bool = False, pw:bool = True, concurrent:bool = True, workers:int = constants.session_workers, processes:int = constants.session_processes):
+    """
+    Update and post a leaderboard
+
+    Args:
+        track: Raw track name, i.e brands_hatch
+        condition: 0 for dry, 1 for wet
+        season: Leaderboard season
+    Return:
+        List with the UpdateResult of the leaderboard
+    """
     leaderboard = Leaderboard.get_leaderboard(season=season, track=constants.pretty_name_raw_name[track], condition=condition)
-    for host in constants.host_list:
-        leaderboard.update(host=host, pages=pages, pw=pw, condition=condition)
+    process_pool = start_process_pool(processes) if processes else None
+    try:
+        if concurrent:
+            updated = leaderboard.update_concurrent(hosts=constants.host_list, pages=pages, pw=pw, condition=condition, workers=workers, process_pool=process_pool)
+        else:
+            updated = False
+            for host in constants.host_list:
+                updated |= leaderboard.update(host=host, pages=pages, pw=pw, condition=condition, workers=workers, process_pool=process_pool)
+    finally:
+        if process_pool:
+            process_pool.shutdown(cancel_futures=True)
     leaderboard.finalize()
-    if simulate:
-        leaderboard.write_leaderboard(f"{track}_POST.csv", True)
-    else:
-        r = leaderboard.post_leaderboard()
-        print(r)
-    return 0
+    published = leaderboard.publish(updated, f"{track}_POST.csv" if simulate else None)
+    commit_validators([leaderboard], [published])
+    return [UpdateResult(track_params=(track, condition, season), new_sessions=leaderboard.new_sessions, published=published)]
+
+def main_multi(track_params:list[tuple[str, int, int]], pages:int = None, simulate:bool = False, pw:bool = True, workers:int = constants.session_workers, processes:int = constants.session_processes):
+    """
+    Update and post several leaderboards with a single crawl of every host
+
+    Args:
+        track_params: (track, condition, season) of each leaderboard. See pj_scheduler.run_leaderboards
+        processes: Worker processes for session parsing and merging. See update_multi
+    Return:
+        UpdateResult of each leaderboard
+    """
+    leaderboards = [
+        Leaderboard.get_leaderboard(season=season, track=constants.pretty_name_raw_name[track], condition=condition)
+        for track, condition, season in track_params
+    ]
+    updated = update_multi(leaderboards, hosts=constants.host_list, pages=pages, pw=pw, workers=workers, processes=processes)
+    for leaderboard in leaderboards:
+        leaderboard.finalize()
+    simulate_paths = [f"{track}-{condition}-S{season}_POST.csv" for track, condition, season in track_params] if simulate else None
+    succeeded = publish_multi(leaderboards, updated, simulate_paths)
+    commit_validators(leaderboards, succeeded)
+    commit_crawl_marks(leaderboards, succeeded)
+    return [
+        UpdateResult(track_params=tuple(params), new_sessions=leaderboard.new_sessions, published=published)
+        for params, leaderboard, published in zip(track_params, leaderboards, succeeded)
+    ]
 
 def __main(track:str, condition:int, season:int = 3, pages:int = None, simulate:bool = False):
     #print(ms_to_string(33235))
@@ -673,6 +1932,7 @@ def __main(track:str, condition:int, season:int = 3, pages:int = None, simulate:
     leaderboard.update(host=constants.host_list[1], pages=pages, pw=False, condition=Condition.DRY)
     leaderboard.write_leaderboard("Donington.csv", True)
     js = leaderboard.to_post_json()
+    import pprint
     pp = pprint.PrettyPrinter(indent=4, sort_dicts=False, compact=False)
     pp.pprint(js)
     #r = leaderboard.post_leaderboard()
@@ -688,8 +1948,11 @@ if __name__ == "__main__":
     parser.add_argument('--pages', type=int, help="Override amount of pages. Stop upon 404")
     parser.add_argument('--no-password', action='store_false', help="Disable password filter")
     parser.add_argument('--simulate', action='store_true', help="Simulation mode. Writes updated leaderboard to a file")
+    parser.add_argument('--serial', action='store_true', help="Crawl hosts one after another instead of concurrently")
+    parser.add_argument('--workers', type=int, default=constants.session_workers, help="Session download threads per host. 1 to disable pipelining")
+    parser.add_argument('--processes', type=int, default=constants.session_processes, help="Worker processes for session parsing. 0 to parse in the download threads")
 
     #args = parser.parse_args("brands_hatch 0 --pages 7".split(' '))
     args = parser.parse_args()
     print(args)
-    main(track=args.track, condition=args.condition, season=args.season, pages=args.pages, simulate=args.simulate, pw=args.no_password)
+    main(track=args.track, condition=args.condition, season=args.season, pages=args.pages, simulate=args.simulate, pw=args.no_password, concurrent=not args.serial, workers=args.workers, processes=args.processes)
@@ -0,0 +1,184 @@
+import argparse
+from collections import namedtuple
+import datetime
+import gzip
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+import constants
+import pj_delta
+
+
+# A POST received by MockHotlapServer. size is the body as sent, decoded_size after gzip decoding
+MockPost = namedtuple("MockPost", "path size decoded_size items status")
+
+
+class MockHotlapServer(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in of the SRA hotlap API. Set constants.sra_api_url to url to use it.
+    Serves GET /api/hotlap/get/{track}/{condition} and takes POST /api/hotlap/update, /api/hotlap/update_delta
+    and /api/hotlap/update_batch (see pj_upload). Bodies may be gzip compressed.
+    Leaderboards are kept in memory, one per track and condition regardless of the season.
+
+    Attributes:
+        url: Base url of the API, i.e http://127.0.0.1:8080/api/hotlap
+        boards: (track, is_wet) -> {"rows": driver dicts, "last_updated": str, "most_recent_sessions": dict}
+        posts: MockPost of every POST received
+        batch: Serve the batch endpoint. 404 like an API without it otherwise
+        max_body_bytes: Bodies bigger than this, as sent, are refused with a 413. 0 for no limit
+        latency: Seconds every request is held before it's answered
+    """
+    daemon_threads = True
+
+    def __init__(self, address:tuple[str, int] = ("127.0.0.1", 0), batch:bool = True, max_body_bytes:int = 0, latency:float = 0) -> None:
+        """
+        Initialize a MockHotlapServer. Call serve_forever or start to serve
+
+        Args:
+            address: (host, port) to listen on. Port 0 picks a free port
+            batch: Serve the batch endpoint
+            max_body_bytes: Max body size as sent. 0 for no limit
+            latency: Seconds every request is held before it's answered
+        """
+        self.boards:dict[tuple[str, int], dict] = {}
+        self.posts:list[MockPost] = []
+        self.batch = batch
+        self.max_body_bytes = max_body_bytes
+        self.latency = latency
+        self._lock = threading.Lock()
+        server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            def do_GET(self):
+                self.reply(*server.handle_get(urllib.parse.urlsplit(self.path).path))
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                size = len(body)
+                items = 0
+                if server.max_body_bytes and (size > server.max_body_bytes):
+                    status, js = 413, {"error": f"Body of {size} bytes is over {server.max_body_bytes}"}
+                else:
+                    try:
+                        if self.headers.get("Content-Encoding") == "gzip":
+                            body = gzip.decompress(body)
+                        status, js = server.handle_post(urllib.parse.urlsplit(self.path).path, json.loads(body))
+                        items = len(js.get("results", [None]))
+                    except (OSError, EOFError, ValueError):
+                        status, js = 400, {"error": "Malformed body"}
+                with server._lock:
+                    server.posts.append(MockPost(path=self.path, size=size, decoded_size=len(body), items=items, status=status))
+                self.reply(status, js)
+            def reply(self, status:int, js:dict):
+                if server.latency:
+                    time.sleep(server.latency)
+                content = json.dumps(js).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            def log_message(self, format, *args):
+                pass
+        super().__init__(address, Handler)
+        self.url = f"http://{self.server_address[0]}:{self.server_port}/api/hotlap"
+
+    def start(self):
+        """
+        Serve from a daemon thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def handle_get(self, url_path:str) -> tuple[int, dict]:
+        parts = url_path.strip("/").split("/")
+        if (len(parts) != 5) or (parts[:3] != ["api", "hotlap", "get"]):
+            return 404, {"error": "Not found"}
+        with self._lock:
+            board = self.boards.get((parts[3], int(parts[4])))
+            if board is None:
+                return 200, {"error": "Leaderboard does not exist"}
+            leaderboard_data = [to_api_row(row) for row in board["rows"]]
+            return 200, {"data": {
+                "leaderboard": {"last_updated_iso_8601": board["last_updated"], "most_recent_sessions": board["most_recent_sessions"]},
+                "leaderboard_data": leaderboard_data
+            }}
+
+    def handle_post(self, url_path:str, js) -> tuple[int, dict]:
+        if url_path == "/api/hotlap/update_batch":
+            if not self.batch:
+                return 404, {"error": "Not found"}
+            try:
+                items = [(item["endpoint"], item["payload"]) for item in js["items"]]
+            except (KeyError, TypeError):
+                return 400, {"error": "Malformed payload"}
+            results = []
+            for endpoint, payload in items:
+                status, result = self.update(endpoint, payload)
+                results.append({"status": status, **result})
+            return 200, {"results": results}
+        if not url_path.startswith("/api/hotlap/"):
+            return 404, {"error": "Not found"}
+        return self.update(url_path[len("/api/hotlap/"):], js)
+
+    def update(self, endpoint:str, js) -> tuple[int, dict]:
+        """
+        Apply a payload of the update or update_delta endpoint
+
+        Return:
+            (HTTP status, response json)
+        """
+        try:
+            key = (js["track"]["name"], int(js["track"]["is_wet"]))
+        except (KeyError, TypeError, ValueError):
+            return 400, {"error": "Malformed payload"}
+        with self._lock:
+            if endpoint == "update":
+                rows = js["drivers"]
+            elif endpoint == "update_delta":
+                board = self.boards.get(key)
+                if (board is None) or (board["last_updated"] != js["base"]["last_updated"]) or (len(board["rows"]) != js["base"]["drivers"]):
+                    return 409, {"error": "Leaderboard changed since it was fetched"}
+                rows = pj_delta.apply_delta(board["rows"], js["drivers"], js["rank_shifts"])
+                if rows is None:
+                    return 422, {"error": "Delta doesn't rank the leaderboard"}
+            else:
+                return 404, {"error": "Not found"}
+            self.boards[key] = {
+                "rows": rows,
+                "last_updated": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "most_recent_sessions": js["track"]["most_recent_sessions"]
+            }
+        return 200, {"success": True, "drivers": len(rows)}
+
+def to_api_row(row:dict) -> dict:
+    """
+    Convert a driver dict of an update payload to a leaderboard_data row of the get endpoint
+    """
+    name, _, year = constants.car_model_dict.get(row["car_id"], "").rpartition(" ")
+    if not year.isdigit():
+        name, year = f"{name} {year}".strip(), ""
+    return {
+        "rank": row["rank"],
+        "lap_time": row["lap_time"],
+        "sector_1": row["sector_1"],
+        "sector_2": row["sector_2"],
+        "sector_3": row["sector_3"],
+        "driver": {"first_name": row["first_name"], "last_name": row["last_name"], "short_name": row["short_name"], "steam_id": row["steam_id"]},
+        "car": {"car_id": row["car_id"], "name": name, "year": year}
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the SRA hotlap API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--no-batch", action="store_true", help="Answer the batch endpoint with a 404")
+    parser.add_argument("--max-body-bytes", type=int, default=0, help="Refuse bodies bigger than this. 0 for no limit")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay of every response")
+    args = parser.parse_args()
+    server = MockHotlapServer((args.host, args.port), batch=not args.no_batch, max_body_bytes=args.max_body_bytes, latency=args.latency_ms/1000)
+    print(f"Serving {server.url}", flush=True)
+    server.serve_forever()
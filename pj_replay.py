@@ -0,0 +1,296 @@
+import argparse
+import hashlib
+import http.server
+import json
+import os
+from os import path
+import threading
+import time
+import urllib.parse
+import requests
+import requests.adapters
+import constants
+import pj_cache
+import pj_http
+
+
+# Response headers kept in a bundle. Content-Length and Content-Encoding are set again by the ReplayServer
+RECORDED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class Bundle:
+    """
+    Fixture bundle of recorded HTTP traffic: dashboard pages, session pages, session json and hotlap API responses.
+    Stored as a directory with an index.jsonl of the responses in the order they were received and their bodies
+    under bodies/, named after their sha1. Request headers and bodies are never stored, so the API key stays out of it
+
+    Attributes:
+        bundle_dir: Directory of the bundle
+    """
+    def __init__(self, bundle_dir:str) -> None:
+        """
+        Initialize a Bundle
+
+        Args:
+            bundle_dir: Directory of the bundle. Created on the first add
+        """
+        self.bundle_dir = bundle_dir
+        self._lock = threading.Lock()
+
+    def get_index_path(self) -> str:
+        return path.join(self.bundle_dir, "index.jsonl")
+
+    def get_body_path(self, digest:str) -> str:
+        return path.join(self.bundle_dir, "bodies", digest)
+
+    def add(self, method:str, url:str, status:int, headers, content:bytes):
+        """
+        Record a response
+
+        Args:
+            method: HTTP method of the request
+            url: Url of the request
+            status: HTTP status
+            headers: Response headers
+            content: Decoded body
+        """
+        digest = hashlib.sha1(content).hexdigest()
+        record = {
+            "method": method,
+            "url": url,
+            "status": status,
+            "headers": {name: headers[name] for name in RECORDED_HEADERS if name in headers},
+            "body": digest
+        }
+        with self._lock:
+            body_path = self.get_body_path(digest)
+            if not path.exists(body_path):
+                os.makedirs(path.dirname(body_path), exist_ok=True)
+                with open(f"{body_path}.tmp", "wb") as file:
+                    file.write(content)
+                os.replace(f"{body_path}.tmp", body_path)
+            with open(self.get_index_path(), "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+
+    def load(self) -> dict[tuple[str, str], list[dict]]:
+        """
+        Read the index
+
+        Return:
+            (method, url) -> records of the responses to that request, in the order they were received
+        """
+        records = {}
+        with open(self.get_index_path(), "r", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                records.setdefault((record["method"], record["url"]), []).append(record)
+        return records
+
+    def body(self, record:dict) -> bytes:
+        with open(self.get_body_path(record["body"]), "rb") as file:
+            return file.read()
+
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter adding every response it gets to a Bundle. Mount it with pj_http.client.mount.
+    Bodies are read in full as they come in, so streamed responses are buffered while recording
+    """
+    def __init__(self, bundle:Bundle, adapter:requests.adapters.HTTPAdapter = None, **kwargs) -> None:
+        """
+        Initialize a RecordingAdapter
+
+        Args:
+            bundle: Bundle to record to
+            adapter: Adapter sending the requests. Defaults to sending them like a HTTPAdapter
+            kwargs: Passed to HTTPAdapter
+        """
+        super().__init__(**kwargs)
+        self.bundle = bundle
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs) if self.adapter else super().send(request, **kwargs)
+        self.bundle.add(request.method, request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter sending every request to a ReplayServer instead of the host of its url.
+    https://host/path?query is requested as {base_url}/https/host/path?query
+    """
+    def __init__(self, base_url:str, **kwargs) -> None:
+        """
+        Initialize a RedirectAdapter
+
+        Args:
+            base_url: Url of the ReplayServer, i.e http://127.0.0.1:8080
+            kwargs: Passed to HTTPAdapter
+        """
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        url = urllib.parse.urlsplit(request.url)
+        request.url = f"{self.base_url}/{url.scheme}/{url.netloc}{url.path}" + (f"?{url.query}" if url.query else "")
+        return super().send(request, **kwargs)
+
+
+class ReplayServer(http.server.ThreadingHTTPServer):
+    """
+    Local server answering the requests of a RedirectAdapter with the responses of a Bundle.
+    A request recorded several times gets the recorded responses in order, then the last one again.
+    Unknown requests get a 404
+
+    Attributes:
+        url: Base url of the server
+        latency: Seconds every response is held before it's sent, i.e a round trip to the real hosts
+        requests: Requests answered since the last reset
+        misses: Requests that weren't in the bundle since the last reset
+    """
+    daemon_threads = True
+
+    def __init__(self, bundle:Bundle, address:tuple[str, int] = ("127.0.0.1", 0), latency:float = 0) -> None:
+        """
+        Initialize a ReplayServer. Call serve_forever or start to serve
+
+        Args:
+            bundle: Bundle to replay
+            address: (host, port) to listen on. Port 0 picks a free port
+            latency: Seconds every response is held before it's sent
+        """
+        self.bundle = bundle
+        self.records = bundle.load()
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._bodies:dict[str, bytes] = {}
+        self._cursors:dict[tuple[str, str], int] = {}
+        self.requests = 0
+        self.misses = 0
+        server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            def do_GET(self):
+                self.replay()
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.replay()
+            def replay(self):
+                status, headers, content = server.response(self.command, self.path)
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            def log_message(self, format, *args):
+                pass
+        super().__init__(address, Handler)
+        self.url = f"http://{self.server_address[0]}:{self.server_port}"
+
+    def start(self):
+        """
+        Serve from a daemon thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self):
+        """
+        Rewind every request to its first recorded response and zero the counters
+        """
+        with self._lock:
+            self._cursors.clear()
+            self.requests = 0
+            self.misses = 0
+
+    def response(self, method:str, request_path:str) -> tuple[int, dict, bytes]:
+        """
+        Look up the recorded response of a redirected request
+
+        Args:
+            method: HTTP method
+            request_path: Path of the request, i.e /https/host/path?query
+        Return:
+            (status, headers, body)
+        """
+        scheme, _, rest = request_path.lstrip("/").partition("/")
+        key = (method, f"{scheme}://{rest}")
+        with self._lock:
+            self.requests += 1
+            records = self.records.get(key)
+            if not records:
+                self.misses += 1
+                return 404, {}, b""
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            record = records[min(cursor, len(records) - 1)]
+            if record["body"] not in self._bodies:
+                self._bodies[record["body"]] = self.bundle.body(record)
+            return record["status"], record["headers"], self._bodies[record["body"]]
+
+
+def disable_caches():
+    """
+    Turn off the session cache, the verdict index, the validator cache and the crawl marks, so every request of a run goes out.
+    Recordings need this to be complete and replays to be reproducible
+    """
+    pj_cache.session_cache.max_bytes = 0
+    pj_cache.verdict_index.file_path = ""
+    pj_cache.validator_cache.cache_dir = ""
+    pj_cache.crawl_marks.file_path = ""
+
+def record(bundle:Bundle, adapter:requests.adapters.HTTPAdapter = None):
+    """
+    Record the traffic of the shared pj_http client to a bundle
+
+    Args:
+        bundle: Bundle to record to
+        adapter: Adapter sending the requests. Defaults to the network
+    """
+    pj_http.client.mount(RecordingAdapter(bundle, adapter=adapter, pool_connections=pj_http.client.pool_hosts, pool_maxsize=pj_http.client.pool_maxsize))
+
+def replay(base_url:str):
+    """
+    Send the traffic of the shared pj_http client to a ReplayServer
+
+    Args:
+        base_url: Url of the ReplayServer
+    """
+    # Every host shares the connections to the server
+    pj_http.client.mount(RedirectAdapter(base_url, pool_maxsize=pj_http.client.pool_maxsize*pj_http.client.pool_hosts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record the traffic of a leaderboard update to a fixture bundle or replay a bundle")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Run a simulated update against the live hosts and record it")
+    record_parser.add_argument("bundle", type=str, help="Bundle directory")
+    record_parser.add_argument("track", type=str, choices=constants.track_choices, help="Track to update")
+    record_parser.add_argument("condition", type=int, choices=[0,1], help="Track condition. 0 for dry. 1 for wet")
+    record_parser.add_argument("season", type=int, nargs='?', choices=[1,2,3,4,5], default=5, help="Leaderboard season")
+    record_parser.add_argument('--pages', type=int, help="Override amount of pages. Stop upon 404")
+
+    serve_parser = subparsers.add_parser("serve", help="Replay a bundle. Point a RedirectAdapter at the printed url")
+    serve_parser.add_argument("bundle", type=str, help="Bundle directory")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--latency-ms", type=float, default=0, help="Delay of every response")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        # Only recording needs the backend, and with it the API key
+        import pj_leaderboard_backend
+        disable_caches()
+        record(Bundle(args.bundle))
+        # Simulated so the recording never posts to the API
+        pj_leaderboard_backend.main(track=args.track, condition=args.condition, season=args.season, pages=args.pages, simulate=True)
+    else:
+        server = ReplayServer(Bundle(args.bundle), (args.host, args.port), latency=args.latency_ms/1000)
+        print(f"Replaying {args.bundle} at {server.url}", flush=True)
+        server.serve_forever()
@@ -0,0 +1,431 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import os
+from os import path
+import threading
+import time
+import constants
+import pj_http
+import pj_leaderboard_backend
+
+
+def run_leaderboards(track_params:list[tuple[str, int, int]], **options):
+    """
+    Update leaderboards with the backend. A single leaderboard goes through main, several through main_multi.
+    Track is the value of a constants.discord_track_choices choice as kept by TrackParams, i.e brands_hatch.
+    The backend maps it to the name the leaderboards are kept under, i.e Brands Hatch, with
+    constants.pretty_name_raw_name. That dict maps both ways, so a pretty name passed here would be turned into the raw one
+
+    Args:
+        track_params: (track, condition, season) of each leaderboard
+        options: pages, simulate and pw. See pj_leaderboard_backend.main
+    """
+    if len(track_params) == 1:
+        track, condition, season = track_params[0]
+        return pj_leaderboard_backend.main(track=track, condition=condition, season=season, **options)
+    return pj_leaderboard_backend.main_multi(track_params=list(track_params), **options)
+
+
+class UpdateJob:
+    """
+    Pending or running update of a set of leaderboards
+
+    Attributes:
+        keys: (track, condition, season) of the leaderboards
+        options: Options passed to the runner, as a sorted tuple of items
+        future: Resolved with the return value of the runner
+        requests: Number of submissions the job stands for
+    """
+    def __init__(self, keys:frozenset, options:tuple) -> None:
+        self.keys = keys
+        self.options = options
+        self.future = Future()
+        self.requests = 1
+
+    def __str__(self) -> str:
+        return ",".join(f"{track}-{'Wet' if condition else 'Dry'}-S{season}" for track, condition, season in sorted(self.keys))
+
+
+class UpdateScheduler:
+    """
+    Queue of leaderboard updates in front of the backend.
+    Updates of a leaderboard never overlap, so two crawls can't race on its post. An update submitted while
+    an equal one is still waiting joins it instead of crawling again, and a waiting update of a set of
+    leaderboards absorbs the waiting updates of single leaderboards it covers. Updates of different
+    leaderboards run in parallel up to the number of workers.
+
+    Attributes:
+        executor: Executor the updates run on
+        max_workers: Max updates running at once
+        max_pending: Max waiting updates. Submissions past it are rejected unless they join a waiting update
+        runner: Function taking a list of (track, condition, season) and the options. See run_leaderboards
+    """
+    def __init__(self, max_workers:int, max_pending:int, runner = run_leaderboards) -> None:
+        """
+        Initialize an UpdateScheduler
+
+        Args:
+            max_workers: Max updates running at once
+            max_pending: Max waiting updates
+            runner: Function running an update. See run_leaderboards
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.runner = runner
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="leaderboard-update")
+        self._lock = threading.Lock()
+        self._pending:list[UpdateJob] = []
+        self._running:list[UpdateJob] = []
+        self._closed = False
+        self.coalesced = 0
+
+    def submit(self, track_params:list[tuple[str, int, int]], **options) -> Future:
+        """
+        Queue an update of leaderboards
+
+        Args:
+            track_params: (track, condition, season) of each leaderboard
+            options: Passed to the runner
+        Return:
+            Future resolved when the update, or the update it joined, is done. None if the queue is full or shut down
+        """
+        keys = frozenset(tuple(params) for params in track_params)
+        options = tuple(sorted(options.items()))
+        with self._lock:
+            if self._closed:
+                return None
+            for job in self._pending:
+                if (job.options == options) and (keys <= job.keys):
+                    job.requests += 1
+                    self.coalesced += 1
+                    print(f"Scheduler: {job} joined a waiting update. Queue depth {len(self._pending)}", flush=True)
+                    return job.future
+            new_job = UpdateJob(keys, options)
+            absorbed = [job for job in self._pending if (job.options == options) and (job.keys <= keys)]
+            if (not absorbed) and (len(self._pending) >= self.max_pending):
+                print(f"Scheduler: queue full, rejected {new_job}", flush=True)
+                return None
+            for job in absorbed:
+                self._pending.remove(job)
+                new_job.requests += job.requests
+                self.coalesced += job.requests
+                new_job.future.add_done_callback(lambda future, job=job: _copy_future(future, job.future))
+            self._pending.append(new_job)
+            self._dispatch()
+            print(f"Scheduler: queued {new_job}. Queue depth {len(self._pending)}, running {len(self._running)}", flush=True)
+            return new_job.future
+
+    def _dispatch(self):
+        """
+        Start every waiting update whose leaderboards are free, in queue order. Caller holds the lock
+        """
+        busy = set()
+        for job in self._running:
+            busy |= job.keys
+        for job in list(self._pending):
+            if len(self._running) >= self.max_workers:
+                return
+            if not (job.keys & busy):
+                self._pending.remove(job)
+                self._running.append(job)
+                if not job.future.set_running_or_notify_cancel():
+                    self._running.remove(job)
+                    continue
+                self.executor.submit(self._run, job)
+            # Later updates of the same leaderboards wait behind this one
+            busy |= job.keys
+
+    def _run(self, job:UpdateJob):
+        try:
+            result = self.runner(sorted(job.keys), **dict(job.options))
+        except BaseException as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            with self._lock:
+                self._running.remove(job)
+                if not self._closed:
+                    self._dispatch()
+
+    def queue_depth(self) -> int:
+        """
+        Number of waiting updates
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def status(self) -> tuple[list[str], list[str]]:
+        """
+        Describe the running and the waiting updates
+
+        Return:
+            (running updates, waiting updates) as strings
+        """
+        with self._lock:
+            return [str(job) for job in self._running], [str(job) for job in self._pending]
+
+    def shutdown(self):
+        """
+        Cancel the waiting updates and stop accepting new ones. Running updates finish in the background
+        """
+        with self._lock:
+            self._closed = True
+            pending = self._pending
+            self._pending = []
+        for job in pending:
+            job.future.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RequestBudget:
+    """
+    Cap on the HTTP requests of all updates over a sliding window.
+    Usage is read from the request counter of the shared HTTP client, so manual updates count too
+
+    Attributes:
+        max_requests: Requests allowed per window
+        window: Window length in seconds
+    """
+    def __init__(self, max_requests:int, window:float, counter = None) -> None:
+        """
+        Initialize a RequestBudget
+
+        Args:
+            max_requests: Requests allowed per window
+            window: Window length in seconds
+            counter: Function returning the number of requests sent so far. Defaults to pj_http.client
+        """
+        self.max_requests = max_requests
+        self.window = window
+        self.counter = counter if counter is not None else (lambda: pj_http.client.request_count)
+        self._lock = threading.Lock()
+        # (time, request count) samples. The first one is at or before the start of the window
+        self._samples:deque[tuple[float, int]] = deque()
+
+    def used(self, now:float = None) -> int:
+        """
+        Requests sent within the window
+        """
+        now = time.time() if now is None else now
+        count = self.counter()
+        with self._lock:
+            self._samples.append((now, count))
+            while (len(self._samples) > 1) and (self._samples[1][0] <= now - self.window):
+                self._samples.popleft()
+            return count - self._samples[0][1]
+
+    def remaining(self, now:float = None) -> int:
+        return max(0, self.max_requests - self.used(now))
+
+
+class RefreshPlanner:
+    """
+    Decides when each leaderboard of the track set is refreshed from its crawl history.
+    The session arrival rate of a leaderboard is the moving average of the new sessions found per refresh over the
+    moving average of the time between refreshes. A leaderboard is due once refresh_target_sessions new sessions are
+    expected at that rate, clamped between refresh_min_interval and refresh_max_interval, so busy tracks refresh every
+    few minutes and dormant ones rarely. The interval at most doubles per refresh, so a quiet spell of a busy
+    track only backs it off gradually.
+    Due leaderboards are started hottest first as long as their expected requests fit in the budget.
+    A failed refresh is retried after twice the interval, doubling with every further failure up to refresh_max_interval.
+    The history is kept in a json file so a restart doesn't forget which tracks are busy.
+
+    Attributes:
+        file_path: Path of the history json. Empty string keeps it in memory only
+        budget: RequestBudget shared by all refreshes
+    """
+    def __init__(self, file_path:str, budget:RequestBudget) -> None:
+        """
+        Initialize a RefreshPlanner
+
+        Args:
+            file_path: Path of the history json. Empty string keeps it in memory only
+            budget: RequestBudget shared by all refreshes
+        """
+        self.file_path = file_path
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._history:dict[str, dict] = None
+        self._in_flight:set[tuple] = set()
+        # Leaderboard -> (failed refreshes in a row, retry time)
+        self._failures:dict[tuple, tuple[int, float]] = {}
+
+    @staticmethod
+    def _key(track_params) -> str:
+        track, condition, season = track_params
+        return f"{track}|{int(condition)}|{season}"
+
+    def _load(self):
+        self._history = {}
+        if not self.file_path:
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as file:
+                self._history = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            pass
+
+    def _save(self):
+        if not self.file_path:
+            return
+        if path.dirname(self.file_path):
+            os.makedirs(path.dirname(self.file_path), exist_ok=True)
+        with open(f"{self.file_path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(self._history, file)
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+
+    def _get(self, track_params) -> dict:
+        if self._history is None:
+            self._load()
+        return self._history.get(self._key(track_params))
+
+    def interval(self, track_params) -> float:
+        """
+        Seconds between refreshes of a leaderboard at its current arrival rate
+        """
+        with self._lock:
+            record = self._get(track_params)
+        if not record:
+            return constants.refresh_min_interval
+        return record["interval"]
+
+    def next_refresh(self, track_params) -> float:
+        """
+        Time the leaderboard is due, 0 if it was never refreshed and never failed
+        """
+        with self._lock:
+            record = self._get(track_params)
+            _, retry = self._failures.get(tuple(track_params), (0, 0.0))
+        if not record:
+            return retry
+        return max(record["last_refresh"] + self.interval(track_params), retry)
+
+    def rate(self, track_params) -> float:
+        """
+        New sessions per hour of a leaderboard. None if not measured yet
+        """
+        with self._lock:
+            record = self._get(track_params)
+        return record["rate"] if record else None
+
+    def due(self, track_set, now:float = None) -> list[tuple]:
+        """
+        Pick the leaderboards to refresh now and mark them in flight until record or cancel
+
+        Args:
+            track_set: (track, condition, season) of every leaderboard of the track set
+            now: Current time. Defaults to time.time()
+        Return:
+            Leaderboards to refresh, most overdue first
+        """
+        now = time.time() if now is None else now
+        overdue = []
+        for track_params in track_set:
+            if tuple(track_params) in self._in_flight:
+                continue
+            next_refresh = self.next_refresh(track_params)
+            if next_refresh > now:
+                continue
+            with self._lock:
+                record = self._get(track_params)
+            if not record:
+                overdue.append((float("inf"), constants.refresh_default_cost, track_params))
+                continue
+            interval = self.interval(track_params)
+            overdue.append(((now - record["last_refresh"])/interval, record["cost"], track_params))
+        overdue.sort(key=lambda item: item[0], reverse=True)
+        remaining = self.budget.remaining(now)
+        picked = []
+        for _, cost, track_params in overdue:
+            if cost > remaining:
+                continue
+            remaining -= cost
+            picked.append(track_params)
+        if len(picked) < len(overdue):
+            print(f"Refresh: request budget left {remaining}, deferred {len(overdue) - len(picked)} leaderboards", flush=True)
+        with self._lock:
+            self._in_flight.update(tuple(track_params) for track_params in picked)
+        return picked
+
+    def record(self, results:list, requests:int, now:float = None):
+        """
+        Record the outcome of a refresh
+
+        Args:
+            results: pj_leaderboard_backend.UpdateResult of each refreshed leaderboard
+            requests: HTTP requests sent while refreshing them. Split evenly between them
+            now: Current time. Defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        if not results:
+            return
+        cost = requests/len(results)
+        alpha = constants.refresh_rate_alpha
+        with self._lock:
+            for result in results:
+                record = self._get(result.track_params)
+                if record is None:
+                    # The first refresh catches up on everything since the leaderboard was last posted. Nothing to measure yet
+                    record = {"rate": None, "sessions": 0.0, "hours": 0.0, "cost": cost, "interval": constants.refresh_min_interval, "last_refresh": now}
+                else:
+                    hours = max(now - record["last_refresh"], 1)/3600
+                    if record["rate"] is None:
+                        record["sessions"] = result.new_sessions
+                        record["hours"] = hours
+                    else:
+                        record["sessions"] = alpha*result.new_sessions + (1 - alpha)*record["sessions"]
+                        record["hours"] = alpha*hours + (1 - alpha)*record["hours"]
+                    record["rate"] = record["sessions"]/record["hours"]
+                    record["cost"] = alpha*cost + (1 - alpha)*record["cost"]
+                    if record["rate"] > 0:
+                        interval = constants.refresh_target_sessions/record["rate"]*3600
+                    else:
+                        interval = constants.refresh_max_interval
+                    interval = min(interval, 2*record["interval"], constants.refresh_max_interval)
+                    record["interval"] = max(constants.refresh_min_interval, interval)
+                    record["last_refresh"] = now
+                self._history[self._key(result.track_params)] = record
+                self._in_flight.discard(tuple(result.track_params))
+                self._failures.pop(tuple(result.track_params), None)
+            self._save()
+
+    def cancel(self, track_set):
+        """
+        Release leaderboards picked by due whose refresh didn't run
+        """
+        with self._lock:
+            for track_params in track_set:
+                self._in_flight.discard(tuple(track_params))
+
+    def fail(self, track_set, now:float = None):
+        """
+        Release leaderboards picked by due whose refresh failed and back them off
+
+        Args:
+            track_set: (track, condition, season) of the leaderboards of the failed refresh
+            now: Current time. Defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        for track_params in track_set:
+            interval = self.interval(track_params)
+            with self._lock:
+                failures, _ = self._failures.get(tuple(track_params), (0, 0.0))
+                failures += 1
+                self._failures[tuple(track_params)] = (failures, now + min(interval*2**failures, constants.refresh_max_interval))
+                self._in_flight.discard(tuple(track_params))
+
+
+def _copy_future(source:Future, target:Future):
+    """
+    Resolve target like source
+    """
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
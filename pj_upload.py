@@ -0,0 +1,100 @@
+from collections import namedtuple
+import gzip
+import json
+import threading
+import constants
+import pj_http
+
+
+# Endpoint of the hotlap API, i.e "update" or "update_delta", and its payload
+BatchItem = namedtuple("BatchItem", "endpoint payload")
+
+
+class BatchUploader:
+    """
+    Posts payloads of several leaderboards to the batch endpoint of the hotlap API in gzip compressed requests.
+    The batch endpoint takes {"items": [{"endpoint": ..., "payload": ...}, ...]} and answers
+    {"results": [{"status": ..., ...}, ...]} with a result per item, in order.
+    Once the API answers that it has no batch endpoint, the uploader stops trying it and callers post one by one.
+
+    Attributes:
+        max_items: Max items per request
+        max_bytes: Max uncompressed bytes of the items of a request. An item bigger than this gets a request of its own
+        compress_level: gzip level
+        supported: False once the API refused the batch endpoint
+    """
+    def __init__(self, max_items:int, max_bytes:int, compress_level:int) -> None:
+        """
+        Initialize a BatchUploader
+
+        Args:
+            max_items: Max items per request
+            max_bytes: Max uncompressed bytes of the items of a request
+            compress_level: gzip level
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.supported = True
+        self._lock = threading.Lock()
+
+    def batches(self, encoded:list[bytes]) -> list[list[int]]:
+        """
+        Split encoded items into batches under max_items and max_bytes
+
+        Return:
+            Indices of the items of each batch
+        """
+        batches = []
+        size = 0
+        for i, item in enumerate(encoded):
+            if (not batches) or (len(batches[-1]) >= self.max_items) or (size + len(item) > self.max_bytes):
+                batches.append([])
+                size = 0
+            batches[-1].append(i)
+            size += len(item)
+        return batches
+
+    def post(self, items:list[BatchItem], headers:dict) -> list[int]:
+        """
+        Post items in batches
+
+        Args:
+            items: Items to post
+            headers: Headers of every request, i.e the Authorization header
+        Return:
+            HTTP status of each item, in order, or None if the API has no batch endpoint
+        """
+        if not self.supported:
+            return None
+        url = f"{constants.sra_api_url}/update_batch"
+        headers = {**headers, 'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        encoded = [json.dumps({"endpoint": item.endpoint, "payload": item.payload}).encode("utf-8") for item in items]
+        statuses:list[int] = [None]*len(items)
+        for batch in self.batches(encoded):
+            body = gzip.compress(b'{"items": [' + b", ".join(encoded[i] for i in batch) + b']}', compresslevel=self.compress_level)
+            r = pj_http.post(url, data=body, headers=headers)
+            if r.status_code in (404, 405, 501):
+                with self._lock:
+                    self.supported = False
+                print(f"Batch endpoint unavailable ({r.status_code})", flush=True)
+                if batch[0] == 0:
+                    return None
+            results = None
+            if r.ok:
+                try:
+                    results = r.json()["results"]
+                except (ValueError, KeyError, TypeError):
+                    pass
+            if (results is None) or (len(results) != len(batch)):
+                # The request failed as a whole
+                for i in batch:
+                    statuses[i] = r.status_code if not r.ok else 502
+                continue
+            for i, result in zip(batch, results):
+                statuses[i] = int(result.get("status", 502))
+            print(f"Posted batch of {len(batch)}: {sum(map(len, (encoded[i] for i in batch)))} bytes, {len(body)} compressed", flush=True)
+        return statuses
+
+
+uploader = BatchUploader(constants.post_batch_max_items, constants.post_batch_max_bytes, constants.post_gzip_level)
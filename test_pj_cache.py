@@ -0,0 +1,123 @@
+import contextlib
+import io
+import os
+import pytest
+import constants
+import pj_cache
+from pj_leaderboard_backend import Session, session_has_password
+
+
+HOST = "accsm1.simracingalliance.com"
+
+
+def stored(cache:pj_cache.SessionCache) -> set[str]:
+    host_dir = os.path.join(cache.cache_dir, HOST)
+    return {filename.removesuffix(".json") for filename in os.listdir(host_dir) if filename.endswith(".json")}
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = pj_cache.SessionCache(str(tmp_path), 250)
+    cache.put(HOST, "a", b"a"*100)
+    cache.put(HOST, "b", b"b"*100)
+    assert cache.get(HOST, "a") == b"a"*100
+    cache.put(HOST, "c", b"c"*100)
+    assert stored(cache) == {"a", "c"}
+    assert cache.get(HOST, "b") is None
+    assert cache.get(HOST, "c") == b"c"*100
+
+    # Replacing a session doesn't count it twice
+    cache.put(HOST, "c", b"C"*100)
+    assert stored(cache) == {"a", "c"}
+    # Bigger than the cap, never stored
+    cache.put(HOST, "d", b"d"*300)
+    assert stored(cache) == {"a", "c"}
+
+def test_index_is_rebuilt_from_file_times(tmp_path):
+    cache = pj_cache.SessionCache(str(tmp_path), 250)
+    for i, filename in enumerate(["a", "b"]):
+        cache.put(HOST, filename, filename.encode("utf-8")*100)
+        os.utime(cache.get_path(HOST, filename), (1000 + i, 1000 + i))
+    os.utime(cache.get_path(HOST, "a"), (2000, 2000))
+    # A restart reads the access order from the mtimes
+    cache = pj_cache.SessionCache(str(tmp_path), 250)
+    cache.put(HOST, "c", b"c"*100)
+    assert stored(cache) == {"a", "c"}
+
+def test_writer_only_stores_committed_sessions(tmp_path):
+    cache = pj_cache.SessionCache(str(tmp_path), 250)
+    with cache.writer(HOST, "a") as writer:
+        assert list(writer.tee([b"a"*50, b"a"*50])) == [b"a"*50, b"a"*50]
+        writer.commit()
+    with cache.writer(HOST, "b") as writer:
+        writer.write(b"b"*100)
+    with cache.writer(HOST, "c") as writer:
+        writer.write(b"c"*200)
+        writer.write(b"c"*200)
+        writer.commit()
+    assert cache.get(HOST, "a") == b"a"*100
+    assert os.listdir(os.path.join(cache.cache_dir, HOST)) == ["a.json"]
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = pj_cache.SessionCache(str(tmp_path), 0)
+    cache.put(HOST, "a", b"a"*100)
+    with cache.writer(HOST, "b") as writer:
+        writer.write(b"b"*100)
+        writer.commit()
+    assert cache.get(HOST, "a") is None
+    assert not os.path.exists(os.path.join(cache.cache_dir, HOST))
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_cached_session_matches_download(origin, monkeypatch, tmp_path, stream):
+    synthetic = origin(5, ["zandvoort"])
+    monkeypatch.setattr(pj_cache.session_cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(pj_cache.session_cache, "max_bytes", 1024*1024)
+    monkeypatch.setattr(constants, "stream_session_json", stream)
+    monkeypatch.setattr(constants, "stream_min_bytes", 0)
+    results = []
+    for _ in range(2):
+        for session_dict in synthetic.sessions[HOST]:
+            session = Session(HOST, session_dict["filename"])
+            with contextlib.redirect_stdout(io.StringIO()):
+                session.get_session_results()
+            results.append((session.track, session.iswet, [str(entry) for entry in session.results]))
+    assert results[:5] == results[5:]
+    assert all(entries for _, _, entries in results)
+    # The second round was read from the cache
+    assert synthetic.counts["json"] == 5
+
+def test_verdicts_survive_a_restart(tmp_path):
+    file_path = str(tmp_path / "cache" / "verdicts.jsonl")
+    index = pj_cache.VerdictIndex(file_path)
+    assert index.get(HOST, "a") is None
+    index.put(HOST, "a", passed=True, rule="assword: sra")
+    index.put(HOST, "b", passed=False)
+    # The first verdict of a session stays
+    index.put(HOST, "a", passed=False)
+    with open(file_path, "a", encoding="utf-8") as file:
+        # Interrupted write
+        file.write('{"key": "accsm1.simracingalliance.com/c", "pas')
+
+    index = pj_cache.VerdictIndex(file_path)
+    assert index.get(HOST, "a") == pj_cache.Verdict(passed=True, rule="assword: sra")
+    assert index.get(HOST, "b") == pj_cache.Verdict(passed=False, rule=None)
+    assert index.get(HOST, "c") is None
+    assert index.get("accsm2.simracingalliance.com", "a") is None
+
+def test_disabled_verdict_index_stores_nothing():
+    index = pj_cache.VerdictIndex("")
+    index.put(HOST, "a", passed=True)
+    assert index.get(HOST, "a") is None
+
+def test_indexed_verdicts_match_session_pages(origin, monkeypatch, tmp_path):
+    synthetic = origin(20, ["zandvoort"])
+    monkeypatch.setattr(pj_cache.verdict_index, "file_path", str(tmp_path / "verdicts.jsonl"))
+    expected = [session_dict["password"] for session_dict in synthetic.sessions[HOST]]
+    assert any(expected) and not all(expected)
+    assert [session_has_password(HOST, session_dict["filename"]) for session_dict in synthetic.sessions[HOST]] == expected
+    # Read back from the file, without fetching the pages again
+    monkeypatch.setattr(pj_cache, "verdict_index", pj_cache.VerdictIndex(str(tmp_path / "verdicts.jsonl")))
+    assert [session_has_password(HOST, session_dict["filename"]) for session_dict in synthetic.sessions[HOST]] == expected
+    assert synthetic.counts["page"] == len(expected)
+    # Missing pages aren't recorded
+    assert not session_has_password(HOST, "missing_FP")
+    assert not session_has_password(HOST, "missing_FP")
+    assert synthetic.counts["page"] == len(expected) + 2
@@ -0,0 +1,53 @@
+import json
+import random
+import pytest
+import constants
+import pj_columnar
+import pj_leaderboard_backend
+from pj_leaderboard_backend import Session
+
+
+pytest.importorskip("numpy")
+
+
+def synthetic_laps(count:int, seed:int = 0) -> list[dict]:
+    """
+    Laps with repeated lap times, invalid laps and laps over the 6 hour cap
+    """
+    rng = random.Random(seed)
+    laps = []
+    for _ in range(count):
+        laptime = rng.choice([90000, 90000, rng.randint(85000, 95000), 3600000 + rng.randint(0, 1000)])
+        s1 = rng.randint(20000, 30000)
+        laps.append({
+            "carId": 1000 + rng.randrange(10),
+            "driverIndex": rng.randrange(3),
+            "laptime": laptime,
+            "isValidForBest": rng.random() < 0.8,
+            "splits": [s1, laptime//2 - s1, laptime - laptime//2]
+        })
+    return laps
+
+@pytest.mark.parametrize("count", [0, 1, 50, 5000])
+def test_best_laps_match_python(count):
+    laps = synthetic_laps(count, seed=count)
+    assert pj_columnar.available()
+    assert pj_columnar.best_laps(pj_columnar.LapColumns(laps)) == pj_leaderboard_backend.best_laps(laps)
+
+def test_session_results_match_python(monkeypatch):
+    monkeypatch.setattr(constants, "columnar_min_laps", 0)
+    laps = synthetic_laps(500)
+    cars = [
+        {"car": {"carId": car_id, "carModel": 0, "drivers": [
+            {"firstName": f"First{d}", "lastName": f"Last{d}", "shortName": f"F{d}", "playerId": f"S7656119{car_id}{d}"} for d in range(3)
+        ]}}
+        for car_id in range(1000, 1010)
+    ]
+    session_json_raw = json.dumps({"trackName": "zandvoort", "sessionResult": {"isWetSession": 0, "leaderBoardLines": cars}, "laps": laps}).encode("utf-8")
+    results = []
+    for columnar in (True, False):
+        session = Session("host", "221220_120000_FP", columnar=columnar)
+        assert session.use_columnar(laps) == columnar
+        session.read_json(session_json_raw)
+        results.append([str(entry) for entry in session.results])
+    assert results[0] == results[1]
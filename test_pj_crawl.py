@@ -0,0 +1,61 @@
+import contextlib
+import datetime
+import io
+import pytest
+import constants
+import pj_cache
+import pj_leaderboard_backend
+
+
+TRACKS = ["zandvoort", "monza", "spa", "imola"]
+# No leaderboard for imola. Its sessions and the wet ones only show up in the shared crawl
+TRACK_PARAMS = [("zandvoort", 0, 5), ("monza", 0, 5), ("spa", 0, 5), ("zandvoort", 1, 5)]
+
+
+@pytest.fixture
+def crawl_marks(no_caches, monkeypatch, tmp_path):
+    monkeypatch.setattr(pj_cache.crawl_marks, "file_path", str(tmp_path / "crawl_marks.json"))
+
+def run(multi:bool) -> list[int]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        if multi:
+            results = pj_leaderboard_backend.main_multi(TRACK_PARAMS, workers=1, processes=0)
+        else:
+            results = [result for track, condition, season in TRACK_PARAMS for result in pj_leaderboard_backend.main(track, condition, season, workers=1, processes=0)]
+    return [result.new_sessions for result in results]
+
+def test_idle_multi_cycle_only_checks_the_first_page(hotlap_server, origin, crawl_marks):
+    # The per leaderboard crawl as reference
+    hotlap_server()
+    origin(120, TRACKS)
+    expected = run(multi=False)
+    assert all(expected)
+
+    server = hotlap_server()
+    synthetic = origin(120, TRACKS)
+    assert run(multi=True) == expected
+
+    for _ in range(2):
+        synthetic.counts.clear()
+        posts = len(server.posts)
+        assert run(multi=True) == [0]*len(TRACK_PARAMS)
+        assert synthetic.counts == {"dashboard": len(constants.host_list)}
+        assert len(server.posts) == posts
+
+    # A new session is only downloaded for the leaderboards of its track
+    host = constants.host_list[0]
+    newest = synthetic.sessions[host][0]["timestamp"]
+    synthetic.add_session(host, newest + datetime.timedelta(minutes=30), "spa", wet=0)
+    synthetic.counts.clear()
+    assert run(multi=True) == [0, 0, 1, 0]
+    assert synthetic.counts == {"dashboard": len(constants.host_list), "page": 1, "json": 1}
+
+def test_idle_multi_cycle_without_crawl_marks(hotlap_server, origin):
+    hotlap_server()
+    synthetic = origin(120, TRACKS)
+    run(multi=True)
+    synthetic.counts.clear()
+    assert run(multi=True) == [0]*len(TRACK_PARAMS)
+    # Every leaderboard is caught up with the newest session of its track, whatever its condition
+    assert synthetic.counts["dashboard"] == len(constants.host_list)
+    assert not synthetic.counts["json"]
@@ -0,0 +1,67 @@
+import pytest
+import pj_leaderboard_backend
+from pj_leaderboard_backend import parse_dashboard_rows, parse_dashboard_rows_bs4
+
+
+def page(rows:str, head:str = "") -> str:
+    return f"<html><head>{head}</head><body><table class='table'><tbody>\n{rows}</tbody></table></body></html>"
+
+def row(filename:str = "221217_203300_FP", timestamp:str = "Sat, 17 Dec 2022 20:33:00 UTC", session_type:str = "Practice",
+        track:str = "Zandvoort", start:str = None, tag:str = "tr", cell:str = "td") -> str:
+    start = start or f'<{tag} class="row-link" data-href="/results/{filename}">'
+    return (
+        f"{start}\n"
+        f"    <{cell}>{timestamp}</{cell}>\n"
+        f"    <{cell}>{session_type}</{cell}>\n"
+        f"    <{cell}>{track}</{cell}>\n"
+        f"</{tag}>\n"
+    )
+
+CASES = {
+    "plain": page(row() + row("221217_190000_R", "Sat, 17 Dec 2022 19:00:00 UTC", "Race", "Monza")),
+    "entities": page(row("221217_203300_FP&amp;x", session_type="Free &amp; Practice", track="Spa&#45;Francorchamps")),
+    "multi-class": page(row(start='<tr class="table-row row-link\tactive" data-href="/results/221217_203300_FP">')),
+    "similar class": page(row(start='<tr class="row-links" data-href="/results/x_FP">') + row()),
+    "comments": page(
+        "<!-- <tr class=\"row-link\" data-href=\"/results/old_FP\"><td>x</td></tr> -->\n"
+        + row(session_type="Practice<!-- FP -->")
+    ),
+    "> in attribute": page(row(start='<tr title="a > b" class="row-link" data-href="/results/221217_203300_FP">')),
+    "uppercase tags": page(row(start='<TR class="row-link" data-href="/results/221217_203300_FP">', tag="TR", cell="TD")),
+    "non-tr row-link": page(row(tag="div", cell="span")),
+    "< in script": page(row(), head="<script>if (a < b && c > d) { document.title = '<b>'; }</script>"),
+    "< in text": page(row(session_type="Practice < Race")),
+    "attribute order": page(row(start="<tr data-href='/results/221217_203300_FP' id=r1 class=row-link>")),
+    "nested cell": page(row(session_type="<b>Qualifying</b> <i>Q1</i>")),
+    "timezone offsets": page(
+        row(timestamp="Sat, 17 Dec 2022 21:33:00 +0100")
+        + row("221217_190000_R", "Sat, 17 Dec 2022 19:00:00 GMT")
+        + row("221217_180000_Q", "2022-12-17T18:00:00-05:00")
+    ),
+}
+
+
+@pytest.fixture
+def no_fallback(monkeypatch):
+    """
+    Fail instead of falling back to bs4, so the tokenizer has to read the page itself
+    """
+    def fallback(dash_html:str):
+        raise AssertionError("Fell back to bs4")
+    monkeypatch.setattr(pj_leaderboard_backend, "parse_dashboard_rows_bs4", fallback)
+
+@pytest.mark.parametrize("name", CASES)
+def test_tokenizer_matches_bs4(name, no_fallback):
+    # The module level import is the real bs4 parser
+    expected = parse_dashboard_rows_bs4(CASES[name])
+    assert expected
+    assert parse_dashboard_rows(CASES[name]) == expected
+
+def test_unreadable_row_falls_back_to_bs4():
+    # No cells, so the tokenizer can't find the timestamp and bs4 raises too
+    dash_html = page('<tr class="row-link" data-href="/results/221217_203300_FP"></tr>\n')
+    with pytest.raises(IndexError):
+        parse_dashboard_rows(dash_html)
+
+def test_empty_page():
+    assert parse_dashboard_rows(page("")) == parse_dashboard_rows_bs4(page("")) == []
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import random
+import pytest
+import constants
+import pj_delta
+from conftest import synthetic_leaderboard
+from pj_leaderboard_backend import Condition, Leaderboard, post_rows
+
+
+TRACK = "Zandvoort"
+
+
+def fetch() -> Leaderboard:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Leaderboard.get_leaderboard(5, TRACK, Condition.DRY)
+
+def post(leaderboard:Leaderboard, delta:bool):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return leaderboard.post_leaderboard(delta=delta)
+
+def improve(leaderboard:Leaderboard, seed:int):
+    """
+    Improve a few drivers and add a new one, like the merge of a session
+    """
+    rng = random.Random(seed)
+    for entry in rng.sample(leaderboard.entry_list, 5):
+        entry.best_time -= rng.randint(1, 2000)
+    leaderboard.entry_list.extend(synthetic_leaderboard(TRACK, 1, seed=seed).entry_list)
+    leaderboard.entry_list.sort(key=lambda x: x.best_time)
+
+def board_rows(server) -> list[dict]:
+    return server.boards[(constants.pretty_name_raw_name[TRACK], int(Condition.DRY))]["rows"]
+
+@pytest.fixture
+def server(hotlap_server):
+    server = hotlap_server()
+    assert post(synthetic_leaderboard(TRACK, 500), delta=False).ok
+    return server
+
+def test_delta_matches_full_update(server):
+    leaderboard = fetch()
+    improve(leaderboard, seed=1)
+    delta_js = leaderboard.to_post_delta_json()
+    assert 0 < len(delta_js["drivers"]) < len(leaderboard.entry_list)
+    assert post(leaderboard, delta=True).ok
+    assert server.posts[-1].path == "/api/hotlap/update_delta"
+    assert server.posts[-1].size < server.posts[0].size
+    assert board_rows(server) == post_rows(leaderboard.entry_list)
+
+    # The same leaderboard posted in full
+    assert post(leaderboard, delta=False).ok
+    assert board_rows(server) == post_rows(leaderboard.entry_list)
+
+def test_stale_base_posts_full_leaderboard(server):
+    leaderboard = fetch()
+    # Another update posts the leaderboard after it was fetched
+    other = fetch()
+    improve(other, seed=2)
+    assert post(other, delta=True).ok
+    improve(leaderboard, seed=3)
+    assert post(leaderboard, delta=True).ok
+    assert [(sent.path, sent.status) for sent in server.posts[-2:]] == [("/api/hotlap/update_delta", 409), ("/api/hotlap/update", 200)]
+    assert board_rows(server) == post_rows(leaderboard.entry_list)
+
+def test_unrankable_delta_posts_full_leaderboard(server, monkeypatch):
+    leaderboard = fetch()
+    improve(leaderboard, seed=4)
+    delta_js = leaderboard.to_post_delta_json()
+    # Without the rank shifts the unchanged rows keep ranks that are taken by the changed ones
+    assert delta_js["rank_shifts"]
+    monkeypatch.setattr(leaderboard, "to_post_delta_json", lambda js = None: {**delta_js, "rank_shifts": []})
+    assert pj_delta.apply_delta(board_rows(server), delta_js["drivers"], []) is None
+    assert post(leaderboard, delta=True).ok
+    assert [(sent.path, sent.status) for sent in server.posts[-2:]] == [("/api/hotlap/update_delta", 422), ("/api/hotlap/update", 200)]
+    assert board_rows(server) == post_rows(leaderboard.entry_list)
@@ -0,0 +1,67 @@
+import json
+import random
+import pytest
+import pj_json_stream
+from pj_leaderboard_backend import Session, best_laps
+
+
+def chunked(data:bytes, size:int):
+    return (data[i:i+size] for i in range(0, len(data), size))
+
+def synthetic_session(seed:int = 0) -> dict:
+    """
+    Session json with the value types the reader has to get across chunk boundaries
+    """
+    rng = random.Random(seed)
+    laps = [
+        {"carId": 1000 + rng.randrange(5), "driverIndex": rng.randrange(2), "laptime": rng.randint(85000, 120000),
+         "isValidForBest": rng.random() < 0.8, "splits": [rng.randint(20000, 40000) for _ in range(3)]}
+        for _ in range(200)
+    ]
+    cars = [
+        {"car": {"carId": car_id, "carModel": 35, "drivers": [
+            {"firstName": "Jürgen", "lastName": "Ñúñez \"JN\" \\ 中文 🏎", "shortName": "JÜR", "playerId": f"S7656119{car_id}{d}"} for d in range(2)
+        ]}, "timing": {"lastLap": 1e3, "bestLap": -0.5, "lapCount": 0, "splits": []}}
+        for car_id in range(1000, 1005)
+    ]
+    return {
+        "sessionType": "R",
+        "trackName": "spa",
+        "sessionIndex": 12345678901234567890,
+        "sessionResult": {"isWetSession": 0, "bestlap": 123456, "leaderBoardLines": cars, "empty": {}},
+        "laps": laps,
+        "penalties": [],
+        "post_race_penalties": None,
+        "ratio": 1.5e-7
+    }
+
+@pytest.mark.parametrize("indent", [None, 4])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_read_session_matches_json_loads(indent, chunk_size):
+    data = json.dumps(synthetic_session(), indent=indent, ensure_ascii=False).encode("utf-8")
+    expected = json.loads(data)
+    assert pj_json_stream.read_session(chunked(data, chunk_size), list) == expected
+
+def test_laps_are_read_lazily():
+    data = json.dumps(synthetic_session()).encode("utf-8")
+    session_data = pj_json_stream.read_session(chunked(data, 64), lambda laps: next(laps))
+    # Laps on_laps didn't consume are skipped
+    assert session_data["laps"] == json.loads(data)["laps"][0]
+    assert session_data["penalties"] == []
+
+@pytest.mark.parametrize("data", [b'{"laps": [1, 2', b'{"laps": [1 2]}', b'[1]', b'{"a": 1'])
+def test_malformed_document_raises(data):
+    with pytest.raises(ValueError):
+        pj_json_stream.read_session(chunked(data, 3), list)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_streamed_session_matches_loaded(seed):
+    data = json.dumps(synthetic_session(seed), indent=4, ensure_ascii=False).encode("utf-8")
+    assert pj_json_stream.read_session(chunked(data, 5), best_laps)["laps"] == best_laps(json.loads(data)["laps"])
+    loaded = Session("host", "221220_120000_R")
+    loaded.read_json(data)
+    streamed = Session("host", "221220_120000_R")
+    streamed.read_stream(chunked(data, 5))
+    assert loaded.results
+    assert [str(entry) for entry in streamed.results] == [str(entry) for entry in loaded.results]
+    assert (streamed.track, streamed.iswet) == (loaded.track, loaded.iswet)
@@ -0,0 +1,95 @@
+import csv
+import datetime
+import random
+import pytest
+import constants
+from conftest import synthetic_leaderboard
+from pj_leaderboard_backend import Entry, datetime_to_ms, laptime_to_ms, laptimes_to_ms, load_leaderboard_csv, parse_timestamp
+
+
+def strptime_to_ms(laptime_str:str) -> int:
+    return datetime_to_ms(datetime.datetime.strptime(laptime_str, "%M:%S.%f"))
+
+def load_leaderboard_csv_strptime(file_path:str):
+    """
+    Leaderboard.read_leaderboard as it was before load_leaderboard_csv
+    """
+    entry_list = []
+    last_updated_str = ""
+    most_recent_sessions = {}
+    with open(file_path, "r", encoding='utf-8') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader)
+        for row in csv_reader:
+            if ("Last updated" in row[0]):
+                last_updated_str = row[0].split("?")[1]
+                continue
+            elif ("?MR?" in row[0]):
+                most_recent_sessions[row[1]] = row[2]
+                continue
+            entry_list.append(Entry(
+                first_name=row[1],
+                last_name=row[2],
+                short_name=row[3],
+                id=row[4],
+                car=row[5],
+                car_raw=int(row[6]),
+                best_time=strptime_to_ms(row[7]),
+                s1=strptime_to_ms(row[8]),
+                s2=strptime_to_ms(row[9]),
+                s3=strptime_to_ms(row[10]),
+                iswet=int(row[11])
+            ))
+    return entry_list, parse_timestamp(last_updated_str), most_recent_sessions
+
+LAPTIMES = ["01:23.456", "00:00.000", "59:59.999", "1:23.456", "01:23.4", "01:23.45", "01:23.456789", "01:3.456", "10:05.007"]
+
+@pytest.mark.parametrize("laptime_str", LAPTIMES)
+def test_laptime_matches_strptime(laptime_str):
+    assert laptime_to_ms(laptime_str) == strptime_to_ms(laptime_str)
+
+@pytest.mark.parametrize("laptime_str", ["01:23", "01:23.", "01:23.4567890", "01-23.456", "xx:23.456"])
+def test_invalid_laptime_raises(laptime_str):
+    with pytest.raises(ValueError):
+        strptime_to_ms(laptime_str)
+    with pytest.raises(ValueError):
+        laptime_to_ms(laptime_str)
+
+def test_laptime_column_matches_strptime():
+    rng = random.Random(0)
+    column = [f"{rng.randrange(60):02}:{rng.randrange(60):02}.{rng.randrange(1000):03}" for _ in range(1000)]
+    # The bulk conversion of plain MM:SS.mmm columns
+    assert laptimes_to_ms(column) == [strptime_to_ms(laptime_str) for laptime_str in column]
+    # Any other lap time sends the column through laptime_to_ms
+    mixed = column + LAPTIMES
+    assert laptimes_to_ms(mixed) == [strptime_to_ms(laptime_str) for laptime_str in mixed]
+    assert laptimes_to_ms([]) == []
+
+def entries_as_tuples(entry_list:list[Entry]) -> list[tuple]:
+    return [
+        (entry.first_name, entry.last_name, entry.short_name, entry.id, entry.car, entry.car_raw, entry.best_time, entry.s1, entry.s2, entry.s3, entry.iswet)
+        for entry in entry_list
+    ]
+
+@pytest.mark.parametrize("trail_trim", [False, True])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_csv_loader_matches_strptime_loader(tmp_path, trail_trim, newline):
+    leaderboard = synthetic_leaderboard("Zandvoort", 500)
+    leaderboard.entry_list[3].first_name = "Jürgen"
+    leaderboard.entry_list[4].last_name = "O\"Neil"
+    leaderboard.entry_list[5].short_name = "A B"
+    leaderboard.last_updated = datetime.datetime(2022, 12, 20, 12, 30, tzinfo=datetime.timezone.utc)
+    leaderboard.most_recent_sessions = {host: f"2022-12-1{i}T00:00:00Z" for i, host in enumerate(constants.host_list)}
+    file_path = str(tmp_path / "leaderboard.csv")
+    leaderboard.write_leaderboard(file_path, trail_trim=trail_trim)
+    if newline != "\n":
+        with open(file_path, "rb") as file:
+            data = file.read()
+        with open(file_path, "wb") as file:
+            file.write(data.replace(b"\n", newline.encode("utf-8")))
+
+    entry_list, last_updated, most_recent_sessions = load_leaderboard_csv(file_path)
+    expected_entry_list, expected_last_updated, expected_most_recent_sessions = load_leaderboard_csv_strptime(file_path)
+    assert entries_as_tuples(entry_list) == entries_as_tuples(expected_entry_list) == entries_as_tuples(leaderboard.entry_list)
+    assert last_updated == expected_last_updated == leaderboard.last_updated
+    assert most_recent_sessions == expected_most_recent_sessions == leaderboard.most_recent_sessions
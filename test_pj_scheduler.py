@@ -0,0 +1,148 @@
+import contextlib
+import io
+import threading
+import pytest
+import constants
+import pj_leaderboard_backend
+import pj_scheduler
+from pj_leaderboard_backend import Condition, Leaderboard, UpdateResult
+
+
+TRACKS = ["zandvoort", "monza"]
+
+
+@pytest.fixture
+def leaderboards(origin):
+    """
+    Dry season 5 leaderboards of TRACKS, crawled from synthetic result hosts with every cache off
+    """
+    origin(30, TRACKS)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [
+            Leaderboard.get_leaderboard(season=5, track=constants.pretty_name_raw_name[track], condition=Condition.DRY)
+            for track in TRACKS
+        ]
+
+def refresh(leaderboards:list[Leaderboard]) -> tuple[list[bool], list[UpdateResult]]:
+    """
+    One update of the leaderboards like main_multi, without posting them
+    """
+    for leaderboard in leaderboards:
+        leaderboard.new_sessions = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        updated = pj_leaderboard_backend.update_multi(leaderboards, hosts=constants.host_list)
+    results = [
+        UpdateResult(track_params=(track, int(Condition.DRY), 5), new_sessions=leaderboard.new_sessions, published=leaderboard_updated)
+        for track, leaderboard, leaderboard_updated in zip(TRACKS, leaderboards, updated)
+    ]
+    return updated, results
+
+def test_idle_refresh_finds_no_new_sessions(leaderboards):
+    updated, results = refresh(leaderboards)
+    assert all(updated)
+    assert all(result.new_sessions > 0 for result in results)
+    entries = [len(leaderboard.entry_list) for leaderboard in leaderboards]
+
+    # Nothing happened on the hosts. The sessions at the watermarks were merged already
+    for _ in range(2):
+        updated, results = refresh(leaderboards)
+        assert not any(updated)
+        assert [result.new_sessions for result in results] == [0, 0]
+        assert [len(leaderboard.entry_list) for leaderboard in leaderboards] == entries
+
+def test_idle_interval_grows_to_max(leaderboards):
+    planner = pj_scheduler.RefreshPlanner("", pj_scheduler.RequestBudget(constants.request_budget, constants.request_budget_window, counter=lambda: 0))
+    track_params = (TRACKS[0], int(Condition.DRY), 5)
+    now = 0.0
+    _, results = refresh(leaderboards)
+    planner.record(results, 100, now=now)
+    intervals = [planner.interval(track_params)]
+    while intervals[-1] < constants.refresh_max_interval:
+        now += intervals[-1]
+        _, results = refresh(leaderboards)
+        planner.record(results, 10, now=now)
+        assert planner.rate(track_params) == 0
+        intervals.append(planner.interval(track_params))
+        assert intervals[-1] > intervals[-2]
+    assert intervals[0] == constants.refresh_min_interval
+    assert intervals[-1] == constants.refresh_max_interval
+
+def test_failed_refresh_backs_off():
+    planner = pj_scheduler.RefreshPlanner("", pj_scheduler.RequestBudget(constants.request_budget, constants.request_budget_window, counter=lambda: 0))
+    track_params = (TRACKS[0], int(Condition.DRY), 5)
+    now = 0.0
+    retries = []
+    while not retries or retries[-1] < constants.refresh_max_interval:
+        assert planner.due([track_params], now=now) == [track_params]
+        planner.fail([track_params], now=now)
+        # Not retried on the next ticks
+        assert planner.due([track_params], now=now + constants.refresh_tick_seconds) == []
+        retries.append(planner.next_refresh(track_params) - now)
+        now += retries[-1]
+    assert retries[0] == 2*constants.refresh_min_interval
+    assert all(retry == 2*previous for previous, retry in zip(retries, retries[1:-1]))
+    assert retries[-1] == constants.refresh_max_interval
+
+    # A successful refresh ends the backoff
+    assert planner.due([track_params], now=now) == [track_params]
+    planner.record([UpdateResult(track_params=track_params, new_sessions=1, published=True)], 10, now=now)
+    assert planner.next_refresh(track_params) == now + constants.refresh_min_interval
+
+class BlockingRunner:
+    """
+    Runner recording its calls. Each call waits until released
+    """
+    def __init__(self) -> None:
+        self.calls = []
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def __call__(self, track_params, **options):
+        self.calls.append((track_params, options))
+        self.started.release()
+        assert self.release.wait(10)
+        if options.get("fail"):
+            raise RuntimeError("Update failed")
+        return [f"{track}-{condition}-{season}" for track, condition, season in track_params]
+
+def test_waiting_updates_are_coalesced():
+    runner = BlockingRunner()
+    scheduler = pj_scheduler.UpdateScheduler(max_workers=1, max_pending=2, runner=runner)
+    zandvoort, monza, spa = [(track, 0, 5) for track in ("zandvoort", "monza", "spa")]
+    with contextlib.redirect_stdout(io.StringIO()):
+        running = scheduler.submit([zandvoort])
+        assert runner.started.acquire(timeout=10)
+        # Waits behind the running update of the same leaderboard, the second one joins it
+        waiting = scheduler.submit([zandvoort])
+        assert scheduler.submit([zandvoort]) is waiting
+        # An update of a set absorbs the waiting update it covers, later single updates join the set
+        both = scheduler.submit([monza, zandvoort])
+        assert scheduler.submit([monza]) is both
+        other_options = scheduler.submit([spa], pages=1)
+        assert scheduler.submit([spa]) is None
+        assert scheduler.queue_depth() == 2
+        runner.release.set()
+        assert running.result(10) == ["zandvoort-0-5"]
+        assert waiting.result(10) == both.result(10) == ["monza-0-5", "zandvoort-0-5"]
+        assert other_options.result(10) == ["spa-0-5"]
+    assert runner.calls == [([zandvoort], {}), ([monza, zandvoort], {}), ([spa], {"pages": 1})]
+    # Two joined submissions and the two absorbed with the waiting update
+    assert scheduler.coalesced == 4
+    scheduler.shutdown()
+
+def test_failed_update_fails_every_joined_submission():
+    runner = BlockingRunner()
+    scheduler = pj_scheduler.UpdateScheduler(max_workers=2, max_pending=2, runner=runner)
+    zandvoort = ("zandvoort", 0, 5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        running = scheduler.submit([zandvoort], fail=True)
+        assert runner.started.acquire(timeout=10)
+        waiting = scheduler.submit([zandvoort], fail=True)
+        assert scheduler.submit([zandvoort], fail=True) is waiting
+        runner.release.set()
+        for future in (running, waiting):
+            with pytest.raises(RuntimeError):
+                future.result(10)
+    assert len(runner.calls) == 2
+    scheduler.shutdown()
+    assert scheduler.submit([zandvoort]) is None
@@ -0,0 +1,64 @@
+import contextlib
+import io
+import json
+import constants
+import pj_upload
+from conftest import synthetic_leaderboard
+from pj_leaderboard_backend import Condition, api_headers, post_leaderboards, post_rows
+
+
+# A leaderboard of 300 entries is about 60 KiB of json, 10 KiB compressed.
+# Single leaderboards fit under MAX_BODY_BYTES. Batches only fit under MAX_BATCH_BODY_BYTES compressed
+MAX_BODY_BYTES = 96*1024
+MAX_BATCH_BODY_BYTES = 48*1024
+
+
+def leaderboards() -> list:
+    return [synthetic_leaderboard(track, 300, seed=i) for i, track in enumerate(list(constants.pretty_name_raw_name)[:5])]
+
+def batch_body(encoded:list[bytes]) -> bytes:
+    return b'{"items": [' + b", ".join(encoded) + b']}'
+
+def test_batches_are_gzip_compressed_and_split(hotlap_server):
+    server = hotlap_server(max_body_bytes=MAX_BATCH_BODY_BYTES)
+    items = [pj_upload.BatchItem(endpoint="update", payload=leaderboard.to_post_json()) for leaderboard in leaderboards()]
+    encoded = [json.dumps({"endpoint": item.endpoint, "payload": item.payload}).encode("utf-8") for item in items]
+    # Two items fit under max_bytes, three don't
+    uploader = pj_upload.BatchUploader(max_items=16, max_bytes=2*max(map(len, encoded)), compress_level=constants.post_gzip_level)
+    batches = uploader.batches(encoded)
+    assert batches == [[0, 1], [2, 3], [4]]
+    assert pj_upload.BatchUploader(max_items=3, max_bytes=uploader.max_bytes*4, compress_level=1).batches(encoded) == [[0, 1, 2], [3, 4]]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        statuses = uploader.post(items, api_headers())
+    assert statuses == [200]*len(items)
+    assert [(post.path, post.items, post.status) for post in server.posts] == [("/api/hotlap/update_batch", len(batch), 200) for batch in batches]
+    for post, batch in zip(server.posts, batches):
+        assert post.decoded_size == len(batch_body([encoded[i] for i in batch]))
+        # The uncompressed batch wouldn't be accepted
+        assert post.size <= MAX_BATCH_BODY_BYTES < post.decoded_size
+    for item in items:
+        assert server.boards[(item.payload["track"]["name"], 0)]["rows"] == item.payload["drivers"]
+
+def test_no_batch_endpoint_posts_one_by_one(hotlap_server, monkeypatch):
+    server = hotlap_server(batch=False, max_body_bytes=MAX_BODY_BYTES)
+    uploader = pj_upload.BatchUploader(max_items=16, max_bytes=constants.post_batch_max_bytes, compress_level=constants.post_gzip_level)
+    monkeypatch.setattr(pj_upload, "uploader", uploader)
+    boards = leaderboards()
+    with contextlib.redirect_stdout(io.StringIO()):
+        posted = post_leaderboards(boards)
+    assert all(posted)
+    assert not uploader.supported
+    batch_post, *posts = server.posts
+    assert (batch_post.path, batch_post.status) == ("/api/hotlap/update_batch", 404)
+    assert batch_post.size <= MAX_BODY_BYTES < batch_post.decoded_size
+    assert [(post.path, post.status) for post in posts] == [("/api/hotlap/update", 200)]*len(boards)
+    # Posted alone, each leaderboard is sent uncompressed
+    assert all(post.size == post.decoded_size <= MAX_BODY_BYTES for post in posts)
+    for leaderboard in boards:
+        assert server.boards[(leaderboard.track_raw, int(Condition.DRY))]["rows"] == post_rows(leaderboard.entry_list)
+
+    # The batch endpoint isn't tried again
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert all(post_leaderboards(boards))
+    assert [post.path for post in server.posts[len(boards) + 1:]] == ["/api/hotlap/update"]*len(boards)